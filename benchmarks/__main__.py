@@ -0,0 +1,62 @@
+import argparse
+import sys
+from benchmarks.corpus import generate_corpus
+from benchmarks.scenarios import (DEFAULT_CANVAS_SIZES, REGRESSION_THRESHOLD, run_benchmarks, save_results,
+                                  load_results, compare_results)
+
+
+def _canvas_size(text):
+    width, _, height = text.partition('x')
+    return int(width), int(height)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description="Photo grid performance benchmarks.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    corpus = commands.add_parser('corpus', help="write a synthetic photo corpus")
+    corpus.add_argument('folder')
+    corpus.add_argument('--count', type=int, default=200)
+    corpus.add_argument('--seed', type=int, default=0)
+    corpus.add_argument('--square-fraction', type=float, default=0.05)
+    corpus.add_argument('--broken-fraction', type=float, default=0.02)
+    corpus.add_argument('--landscape-fraction', type=float, default=0.6)
+
+    run = commands.add_parser('run', help="time the scenarios against a corpus")
+    run.add_argument('folder')
+    run.add_argument('--output', default='bench_results.json', help="JSON results file")
+    run.add_argument('--repeat', type=int, default=3)
+    run.add_argument('--canvas', type=_canvas_size, action='append',
+                     help="canvas size as WIDTHxHEIGHT; repeat for several (default: 1080p, 4K and 8K)")
+    run.add_argument('--only', action='append', help="run only this scenario; may be repeated")
+
+    compare = commands.add_parser('compare', help="flag regressions between two result files")
+    compare.add_argument('baseline')
+    compare.add_argument('current')
+    compare.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                         help="slowdown ratio above which a scenario is flagged (default: 0.10)")
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'corpus':
+        counts = generate_corpus(args.folder, args.count, landscape_fraction=args.landscape_fraction,
+                                 square_fraction=args.square_fraction, broken_fraction=args.broken_fraction,
+                                 seed=args.seed)
+        print(', '.join(f"{count} {kind}" for kind, count in counts.items()))
+        return 0
+
+    if args.command == 'run':
+        results = run_benchmarks(args.folder, tuple(args.canvas or DEFAULT_CANVAS_SIZES), args.repeat, args.only)
+        save_results(results, args.output)
+        print(f"Results written to {args.output}")
+        return 0
+
+    rows = compare_results(load_results(args.baseline), load_results(args.current), args.threshold)
+    for name, old_time, new_time, ratio, regressed in rows:
+        flag = "REGRESSION" if regressed else ""
+        print(f"{name:24} {old_time * 1000:10.1f} ms -> {new_time * 1000:10.1f} ms  x{ratio:5.2f}  {flag}")
+    return 1 if any(row[4] for row in rows) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,81 @@
+import os
+import random
+from PIL import Image
+
+# (long side, short side) of the generated photos
+DEFAULT_SIZES = ((1600, 1200), (3000, 2000), (4032, 3024))
+DEFAULT_ORIENTATIONS = (1, 3, 6, 8)
+
+
+def _synthetic_photo(width, height, rng):
+    """
+    Draws a photo-like RGB image: smooth gradients with a few flat blocks and
+    some noise, so it compresses and decodes roughly like a real JPEG.
+    """
+    gradient = Image.linear_gradient('L')
+    red = gradient.resize((width, height))
+    green = gradient.rotate(90).resize((width, height))
+    blue = Image.effect_noise((max(1, width // 8), max(1, height // 8)), 48).resize((width, height))
+    image = Image.merge('RGB', (red, green, blue))
+    for _ in range(6):
+        x0, y0 = rng.randrange(width), rng.randrange(height)
+        x1, y1 = min(width, x0 + rng.randrange(1, width // 3 + 2)), min(height, y0 + rng.randrange(1, height // 3 + 2))
+        color = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+        image.paste(color, (x0, y0, x1, y1))
+    return image
+
+
+def generate_corpus(folder, count, sizes=DEFAULT_SIZES, landscape_fraction=0.6, orientations=DEFAULT_ORIENTATIONS,
+                    square_fraction=0.05, broken_fraction=0.02, quality=90, seed=0):
+    """
+    Writes a folder of synthetic JPEGs for benchmarking.
+
+    Every photo's displayed shape is chosen first and then stored rotated to
+    match its EXIF orientation, as a camera would. Square photos are skipped by
+    the scanner and broken files (random bytes with a .jpg name) are reported
+    as unreadable, so both exercise the same paths real folders do.
+
+    Args:
+        folder (str): Output directory; created if needed.
+        count (int): Number of files to write.
+        sizes (tuple): (long side, short side) pairs to pick from.
+        landscape_fraction (float): Share of landscape photos among the others.
+        orientations (tuple): EXIF orientations to pick from.
+        square_fraction (float): Share of square photos.
+        broken_fraction (float): Share of unreadable files.
+        quality (int): JPEG quality.
+        seed (int): Seed of the random choices; the same seed gives the same corpus.
+
+    Returns:
+        dict: Counts of 'landscape', 'portrait', 'square' and 'broken' files.
+    """
+    os.makedirs(folder, exist_ok=True)
+    rng = random.Random(seed)
+    counts = {'landscape': 0, 'portrait': 0, 'square': 0, 'broken': 0}
+
+    for i in range(count):
+        path = os.path.join(folder, f"synthetic_{i:05d}.jpg")
+        roll = rng.random()
+        if roll < broken_fraction:
+            with open(path, 'wb') as f:
+                f.write(bytes(rng.randrange(256) for _ in range(512)))
+            counts['broken'] += 1
+            continue
+
+        long_side, short_side = rng.choice(sizes)
+        if roll < broken_fraction + square_fraction:
+            kind, width, height = 'square', short_side, short_side
+        elif rng.random() < landscape_fraction:
+            kind, width, height = 'landscape', long_side, short_side
+        else:
+            kind, width, height = 'portrait', short_side, long_side
+
+        orientation = rng.choice(orientations)
+        if orientation >= 5:
+            width, height = height, width  # Stored sideways, displayed upright
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        _synthetic_photo(width, height, rng).save(path, quality=quality, exif=exif)
+        counts[kind] += 1
+
+    return counts
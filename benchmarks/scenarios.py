@@ -0,0 +1,263 @@
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from photogrid.image_utils import ImageInfo, analyze_images
+from photogrid.layout import build_rows, justify_row
+from photogrid.engine import LayoutSearch, search_layout, search_shuffles, size_images, save_collage
+from photogrid.render import render_preview
+
+DEFAULT_CANVAS_SIZES = ((1920, 1080), (3840, 2160), (7680, 4320))
+PREVIEW_BOX = (800, 600)
+MIN_SPACE = 10
+MAX_SPACE = 50
+SHUFFLES = 32
+REGRESSION_THRESHOLD = 0.10
+# What a fresh process imports to scan and lay out, and to render as well
+CORE_MODULES = ('photogrid.engine', 'photogrid.index')
+RENDER_MODULES = CORE_MODULES + ('photogrid.render',)
+
+
+def _scanned_images(folder):
+    h, v = analyze_images(folder)
+    images = h + v
+    random.Random(0).shuffle(images)
+    return images
+
+
+def _synthetic_infos(count):
+    """
+    Returns ImageInfo records with a realistic aspect mix, for search scenarios
+    larger than the corpus on disk.
+    """
+    rng = random.Random(0)
+    infos = []
+    for i in range(count):
+        width, height = rng.choice(((4032, 3024), (3000, 2000), (3024, 4032), (2000, 3000)))
+        infos.append(ImageInfo(f"synthetic_{i}.jpg", width, height, width / height))
+    return infos
+
+
+def _layout(images, canvas):
+    return search_layout(images, canvas[0], canvas[1], MIN_SPACE, MAX_SPACE, False)
+
+
+# Each scenario is a (setup, run) pair. setup(folder, canvas) runs untimed and
+# returns the arguments of run, which returns the number of images it handled.
+
+def _setup_folder(folder, canvas):
+    return (folder,)
+
+
+def _run_scan_header(folder):
+    h, v = analyze_images(folder)
+    return len(h) + len(v)
+
+
+def _run_scan_decode(folder):
+    h, v = analyze_images(folder, header_only=False)
+    return len(h) + len(v)
+
+
+def _setup_core_imports(folder, canvas):
+    return (CORE_MODULES,)
+
+
+def _setup_render_imports(folder, canvas):
+    return (RENDER_MODULES,)
+
+
+def _run_imports(modules):
+    subprocess.run([sys.executable, '-c', f"import {', '.join(modules)}"], check=True)
+    return 1
+
+
+def _setup_search(folder, canvas):
+    return _scanned_images(folder), canvas
+
+
+def _setup_search_10k(folder, canvas):
+    return _synthetic_infos(10000), canvas
+
+
+def _setup_search_50k(folder, canvas):
+    return _synthetic_infos(50000), canvas
+
+
+def _run_search_greedy(images, canvas):
+    _layout(images, canvas)
+    return len(images)
+
+
+def _run_search_justified(images, canvas):
+    search_layout(images, canvas[0], canvas[1], MIN_SPACE, MAX_SPACE, False, mode='justified')
+    return len(images)
+
+
+def _run_search_shuffles(images, canvas):
+    search_shuffles(images, canvas[0], canvas[1], MIN_SPACE, MAX_SPACE, False, seed=0, time_budget=None,
+                    max_shuffles=SHUFFLES)
+    return SHUFFLES
+
+
+def _setup_rows(folder, canvas):
+    images = _synthetic_infos(10000)
+    search = LayoutSearch(images, canvas[0], canvas[1], MIN_SPACE, False)
+    sized_images = size_images(images, float(search.scales[search.best_index()]), canvas[0], canvas[1], False)
+    return sized_images, canvas
+
+
+def _run_rows(sized_images, canvas):
+    for row in build_rows(sized_images, canvas[0], MIN_SPACE):
+        justify_row(row, canvas[0], MIN_SPACE, MAX_SPACE)
+    return len(sized_images)
+
+
+def _setup_render(folder, canvas):
+    images = _scanned_images(folder)
+    return _layout(images, canvas), canvas
+
+
+def _run_preview(layout, canvas):
+    render_preview(layout, canvas, PREVIEW_BOX)
+    return len(layout)
+
+
+def _run_save(layout, canvas):
+    output_dir = tempfile.mkdtemp(prefix='photogrid-bench-')
+    try:
+        save_collage(layout, os.path.join(output_dir, 'collage.jpg'), canvas, workers=None)
+    finally:
+        shutil.rmtree(output_dir)
+    return len(layout)
+
+
+def scenario_table(canvas_sizes=DEFAULT_CANVAS_SIZES):
+    """
+    Returns the benchmark scenarios as {name: (setup, run, canvas)}.
+    """
+    first = canvas_sizes[0]
+    scenarios = {
+        'import_core': (_setup_core_imports, _run_imports, first),
+        'import_render': (_setup_render_imports, _run_imports, first),
+        'scan_header': (_setup_folder, _run_scan_header, first),
+        'scan_decode': (_setup_folder, _run_scan_decode, first),
+        'search_greedy': (_setup_search, _run_search_greedy, first),
+        'search_justified': (_setup_search, _run_search_justified, first),
+        'search_greedy_10k': (_setup_search_10k, _run_search_greedy, first),
+        'search_justified_10k': (_setup_search_10k, _run_search_justified, first),
+        'search_justified_50k': (_setup_search_50k, _run_search_justified, first),
+        'search_shuffles': (_setup_search, _run_search_shuffles, first),
+        'rows_10k': (_setup_rows, _run_rows, first),
+        'preview': (_setup_render, _run_preview, first),
+    }
+    for canvas in canvas_sizes:
+        scenarios[f'save_{canvas[0]}x{canvas[1]}'] = (_setup_render, _run_save, canvas)
+    return scenarios
+
+
+def _peak_rss_kb():
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if sys.platform == 'darwin':  # Reported in bytes there
+        own, children = own // 1024, children // 1024
+    return max(own, children)
+
+
+def _measure(setup, run, folder, canvas, repeat):
+    args = setup(folder, canvas)
+    wall_times = []
+    items = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        items = run(*args)
+        wall_times.append(time.perf_counter() - start)
+    return {'wall_times': wall_times, 'items': items, 'peak_rss_kb': _peak_rss_kb()}
+
+
+def run_scenario(setup, run, folder, canvas, repeat=3):
+    """
+    Times one scenario in a fresh process, so its peak RSS is its own.
+
+    Returns:
+        dict: 'wall_time' (the best of `repeat` runs), 'wall_times', 'items',
+              'items_per_sec' and 'peak_rss_kb'.
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        result = executor.submit(_measure, setup, run, folder, canvas, repeat).result()
+
+    wall_time = min(result['wall_times'])
+    result['wall_time'] = wall_time
+    result['items_per_sec'] = result['items'] / wall_time if wall_time > 0 else 0.0
+    return result
+
+
+def run_benchmarks(folder, canvas_sizes=DEFAULT_CANVAS_SIZES, repeat=3, only=None, report=print):
+    """
+    Runs the benchmark scenarios against a corpus folder.
+
+    Args:
+        folder (str): A folder of photos, e.g. from generate_corpus.
+        canvas_sizes (tuple): Canvas sizes; the first is used by all but the save scenarios.
+        repeat (int): Timed runs per scenario.
+        only (list): Names of the scenarios to run; None runs them all.
+        report (callable): Called with one line per finished scenario.
+
+    Returns:
+        dict: The run's metadata and per-scenario results, ready for JSON.
+    """
+    results = {}
+    for name, (setup, run, canvas) in scenario_table(canvas_sizes).items():
+        if only and name not in only:
+            continue
+        result = run_scenario(setup, run, folder, canvas, repeat)
+        results[name] = result
+        report(f"{name:24} {result['wall_time'] * 1000:10.1f} ms {result['items_per_sec']:12.1f} img/s "
+               f"{result['peak_rss_kb'] / 1024:8.1f} MB")
+
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'folder': os.path.abspath(folder),
+        'repeat': repeat,
+        'scenarios': results,
+    }
+
+
+def save_results(results, path):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare_results(baseline, current, threshold=REGRESSION_THRESHOLD):
+    """
+    Compares the wall times of the scenarios two runs have in common.
+
+    Returns:
+        list: (name, baseline_time, current_time, ratio, regressed) tuples, where
+              regressed means current is more than `threshold` slower.
+    """
+    rows = []
+    for name, result in current['scenarios'].items():
+        if name not in baseline['scenarios']:
+            continue
+        old_time = baseline['scenarios'][name]['wall_time']
+        new_time = result['wall_time']
+        ratio = new_time / old_time if old_time > 0 else float('inf')
+        rows.append((name, old_time, new_time, ratio, ratio > 1 + threshold))
+    return rows
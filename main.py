@@ -2,9 +2,25 @@ import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, colorchooser
 import os
 import random
-from PIL import Image, ImageTk, ImageOps
-from photogrid.image_utils import analyze_images, crop_to_aspect_ratio
-from photogrid.layout import calculate_target_sizes, build_rows, justify_row
+import time
+from PIL import ImageTk
+from photogrid.image_utils import split_by_orientation
+from photogrid.index import INDEX_FILENAME, scan_images_cached
+from photogrid.crop import CROP_MODES
+from photogrid.dedup import dedupe_images
+from photogrid.engine import layout_coverage, search_shuffles, COVERAGE_GOAL, LAYOUT_MODES
+from photogrid.export import web_renditions
+from photogrid.layout_cache import LayoutCache
+from photogrid.session import CollageSession
+from photogrid.tile_cache import TileCache, default_cache_dir
+from photogrid.timing import recording
+from photogrid.worker import BackgroundWorker
+
+# Seconds spent trying shuffles when "Search shuffles" is on
+SHUFFLE_SEARCH_SECONDS = 2.0
+
+# Seconds between updates of the image count while a folder is scanned
+SCAN_REPORT_SECONDS = 0.1
 
 class PhotoGridApp(tk.Tk):
     def __init__(self):
@@ -17,8 +33,18 @@ class PhotoGridApp(tk.Tk):
         self.folder_path = None
         self.all_images = []
         self.layout = None
+        self.layout_seed = None  # The seed entry's text when the shown layout was requested
+        self.applied_parameters = None  # The parameters of the last layout requested
+        self.writing = None  # What the running save or export job is doing, e.g. "Saving the image"
+        self.relayout_pending = False  # Parameters changed while a save or export was running
         self.preview_image = None
         self.background_color = 'white'  # Default background color
+        self.render_workers = None  # Processes used to render saved images; None uses every core
+        self.worker = BackgroundWorker()
+        self.tile_cache = TileCache(cache_dir=default_cache_dir())  # Shared by preview and save
+        self.progressive_preview = True  # Show placeholder and draft passes before the final preview
+        # Recomputes only what a parameter change affects; seeded layouts are kept across runs
+        self.session = CollageSession(cache=self.tile_cache, layout_cache=LayoutCache(cache_dir=default_cache_dir('layouts')))
 
         # --- Main Layout ---
         main_frame = ttk.Frame(self)
@@ -36,6 +62,9 @@ class PhotoGridApp(tk.Tk):
         ttk.Button(folder_frame, text="Select Image Folder...", command=self.select_folder).pack(fill=tk.X)
         self.folder_label = ttk.Label(folder_frame, text="No folder selected", wraplength=180)
         self.folder_label.pack(fill=tk.X, pady=(5,0))
+        self.dedupe_var = tk.BooleanVar()
+        ttk.Checkbutton(folder_frame, text="Skip near-duplicates", variable=self.dedupe_var,
+                        command=self._rescan_folder).pack(anchor="w", pady=(5,0))
 
         # Dimensions
         dims_frame = ttk.LabelFrame(controls_frame, text="Output Size")
@@ -48,6 +77,8 @@ class PhotoGridApp(tk.Tk):
         self.height_entry = ttk.Entry(dims_frame, width=8)
         self.height_entry.grid(row=1, column=1, padx=5)
         self.height_entry.insert(0, "1080")
+        self._bind_parameter_entry(self.width_entry)
+        self._bind_parameter_entry(self.height_entry)
 
         # Spacing
         space_frame = ttk.LabelFrame(controls_frame, text="Spacing (px)")
@@ -60,13 +91,37 @@ class PhotoGridApp(tk.Tk):
         self.max_space_entry = ttk.Entry(space_frame, width=6)
         self.max_space_entry.grid(row=1, column=1, padx=5)
         self.max_space_entry.insert(0, "50")
+        self._bind_parameter_entry(self.min_space_entry)
+        self._bind_parameter_entry(self.max_space_entry)
 
         # Cropping Option
         crop_frame = ttk.LabelFrame(controls_frame, text="Cropping")
         crop_frame.pack(fill=tk.X, padx=5, pady=5)
         self.crop_var = tk.BooleanVar()
-        self.crop_check = ttk.Checkbutton(crop_frame, text="Enable Smart Cropping", variable=self.crop_var)
+        self.crop_check = ttk.Checkbutton(crop_frame, text="Enable Smart Cropping", variable=self.crop_var, command=self.apply_parameters)
         self.crop_check.pack(padx=5, pady=2, anchor="w")
+        self.crop_mode_var = tk.StringVar(value=CROP_MODES[0])
+        crop_mode_box = ttk.Combobox(crop_frame, textvariable=self.crop_mode_var, values=CROP_MODES, state="readonly", width=12)
+        crop_mode_box.pack(padx=5, pady=2, anchor="w")
+        crop_mode_box.bind("<<ComboboxSelected>>", lambda event: self.apply_parameters())
+
+        # Layout Mode
+        mode_frame = ttk.LabelFrame(controls_frame, text="Layout Mode")
+        mode_frame.pack(fill=tk.X, padx=5, pady=5)
+        self.mode_var = tk.StringVar(value=LAYOUT_MODES[0])
+        mode_box = ttk.Combobox(mode_frame, textvariable=self.mode_var, values=LAYOUT_MODES, state="readonly", width=12)
+        mode_box.pack(padx=5, pady=2, anchor="w")
+        mode_box.bind("<<ComboboxSelected>>", lambda event: self.apply_parameters())
+
+        # Seed
+        seed_frame = ttk.LabelFrame(controls_frame, text="Seed")
+        seed_frame.pack(fill=tk.X, padx=5, pady=5)
+        self.seed_entry = ttk.Entry(seed_frame, width=12)
+        self.seed_entry.pack(padx=5, pady=2, anchor="w")
+        self._bind_parameter_entry(self.seed_entry)
+        self.search_shuffles_var = tk.BooleanVar()
+        ttk.Checkbutton(seed_frame, text=f"Search shuffles ({SHUFFLE_SEARCH_SECONDS:g} s)",
+                        variable=self.search_shuffles_var).pack(padx=5, pady=2, anchor="w")
 
         # Background Color
         color_frame = ttk.LabelFrame(controls_frame, text="Background Color")
@@ -95,6 +150,14 @@ class PhotoGridApp(tk.Tk):
         self.generate_button.pack(fill=tk.X)
         self.save_button = ttk.Button(action_frame, text="Save Image...", state="disabled", command=self.save_image)
         self.save_button.pack(fill=tk.X, pady=(5,0))
+        self.export_button = ttk.Button(action_frame, text="Export Web Set...", state="disabled", command=self.export_web_set)
+        self.export_button.pack(fill=tk.X, pady=(5,0))
+        self.progress_bar = ttk.Progressbar(action_frame, mode="determinate", maximum=1.0)
+        self.progress_bar.pack(fill=tk.X, pady=(10,0))
+        self.status_label = ttk.Label(action_frame, text="", wraplength=180)
+        self.status_label.pack(fill=tk.X, pady=(5,0))
+        self.timing_label = ttk.Label(action_frame, text="", wraplength=180, foreground="gray")
+        self.timing_label.pack(fill=tk.X, pady=(5,0))
 
         # --- Preview Frame ---
         self.preview_frame = ttk.LabelFrame(main_frame, text="Preview")
@@ -105,144 +168,234 @@ class PhotoGridApp(tk.Tk):
         self.preview_label = ttk.Label(self.preview_frame, text="Select a folder and click 'Generate' to see a preview.")
         self.preview_label.grid(row=0, column=0, sticky="nsew")
 
+        self.after(50, self._poll_worker)
+
+    def _bind_parameter_entry(self, entry):
+        entry.bind("<Return>", lambda event: self.apply_parameters())
+        entry.bind("<FocusOut>", lambda event: self.apply_parameters())
+
+    def _poll_worker(self):
+        self.worker.poll()
+        self.after(50, self._poll_worker)
+
+    def _submit_timed(self, fn, *args, on_done=None, writing=None, **callbacks):
+        """
+        Submits a job to the worker and shows the time it spent per stage once it is done.
+
+        The new job cancels the running one. A save or export job is named by
+        writing, so a cancelled one can be reported in the status label.
+        """
+        cancelled = self.writing if self.worker.busy else None
+        self.writing = writing
+        self.relayout_pending = False
+
+        def run(job, *args):
+            with recording() as timings:
+                result = fn(job, *args)
+            return result, timings
+
+        def done(payload):
+            result, timings = payload
+            self.timing_label.config(text=timings.summary())
+            if on_done is not None:
+                on_done(result)
+
+        job = self.worker.submit(run, *args, on_done=done, **callbacks)
+        if cancelled is not None:
+            self.status_label.config(text=f"{cancelled} was cancelled. {self.status_label.cget('text')}")
+        return job
+
+    def _set_status(self, message, fraction=0.0):
+        self.status_label.config(text=message)
+        self.progress_bar.config(value=fraction)
+
+    def _on_progress(self, done, total, message):
+        self._set_status(message or "", done / total if total else 0.0)
+
+    def _on_job_error(self, title, error):
+        self._set_status("")
+        messagebox.showerror(title, f"{title}.\nError: {error}")
+
     def select_folder(self):
         path = filedialog.askdirectory(initialdir=os.path.expanduser("~"))
         if not path:
             return
 
         self.folder_path = path
-        h, v = analyze_images(self.folder_path)
+        self._rescan_folder()
+
+    def _rescan_folder(self):
+        if self.folder_path is None:
+            return
+        self.generate_button.config(state="disabled")
+        self._set_status("Scanning folder...")
+        self._submit_timed(self._scan_folder, self.folder_path, self.dedupe_var.get(),
+                           on_done=self._on_folder_scanned,
+                           on_partial=self._on_scan_partial,
+                           on_error=lambda e: self._on_job_error("Could not scan the folder", e))
+
+    def _scan_folder(self, job, folder, dedupe):
+        """
+        Scans a folder and its subfolders on the worker, posting the running image
+        count, and leaves out near-duplicates if dedupe is set.
+
+        Returns:
+            tuple: (horizontal, vertical, number of near-duplicates left out)
+        """
+        images = []
+        reported = time.monotonic()
+        for info in scan_images_cached(folder, recursive=True):
+            images.append(info)
+            if time.monotonic() - reported > SCAN_REPORT_SECONDS:
+                job.report_partial(len(images))
+                reported = time.monotonic()
+        found = len(images)
+        if dedupe:
+            images = dedupe_images(images, index_path=os.path.join(folder, INDEX_FILENAME))
+        return (*split_by_orientation(images), found - len(images))
+
+    def _on_scan_partial(self, count):
+        self.folder_label.config(text=f"Scanning: {os.path.basename(self.folder_path)}\n({count} images found so far)")
+
+    def _on_folder_scanned(self, result):
+        h, v, skipped = result
         self.all_images = h + v
+        self.layout = None
+        self._set_status("")
 
         total_images = len(self.all_images)
-        self.folder_label.config(text=f"Selected: {os.path.basename(self.folder_path)}\n({total_images} images found)")
+        found = f"{total_images} images found, {skipped} near-duplicates skipped" if skipped else f"{total_images} images found"
+        self.folder_label.config(text=f"Selected: {os.path.basename(self.folder_path)}\n({found})")
 
         if total_images > 0:
             self.generate_button.config(state="normal")
         else:
             self.generate_button.config(state="disabled")
-            messagebox.showinfo("No Images Found", "Could not find any compatible (horizontal/vertical) JPEG images in the selected folder.")
+            messagebox.showinfo("No Images Found", "Could not find any compatible (horizontal/vertical) images in the selected folder.")
 
     def choose_background_color(self):
         color = colorchooser.askcolor(color=self.background_color, title="Choose Background Color")
         if color[1]:  # color[1] is the hex string
             self.background_color = color[1]
             self.color_preview.config(bg=self.background_color)
+            self.apply_parameters()
 
-    def generate_layout(self):
+    def _collage_parameters(self, quiet=False):
+        """
+        Returns the collage parameters set in the controls, or None if they are
+        invalid, which the user is told about unless quiet is set.
+        """
         try:
             output_w = int(self.width_entry.get())
             output_h = int(self.height_entry.get())
             min_space = int(self.min_space_entry.get())
             max_space = int(self.max_space_entry.get())
-            is_cropping = self.crop_var.get()
+            seed = int(self.seed_entry.get()) if self.seed_entry.get().strip() else None
         except ValueError:
-            messagebox.showerror("Invalid Input", "Please enter valid integers for dimensions and spacing.")
-            return
+            if not quiet:
+                messagebox.showerror("Invalid Input", "Please enter valid integers for dimensions, spacing and seed.")
+            return None
+        return {'images': self.all_images, 'seed': seed, 'output_size': (output_w, output_h),
+                'min_space': min_space, 'max_space': max_space, 'is_cropping': self.crop_var.get(),
+                'crop_mode': self.crop_mode_var.get(), 'mode': self.mode_var.get(),
+                'background_color': self.background_color,
+                'index_path': os.path.join(self.folder_path, INDEX_FILENAME) if self.folder_path else None}
 
+    def generate_layout(self):
         num_images = len(self.all_images)
         if num_images == 0:
             messagebox.showinfo("No Images", "No images to generate a layout from.")
             return
 
-        random.shuffle(self.all_images)
-
-        best_layout = None
-        max_score = -float('inf')
-
-        # New, smarter target scale calculation
-        canvas_aspect_ratio = output_w / output_h
-        avg_aspect_ratio = sum(img.aspect_ratio for img in self.all_images) / num_images if num_images > 0 else 1
-        
-        # Estimate num columns to guess a width-constrained size
-        est_cols = (num_images * canvas_aspect_ratio / avg_aspect_ratio) ** 0.5
-        est_cols = max(1, round(est_cols))
-        
-        # Estimate a target width based on this
-        target_w = (output_w - (est_cols - 1) * min_space) / est_cols
-        target_h = target_w / avg_aspect_ratio
-        target_area = target_w * target_h
-        target_scale = max(1, target_area ** 0.5)
-        
-        for i in range(50):
-            scale = target_scale * (0.5 + (i / 49.0) * 2.5)
-            if scale == 0: continue
-
-            if is_cropping:
-                target_aspect_ratio = output_w / output_h
-                img_h = scale
-                img_w = scale * target_aspect_ratio
-                sized_images = [{'path': img.path, 'width': img_w, 'height': img_h} for img in self.all_images]
-            else:
-                h_imgs = [img for img in self.all_images if img.aspect_ratio > 1]
-                v_imgs = [img for img in self.all_images if img.aspect_ratio < 1]
-                sizer = calculate_target_sizes(h_imgs, v_imgs)
-                w_h, h_h, w_v, h_v = sizer(scale)
-                sized_images = []
-                for img_info in self.all_images:
-                    if img_info.aspect_ratio > 1: # Horizontal
-                        sized_images.append({'path': img_info.path, 'width': w_h, 'height': h_h})
-                    else: # Vertical
-                        sized_images.append({'path': img_info.path, 'width': w_v, 'height': h_v})
-
-            rows_of_images = build_rows(sized_images, output_w, min_space)
-            layout_w, layout_h, total_photo_area = self._calculate_layout_metrics(rows_of_images, min_space)
-
-            if layout_w > output_w or layout_h > output_h:
-                final_score = -1
-            else:
-                coverage_score = total_photo_area / (output_w * output_h)
-                canvas_aspect_ratio = output_w / output_h
-                layout_aspect_ratio = layout_w / layout_h if layout_h > 0 else 0
-                balance_penalty = abs(canvas_aspect_ratio - layout_aspect_ratio) / canvas_aspect_ratio
-                final_score = coverage_score - balance_penalty
-
-            if final_score > max_score:
-                max_score = final_score
-                best_layout = self._construct_layout(rows_of_images, output_w, min_space, max_space)
-
+        # Each shuffle gets a fresh seed, shown so the layout can be reproduced by
+        # entering it again; a seed typed in since the last layout is used as is.
+        typed_seed = self.seed_entry.get().strip()
+        if not typed_seed or typed_seed == self.layout_seed:
+            self._set_seed(random.randrange(2 ** 32))
+        self._relayout(announce=True, many_shuffles=self.search_shuffles_var.get())
+
+    def _set_seed(self, seed):
+        self.seed_entry.delete(0, tk.END)
+        self.seed_entry.insert(0, str(seed))
+
+    def apply_parameters(self):
+        """
+        Brings the shown layout up to date with the controls, keeping its shuffle.
+        Only the stages affected by the changed controls are recomputed, and
+        nothing is done if the controls did not change.
+
+        A running save or export is never cancelled for this: the layout is
+        brought up to date once it finishes.
+        """
+        if self.layout is None:
+            return
+        parameters = self._collage_parameters(quiet=True)
+        if parameters is None or parameters == self.applied_parameters:
+            return
+        if self.writing is not None:
+            self.relayout_pending = True
+            return
+        self._relayout(announce=False)
+
+    def _finish_writing(self):
+        """
+        Ends a save or export job and applies the edits made while it ran.
+        """
+        self.writing = None
+        if self.relayout_pending:
+            self.relayout_pending = False
+            self.apply_parameters()
+
+    def _relayout(self, announce, many_shuffles=False):
+        # Edits are applied as the user types and leaves fields, so half-typed values are ignored quietly.
+        parameters = self._collage_parameters(quiet=not announce)
+        if parameters is None:
+            return
+        output_w, output_h = parameters['output_size']
+        self.layout_seed = self.seed_entry.get().strip()
+        self.applied_parameters = parameters
+        self._set_status("Searching layouts...")
+        self._submit_timed(self._search_layout, parameters, many_shuffles,
+                           on_done=lambda result: self._on_layout_found(*result, output_w, output_h, announce),
+                           on_error=lambda e: self._on_job_error("Could not generate a layout", e),
+                           on_progress=self._on_progress)
+
+    def _search_layout(self, job, parameters, many_shuffles=False):
+        """
+        Updates the session on the worker thread and returns its layout. When
+        searching shuffles, the session is given the seed of the best one.
+        """
+        progress = lambda done, total: job.report_progress(done, total, "Searching layouts...")
+        if many_shuffles:
+            output_w, output_h = parameters['output_size']
+            result = search_shuffles(parameters['images'], output_w, output_h, parameters['min_space'],
+                                     parameters['max_space'], parameters['is_cropping'], parameters['seed'],
+                                     parameters['mode'], time_budget=SHUFFLE_SEARCH_SECONDS, progress=progress,
+                                     cache=self.session.layout_cache)
+            parameters = dict(parameters, seed=result.seed)
+        self.session.update(**parameters)
+        return self.session.layout(progress=progress), parameters['seed']
+
+    def _on_layout_found(self, best_layout, seed, output_w, output_h, announce=True):
         self.layout = best_layout
+        if seed is not None and str(seed) != self.layout_seed:
+            # A shuffle search picked another seed; show it so the layout can be reproduced
+            self._set_seed(seed)
+            self.layout_seed = str(seed)
+            self.applied_parameters = dict(self.applied_parameters, seed=seed)
         self._update_preview()
         self.save_button.config(state="normal")
+        self.export_button.config(state="normal")
         
-        final_photo_area = sum(img['width'] * img['height'] for img in best_layout) if best_layout else 0
-        final_coverage = final_photo_area / (output_w * output_h)
-        coverage_percent = final_coverage * 100
+        coverage_percent = layout_coverage(best_layout, output_w, output_h) * 100
+        if not announce:
+            return
 
-        if coverage_percent >= 80:
+        if coverage_percent >= COVERAGE_GOAL * 100:
             messagebox.showinfo("Layout Generated", f"Coverage: {coverage_percent:.1f}%\nGoal of 80% was met.")
         else:
             messagebox.showwarning("Layout Generated", f"Coverage: {coverage_percent:.1f}%\nCould not achieve 80% coverage with the current settings.")
 
-    def _calculate_layout_metrics(self, rows_of_images, min_space):
-        layout_w = 0
-        layout_h = 0
-        total_photo_area = 0
-        current_y = 0
-        for row in rows_of_images:
-            row_height = max(img['height'] for img in row)
-            row_width = sum(img['width'] for img in row) + (len(row) - 1) * min_space if len(row) > 1 else sum(img['width'] for img in row)
-            layout_w = max(layout_w, row_width)
-            layout_h = current_y + row_height
-            current_y += row_height + min_space
-            total_photo_area += sum(img['width'] * img['height'] for img in row)
-        return layout_w, layout_h, total_photo_area
-
-    def _construct_layout(self, rows_of_images, output_w, min_space, max_space):
-        final_layout = []
-        current_y = 0
-        for row in rows_of_images:
-            row_height = max(img['height'] for img in row)
-            justified_positions = justify_row(row, output_w, min_space, max_space)
-            for pos_info in justified_positions:
-                final_layout.append({
-                    'path': pos_info['image']['path'],
-                    'x': pos_info['x'], 'y': current_y,
-                    'width': pos_info['image']['width'], 'height': pos_info['image']['height']
-                })
-            current_y += row_height + min_space
-        return final_layout
-
     def _update_preview(self):
         if not self.layout:
             return
@@ -252,25 +405,39 @@ class PhotoGridApp(tk.Tk):
         preview_h = self.preview_frame.winfo_height()
         if preview_w < 2 or preview_h < 2: preview_w, preview_h = 800, 600
 
-        output_w = int(self.width_entry.get())
-        output_h = int(self.height_entry.get())
-        is_cropping = self.crop_var.get()
-        target_aspect_ratio = output_w / output_h
-
-        preview_img = Image.new('RGB', (output_w, output_h), self.background_color)
+        self._set_status("Rendering preview...")
+        self._submit_timed(self._render_preview, (preview_w - 20, preview_h - 20),
+                           on_done=self._show_preview,
+                           on_error=lambda e: self._on_job_error("Could not render the preview", e),
+                           on_progress=self._on_progress,
+                           on_partial=self._show_partial_preview)
+
+    def _render_preview(self, job, max_size):
+        if not self.progressive_preview:
+            progress = lambda done, total: job.report_progress(done, total, "Rendering preview...")
+            return self.session.preview(max_size, progress=progress)
+
+        messages = {'placeholder': "Loading preview...", 'draft': "Drafting preview...",
+                    'refine': "Refining preview..."}
+        canvas = None
+        for canvas, phase, done, total in self.session.preview_frames(max_size):
+            job.report_partial(canvas.copy())
+            job.report_progress(done, total, messages[phase])
+        return canvas
+
+    def _show_partial_preview(self, preview_img):
+        """
+        Swaps an intermediate preview into the displayed image.
+        """
+        if self.preview_image is not None and (self.preview_image.width(), self.preview_image.height()) == preview_img.size:
+            self.preview_image.paste(preview_img)
+        else:
+            self.preview_image = ImageTk.PhotoImage(preview_img)
+            self.preview_label.config(image=self.preview_image, text="")
 
-        for img_layout in self.layout:
-            with Image.open(img_layout['path']) as img:
-                img = ImageOps.exif_transpose(img)
-                if is_cropping:
-                    img = crop_to_aspect_ratio(img, target_aspect_ratio)
-                img = img.resize((int(img_layout['width']), int(img_layout['height'])), Image.Resampling.LANCZOS)
-                preview_img.paste(img, (int(img_layout['x']), int(img_layout['y'])))
-        
-        preview_img.thumbnail((preview_w - 20, preview_h - 20), Image.Resampling.LANCZOS)
-        
-        self.preview_image = ImageTk.PhotoImage(preview_img)
-        self.preview_label.config(image=self.preview_image, text="")
+    def _show_preview(self, preview_img):
+        self._set_status("")
+        self._show_partial_preview(preview_img)
 
     def save_image(self):
         if not self.layout:
@@ -281,32 +448,77 @@ class PhotoGridApp(tk.Tk):
         if not save_path: return
 
         try:
-            output_w = int(self.width_entry.get())
-            output_h = int(self.height_entry.get())
             quality = int(self.quality_entry.get())
             quality = max(1, min(100, quality))  # Clamp to 1-100 range
         except ValueError:
             messagebox.showerror("Invalid Input", "Please enter valid integers for dimensions and quality.")
             return
+        parameters = self._collage_parameters()
+        if parameters is None:
+            return
+
+        self._set_status("Rendering image...")
+        self._submit_timed(self._render_and_save, parameters, save_path, quality, writing="Saving the image",
+                           on_done=self._on_image_saved,
+                           on_error=self._on_save_error,
+                           on_progress=self._on_progress)
+
+    def _render_and_save(self, job, parameters, save_path, quality):
+        """
+        Saves the session's collage; a save after only a quality or color change reuses the last render.
+        """
+        progress = lambda done, total: job.report_progress(done, total, "Rendering image...")
+        self.session.update(**parameters)
+        self.session.save(save_path, quality, workers=self.render_workers, progress=progress)
+        return save_path, quality
+
+    def _on_image_saved(self, result):
+        save_path, quality = result
+        self._set_status("")
+        self._finish_writing()
+        messagebox.showinfo("Success", f"Image saved successfully to:\n{save_path}\nQuality: {quality}")
+
+    def export_web_set(self):
+        """
+        Writes the full image, web sizes, a thumbnail and a Deep Zoom viewer of the collage into a folder.
+        """
+        if not self.layout:
+            messagebox.showerror("Error", "No layout has been generated to export.")
+            return
+
+        folder = filedialog.askdirectory(title="Export Web Set To...")
+        if not folder: return
 
-        is_cropping = self.crop_var.get()
-        target_aspect_ratio = output_w / output_h
-        
-        final_image = Image.new('RGB', (output_w, output_h), self.background_color)
-
-        for img_layout in self.layout:
-            with Image.open(img_layout['path']) as img:
-                img = ImageOps.exif_transpose(img)
-                if is_cropping:
-                    img = crop_to_aspect_ratio(img, target_aspect_ratio)
-                img = img.resize((int(img_layout['width']), int(img_layout['height'])), Image.Resampling.LANCZOS)
-                final_image.paste(img, (int(img_layout['x']), int(img_layout['y'])))
-        
         try:
-            final_image.save(save_path, quality=quality, optimize=True)
-            messagebox.showinfo("Success", f"Image saved successfully to:\n{save_path}\nQuality: {quality}")
-        except Exception as e:
-            messagebox.showerror("Save Error", f"Could not save the image.\nError: {e}")
+            quality = max(1, min(100, int(self.quality_entry.get())))
+        except ValueError:
+            messagebox.showerror("Invalid Input", "Please enter a valid integer for quality.")
+            return
+        parameters = self._collage_parameters()
+        if parameters is None:
+            return
+
+        self._set_status("Exporting...")
+        self._submit_timed(self._export, parameters, folder, quality, writing="Exporting the web set",
+                           on_done=self._on_exported,
+                           on_error=self._on_save_error,
+                           on_progress=self._on_progress)
+
+    def _export(self, job, parameters, folder, quality):
+        progress = lambda done, total: job.report_progress(done, total, "Exporting...")
+        self.session.update(**parameters)
+        self.session.export(web_renditions(folder, quality), workers=self.render_workers, progress=progress)
+        return folder
+
+    def _on_exported(self, folder):
+        self._set_status("")
+        self._finish_writing()
+        messagebox.showinfo("Success", f"Web set exported to:\n{folder}")
+
+    def _on_save_error(self, e):
+        self._set_status("")
+        self._finish_writing()
+        messagebox.showerror("Save Error", f"Could not save the image.\nError: {e}")
 
 
 if __name__ == "__main__":
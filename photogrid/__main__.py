@@ -0,0 +1,4 @@
+import sys
+from photogrid.batch import main
+
+sys.exit(main())
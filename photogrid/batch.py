@@ -0,0 +1,365 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from photogrid.catalog import ImageCatalog, Placements
+from photogrid.crop import CROP_MODES, plan_crops
+from photogrid.dedup import dedupe_images
+from photogrid.engine import LAYOUT_MODES, seeded_layout, search_shuffles, layout_coverage, save_collage
+from photogrid.export import Rendition, export_renditions, rendition_from_dict
+from photogrid.imaging import LazyModule
+from photogrid.index import INDEX_FILENAME, analyze_images_cached
+from photogrid.layout_cache import LayoutCache
+from photogrid.pages import (PageResult, page_path, page_report_path, paginate, read_page_result, write_page_report,
+                             write_page_result)
+from photogrid.tile_cache import TileCache
+from photogrid.timing import Timings, recording, profiling
+
+CollageJob = namedtuple('CollageJob', ['folder', 'output', 'width', 'height', 'min_spacing', 'max_spacing',
+                                       'crop', 'seed', 'quality', 'background', 'mode', 'strip_height', 'renditions',
+                                       'search_budget', 'max_shuffles', 'crop_mode', 'page_size', 'dedupe'],
+                        defaults=[1920, 1080, 10, 50, False, None, 95, 'white', 'greedy', None, None, None, None,
+                                  'center', None, False])
+
+# Only needed once a job renders, so loading a manifest does not import Pillow
+_render = LazyModule('photogrid.render')
+
+
+def load_manifest(manifest_path):
+    """
+    Reads a manifest of collage jobs.
+
+    The manifest is either a JSON list of job objects, a JSON object with a
+    "jobs" list, or one JSON job object per line. Each job needs "folder" and
+    "output"; the other CollageJob fields are optional. "renditions" is a list
+    of objects with the fields of export.Rendition, written along with the
+    output. With "search_budget" (seconds) or "max_shuffles" set, many
+    shuffles are searched for the best layout, starting from "seed".
+    "crop_mode" is "center" or "content", for cropping to the content.
+    With "page_size" set, the folder is split into pages of about that many
+    images, written as numbered outputs (archive_001.jpg, ...) along with a
+    combined coverage report (archive_pages.json). With "dedupe" set,
+    near-duplicate photos such as burst shots are left out, keeping the
+    sharpest of each group.
+    Relative paths are resolved against the manifest's directory.
+
+    Returns:
+        list: CollageJob records, in manifest order.
+    """
+    with open(manifest_path) as f:
+        text = f.read()
+
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        data = [json.loads(line) for line in text.splitlines() if line.strip()]
+    if isinstance(data, dict):
+        data = data['jobs']
+
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    return [job_from_dict(entry, base_dir) for entry in data]
+
+
+def job_from_dict(entry, base_dir=''):
+    """
+    Builds a CollageJob from one manifest entry, resolving its paths against base_dir.
+
+    Raises:
+        ValueError: If the entry has unknown fields or values.
+    """
+    unknown = set(entry) - set(CollageJob._fields)
+    if unknown:
+        raise ValueError(f"Unknown manifest fields: {', '.join(sorted(unknown))}")
+    try:
+        job = CollageJob(**entry)
+    except TypeError as e:
+        raise ValueError(f"Invalid job: {e}") from None
+    if job.mode not in LAYOUT_MODES:
+        raise ValueError(f"Unknown layout mode: {job.mode}")
+    if job.crop_mode not in CROP_MODES:
+        raise ValueError(f"Unknown crop mode: {job.crop_mode}")
+    if job.page_size is not None and (not isinstance(job.page_size, int) or job.page_size < 1):
+        raise ValueError(f"Invalid page size: {job.page_size}")
+    renditions = job.renditions
+    if renditions is not None:
+        renditions = tuple(rendition_from_dict(rendition, base_dir) for rendition in renditions)
+    return job._replace(folder=os.path.join(base_dir, job.folder), output=os.path.join(base_dir, job.output),
+                        renditions=renditions)
+
+
+def job_layout(job, images, layout_cache=None):
+    """
+    Lays out the images of a job, searching many shuffles if the job asks for it,
+    after leaving out near-duplicates if it asks for that.
+
+    Returns:
+        list: The layout, as search_layout returns it.
+    """
+    if job.dedupe:
+        images = dedupe_images(images, index_path=os.path.join(job.folder, INDEX_FILENAME))
+    if job.search_budget is not None or job.max_shuffles is not None:
+        # Jobs already run one per core, so each searches in its own process
+        return search_shuffles(images, job.width, job.height, job.min_spacing, job.max_spacing, job.crop,
+                               job.seed, job.mode, time_budget=job.search_budget, max_shuffles=job.max_shuffles,
+                               workers=1, cache=layout_cache).layout
+    return seeded_layout(images, job.width, job.height, job.min_spacing, job.max_spacing, job.crop, job.seed,
+                         job.mode, cache=layout_cache)
+
+
+def page_jobs(job, images):
+    """
+    Splits a job with a page_size into one job per page, see pages.paginate.
+    Near-duplicates are left out before the images are split, if the job asks for it.
+
+    Returns:
+        list: (CollageJob, ImageCatalog) pairs, in page order; every job writes
+              its page's numbered output.
+    """
+    if not images:
+        raise ValueError(f"No compatible images found in {job.folder}")
+    if job.renditions:
+        raise ValueError("Renditions cannot be combined with page_size")
+    if job.dedupe:
+        images = dedupe_images(images, index_path=os.path.join(job.folder, INDEX_FILENAME))
+    pages = paginate(images, job.page_size, job.crop)
+    return [(job._replace(output=page_path(job.output, i, len(pages)), page_size=None, dedupe=False), page)
+            for i, page in enumerate(pages)]
+
+
+def job_crop(job, layout):
+    """
+    Returns what the render functions should crop the tiles of a job's layout by.
+    """
+    if not job.crop:
+        return None
+    if job.crop_mode == 'content':
+        return plan_crops(Placements.from_dicts(layout).paths, job.width / job.height,
+                          index_path=os.path.join(job.folder, INDEX_FILENAME))
+    return job.width / job.height
+
+
+def run_job(job, images, layout_cache=None, tile_cache=None):
+    """
+    Lays out and renders one collage.
+
+    Args:
+        job (CollageJob): The job to run.
+        images (ImageCatalog): The images of the job's folder; a list of ImageInfo also works.
+        layout_cache (LayoutCache): Reuse the layout of a seeded job run before.
+        tile_cache (TileCache): Reuse tiles rendered by other jobs and pages.
+
+    Returns:
+        float: The coverage of the rendered layout.
+    """
+    if not images:
+        raise ValueError(f"No compatible images found in {job.folder}")
+    if job.renditions and job.strip_height is not None:
+        raise ValueError("Renditions need the whole canvas and cannot be combined with strip_height")
+
+    layout = job_layout(job, images, layout_cache)
+    crop_aspect_ratio = job_crop(job, layout)
+
+    output_dir = os.path.dirname(job.output)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    if job.renditions:
+        canvas = _render.render_collage(layout, (job.width, job.height), job.background, crop_aspect_ratio,
+                                        cache=tile_cache)
+        export_renditions(canvas, [Rendition('image', job.output, quality=job.quality), *job.renditions],
+                          job.background)
+    else:
+        save_collage(layout, job.output, (job.width, job.height), job.background, crop_aspect_ratio, job.quality,
+                     strip_height=job.strip_height, cache=tile_cache)
+    return layout_coverage(layout, job.width, job.height)
+
+
+def _run_job_timed(job, images, layout_cache_dir, tile_cache_dir):
+    """
+    Runs one job and returns its coverage with the stage timings it recorded.
+    """
+    layout_cache = LayoutCache(cache_dir=layout_cache_dir) if layout_cache_dir is not None else None
+    tile_cache = TileCache(cache_dir=tile_cache_dir) if tile_cache_dir is not None else None
+    with recording() as timings:
+        coverage = run_job(job, images, layout_cache, tile_cache)
+    return coverage, timings.as_dict()
+
+
+def _run_jobs(tasks, workers, layout_cache_dir=None, tile_cache_dir=None):
+    """
+    Runs (job, images) tasks and yields (index, (coverage, timings) or exception) as they finish.
+    """
+    if workers == 0:
+        for index, (job, images) in enumerate(tasks):
+            try:
+                yield index, _run_job_timed(job, images, layout_cache_dir, tile_cache_dir)
+            except Exception as e:
+                yield index, e
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_run_job_timed, job, images, layout_cache_dir, tile_cache_dir): index
+                   for index, (job, images) in enumerate(tasks)}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result()
+            except Exception as e:
+                yield futures[future], e
+
+
+def _job_marker(job):
+    """
+    Returns the file whose presence means the job is finished.
+    """
+    return page_report_path(job.output) if job.page_size is not None else job.output
+
+
+def run_manifest(jobs, workers=None, force=False, report=print, timings=None, layout_cache_dir=None,
+                 tile_cache_dir=None):
+    """
+    Runs many collage jobs concurrently, one job per process.
+
+    Every folder is scanned once, through its persistent index, and the results
+    are shared by all jobs that use it. Jobs whose output already exists are
+    skipped unless force is set, so an interrupted run can simply be restarted.
+    The pages of a job with a page_size are run like separate jobs, in
+    parallel; the job is finished once its coverage report is written, and
+    pages rendered by an interrupted run are not rendered again.
+
+    All jobs share one disk-backed TileCache, so a source that several jobs or
+    pages show at the same size is decoded once.
+
+    Args:
+        jobs (list): CollageJob records.
+        workers (int): Number of processes; None uses every core and 0 runs
+                       the jobs one by one in this process.
+        force (bool): Re-render jobs whose output already exists.
+        report (callable): Called with one status line per job.
+        timings (Timings): Collects the stage timings of the scans and all jobs.
+        layout_cache_dir (str): Directory of a LayoutCache shared by all jobs,
+                                so seeded jobs run before skip the layout search.
+        tile_cache_dir (str): Directory of the TileCache, to keep tiles for
+                              later runs. By default a temporary directory is
+                              used and removed when the run ends.
+
+    Returns:
+        dict: Counts of 'done', 'skipped' and 'failed' jobs.
+    """
+    counts = {'done': 0, 'skipped': 0, 'failed': 0}
+    pending = []
+    for job in jobs:
+        if not force and os.path.exists(_job_marker(job)):
+            counts['skipped'] += 1
+            report(f"skipped {job.output} (already exists)")
+        else:
+            pending.append(job)
+
+    folder_images = {}
+    tasks = []
+    # The index into pending of the job each task belongs to
+    owners = []
+    page_results = {}
+    for owner, job in enumerate(pending):
+        if job.folder not in folder_images:
+            try:
+                with recording(timings):
+                    h, v = analyze_images_cached(job.folder)
+                folder_images[job.folder] = ImageCatalog.from_infos(h + v)
+            except OSError as e:
+                folder_images[job.folder] = e
+        images = folder_images[job.folder]
+        try:
+            if isinstance(images, OSError):
+                raise images
+            job_tasks = [(job, images)] if job.page_size is None else page_jobs(job, images)
+        except (OSError, ValueError) as e:
+            counts['failed'] += 1
+            report(f"failed  {job.output}: {e}")
+            continue
+        page_results[owner] = []
+        for task in job_tasks:
+            done = read_page_result(task[0].output) if job.page_size is not None and not force else None
+            if done is not None:
+                page_results[owner].append(done)
+            else:
+                tasks.append(task)
+                owners.append(owner)
+
+    tasks_left = Counter(owners)
+    errors = {}
+
+    def finish(owner):
+        job = pending[owner]
+        if owner in errors:
+            counts['failed'] += 1
+            report(f"failed  {job.output}: {errors[owner]}")
+        elif job.page_size is None:
+            counts['done'] += 1
+            report(f"done    {job.output} ({page_results[owner][0].coverage * 100:.1f}% coverage)")
+        else:
+            # Zero-padded page numbers sort in page order
+            pages = write_page_report(job.output, sorted(page_results[owner]))
+            counts['done'] += 1
+            report(f"done    {job.output} ({len(pages['pages'])} pages, {pages['mean'] * 100:.1f}% mean "
+                   f"coverage, {pages['min'] * 100:.1f}% lowest)")
+
+    # Paginated jobs whose pages were all rendered by an earlier run only need their report
+    for owner in page_results:
+        if not tasks_left[owner]:
+            finish(owner)
+
+    temp_dir = None
+    if tile_cache_dir is None and tasks:
+        tile_cache_dir = temp_dir = tempfile.mkdtemp(prefix='photogrid-tiles-')
+    try:
+        for index, result in _run_jobs(tasks, workers, layout_cache_dir, tile_cache_dir):
+            owner = owners[index]
+            if isinstance(result, Exception):
+                errors.setdefault(owner, result)
+            else:
+                coverage, job_timings = result
+                if timings is not None:
+                    timings.merge(job_timings)
+                task_job, images = tasks[index]
+                page_result = PageResult(task_job.output, len(images), coverage)
+                page_results[owner].append(page_result)
+                if pending[owner].page_size is not None:
+                    write_page_result(page_result)
+            tasks_left[owner] -= 1
+            if not tasks_left[owner]:
+                finish(owner)
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m photogrid',
+                                     description="Render photo grid collages from a manifest of jobs.")
+    parser.add_argument('manifest', help="JSON or JSON-lines file describing the collages to render")
+    parser.add_argument('--workers', type=int, default=None, help="number of jobs to run in parallel (default: all cores)")
+    parser.add_argument('--force', action='store_true', help="re-render collages whose output already exists")
+    parser.add_argument('--profile', action='store_true',
+                        help="print the time spent per stage (scan, search, decode, resample, paste, encode)")
+    parser.add_argument('--cprofile', metavar='PATH',
+                        help="run the jobs in this process under cProfile and write the stats to PATH")
+    parser.add_argument('--layout-cache', metavar='DIR',
+                        help="reuse the layouts of seeded jobs from DIR, e.g. when re-rendering at another quality")
+    parser.add_argument('--tile-cache', metavar='DIR',
+                        help="keep rendered tiles in DIR for later runs (default: a temporary directory per run)")
+    args = parser.parse_args(argv)
+
+    jobs = load_manifest(args.manifest)
+    timings = Timings() if args.profile else None
+    workers = 0 if args.cprofile else args.workers
+    with profiling(args.cprofile):
+        counts = run_manifest(jobs, workers=workers, force=args.force, timings=timings,
+                              layout_cache_dir=args.layout_cache, tile_cache_dir=args.tile_cache)
+    print(f"{counts['done']} rendered, {counts['skipped']} skipped, {counts['failed']} failed")
+    if timings is not None:
+        print(timings.report())
+    return 1 if counts['failed'] else 0
@@ -0,0 +1,141 @@
+import numpy as np
+from photogrid.image_utils import ImageInfo
+
+
+def _compact(values):
+    """
+    Returns the values as an array, using 32-bit integers for pixel counts.
+    """
+    values = np.asarray(values)
+    return values.astype(np.int32) if values.dtype.kind in 'iu' else values
+
+
+class ImageCatalog:
+    """
+    A column-oriented list of images: one array per ImageInfo field instead of
+    one namedtuple per image.
+
+    The layout code reads the columns directly. Indexing or iterating yields
+    ImageInfo records, so a catalog can stand in wherever a list of ImageInfo
+    is read.
+    """
+
+    __slots__ = ('paths', 'widths', 'heights', 'aspect_ratios')
+
+    def __init__(self, paths, widths, heights, aspect_ratios=None):
+        self.paths = list(paths)
+        self.widths = _compact(widths)
+        self.heights = _compact(heights)
+        if aspect_ratios is None:
+            aspect_ratios = self.widths / self.heights if len(self.paths) else []
+        self.aspect_ratios = np.asarray(aspect_ratios, dtype=float)
+
+    @classmethod
+    def from_infos(cls, images):
+        """
+        Builds a catalog from ImageInfo records, keeping their order.
+        """
+        if isinstance(images, cls):
+            return images
+        images = list(images)
+        return cls([img.path for img in images], [img.width for img in images], [img.height for img in images],
+                   [img.aspect_ratio for img in images])
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.take(np.arange(len(self))[index])
+        return ImageInfo(self.paths[index], self.widths[index].item(), self.heights[index].item(),
+                         self.aspect_ratios[index].item())
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def take(self, indices):
+        """
+        Returns a new catalog of the images at the given indices, in that order.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        return ImageCatalog([self.paths[i] for i in indices.tolist()], self.widths[indices], self.heights[indices],
+                            self.aspect_ratios[indices])
+
+    def to_infos(self):
+        return list(self)
+
+
+class Placements:
+    """
+    A final layout stored column-wise: the path of every image plus arrays of
+    its x, y, width and height.
+
+    Placements behave as a read-only sequence of the layout dicts ('path', 'x',
+    'y', 'width', 'height') used throughout photogrid, built on demand, and
+    compare equal to such a list. Code that knows about Placements reads the
+    arrays instead.
+    """
+
+    __slots__ = ('paths', 'x', 'y', 'width', 'height')
+
+    def __init__(self, paths, x, y, width, height):
+        self.paths = list(paths)
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.width = np.asarray(width, dtype=float)
+        self.height = np.asarray(height, dtype=float)
+
+    @classmethod
+    def from_dicts(cls, layout):
+        """
+        Builds Placements from a list of layout dicts; Placements are returned as they are.
+        """
+        if isinstance(layout, cls):
+            return layout
+        return cls([img['path'] for img in layout], [img['x'] for img in layout], [img['y'] for img in layout],
+                   [img['width'] for img in layout], [img['height'] for img in layout])
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.to_dicts()[index]
+        return {'path': self.paths[index], 'x': float(self.x[index]), 'y': float(self.y[index]),
+                'width': float(self.width[index]), 'height': float(self.height[index])}
+
+    def __iter__(self):
+        return iter(self.to_dicts())
+
+    def __eq__(self, other):
+        if isinstance(other, (Placements, list, tuple)):
+            return self.to_dicts() == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return f"Placements({len(self)} images)"
+
+    def to_dicts(self):
+        """
+        Returns the layout as a list of dicts.
+        """
+        return [{'path': path, 'x': x, 'y': y, 'width': width, 'height': height}
+                for path, x, y, width, height in zip(self.paths, self.x.tolist(), self.y.tolist(),
+                                                      self.width.tolist(), self.height.tolist())]
+
+    def scaled(self, factor):
+        """
+        Returns the placements with all positions and sizes multiplied by factor.
+        """
+        return Placements(self.paths, self.x * factor, self.y * factor, self.width * factor, self.height * factor)
+
+    def photo_area(self):
+        return float(np.sum(self.width * self.height))
+
+    def tile_tasks(self):
+        """
+        Returns (path, x, y, width, height) per image, truncated to whole pixels.
+        """
+        columns = (self.x, self.y, self.width, self.height)
+        return list(zip(self.paths, *(column.astype(np.int64).tolist() for column in columns)))
@@ -0,0 +1,234 @@
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from photogrid.image_utils import ORIENTATION_TAG, ORIENTATION_TRANSPOSE, crop_box
+from photogrid.imaging import Image, exif_thumbnail, open_image
+from photogrid.index import ImageIndex, index_groups
+from photogrid.timing import stage
+
+CROP_MODES = ('center', 'content')
+
+# Long side of the saliency map; the 1/8 DCT decode is reduced further to about this size.
+SALIENCY_SIZE = 160
+
+# An embedded EXIF thumbnail serves as the proxy instead when it is stretched by
+# at most this fraction, which excludes thumbnails padded to another shape.
+THUMBNAIL_STRETCH = 0.08
+
+# Windows scoring within this fraction of the best are considered equal, and
+# the one nearest the center wins, so flat images keep the center crop.
+CROP_TOLERANCE = 0.02
+
+
+class CropPlan:
+    """
+    Content-aware crop boxes for a set of images and one target aspect ratio.
+
+    It stands in for the crop aspect ratio of the render functions: a box
+    is looked up by path, and images without one are center-cropped.
+    Boxes are (left, upper, right, lower) in pixels of the oriented image, of
+    the same size as crop_box gives, so layouts are unaffected.
+    """
+
+    def __init__(self, aspect_ratio, boxes=None):
+        self.aspect_ratio = aspect_ratio
+        self.boxes = dict(boxes or {})
+
+    def __eq__(self, other):
+        if not isinstance(other, CropPlan):
+            return NotImplemented
+        return self.aspect_ratio == other.aspect_ratio and self.boxes == other.boxes
+
+    def __repr__(self):
+        return f"CropPlan({self.aspect_ratio:.4f}, {len(self.boxes)} boxes)"
+
+    def box(self, path, width, height):
+        """
+        Returns the crop box of an image whose oriented size is (width, height).
+        """
+        box = self.boxes.get(path)
+        center = crop_box(width, height, self.aspect_ratio)
+        if box is None or box[2] > width + 0.5 or box[3] > height + 0.5:
+            return center
+        return box
+
+    def key(self, path):
+        """
+        Returns what identifies the crop of one image, e.g. for tile cache keys.
+        """
+        return ('content', self.aspect_ratio, self.boxes.get(path))
+
+
+def source_crop_box(crop, path, width, height):
+    """
+    Returns the box to cut from an oriented image of (width, height) pixels
+    for a crop given as an aspect ratio (center crop), a CropPlan, or None.
+    """
+    if crop is None:
+        return (0, 0, width, height)
+    if isinstance(crop, CropPlan):
+        return crop.box(path, width, height)
+    return crop_box(width, height, crop)
+
+
+def saliency_map(pixels):
+    """
+    Scores every pixel of an RGB array by how much it stands out: luminance
+    edge energy plus distance from the image's mean color.
+    """
+    pixels = pixels.astype(np.float32)
+    luminance = pixels @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    energy = np.zeros_like(luminance)
+    dx = np.abs(np.diff(luminance, axis=1))
+    dy = np.abs(np.diff(luminance, axis=0))
+    energy[:, 1:] += dx
+    energy[:, :-1] += dx
+    energy[1:, :] += dy
+    energy[:-1, :] += dy
+    contrast = np.abs(pixels - pixels.reshape(-1, 3).mean(axis=0)).sum(axis=2)
+    return energy + 0.25 * contrast
+
+
+def best_window(profile, window):
+    """
+    Returns the start of the `window`-long run of profile with the largest sum,
+    preferring the run nearest the center among those within CROP_TOLERANCE.
+    """
+    count = len(profile)
+    if window >= count:
+        return 0
+    sums = np.concatenate(([0.0], np.cumsum(profile, dtype=np.float64)))
+    scores = sums[window:] - sums[:-window]
+    best = scores.max()
+    candidates = np.flatnonzero(scores >= best - CROP_TOLERANCE * abs(best))
+    center = (count - window) / 2
+    return int(candidates[np.argmin(np.abs(candidates - center))])
+
+
+def _open_proxy(path):
+    """
+    Decodes an image at reduced size, as oriented, for saliency. Its EXIF
+    thumbnail is used if it has the photo's proportions and about the
+    saliency map's size, which saves decoding the photo itself.
+
+    Returns:
+        tuple: (RGB array, oriented width, oriented height) of the full image.
+    """
+    with open_image(path) as img:
+        orientation = img.getexif().get(ORIENTATION_TAG, 1)
+        stored_width, stored_height = img.size
+        proxy = exif_thumbnail(img)
+        if proxy is not None:
+            scale_x, scale_y = proxy.size[0] / stored_width, proxy.size[1] / stored_height
+            if abs(scale_x - scale_y) > THUMBNAIL_STRETCH * scale_x or max(proxy.size) < SALIENCY_SIZE // 2:
+                proxy = None
+        if proxy is None:
+            if img.format == 'JPEG':
+                img.draft('RGB', (max(1, stored_width // 8), max(1, stored_height // 8)))
+            proxy = img
+        proxy = proxy.convert('RGB')
+    factor = max(1, max(proxy.size) // SALIENCY_SIZE)
+    if factor > 1:
+        proxy = proxy.reduce(factor)
+    if orientation in ORIENTATION_TRANSPOSE:
+        proxy = proxy.transpose(ORIENTATION_TRANSPOSE[orientation])
+    if orientation >= 5:
+        return np.asarray(proxy), stored_height, stored_width
+    return np.asarray(proxy), stored_width, stored_height
+
+
+def plan_crop(path, aspect_ratio):
+    """
+    Picks the crop window of an image for a target aspect ratio by saliency.
+
+    The window has the size of the center crop and only slides along the
+    axis being cropped, to wherever the saliency map of a small proxy sums
+    highest. Most camera JPEGs carry an EXIF thumbnail that serves as the
+    proxy, and then a plan takes a few milliseconds. Without one, the 1/8
+    scale decode dominates, at about 50 ms for a 24 MP JPEG.
+
+    Returns:
+        tuple: (left, upper, right, lower) in pixels of the oriented image.
+    """
+    pixels, width, height = _open_proxy(path)
+    center = crop_box(width, height, aspect_ratio)
+    left, upper, right, lower = center
+    proxy_height, proxy_width = pixels.shape[:2]
+    saliency = saliency_map(pixels)
+
+    if left > 0:
+        # Wider than the target: slide horizontally
+        scale = proxy_width / width
+        window = max(1, round((right - left) * scale))
+        start = best_window(saliency.sum(axis=0), window) / scale
+        start = min(max(0.0, start), width - (right - left))
+        return (start, upper, start + (right - left), lower)
+    if upper > 0:
+        scale = proxy_height / height
+        window = max(1, round((lower - upper) * scale))
+        start = best_window(saliency.sum(axis=1), window) / scale
+        start = min(max(0.0, start), height - (lower - upper))
+        return (left, start, right, start + (lower - upper))
+    return center
+
+
+def _plan_or_none(path, aspect_ratio):
+    try:
+        return plan_crop(path, aspect_ratio)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None  # Unreadable: the render path center-crops it, or reports the error itself
+
+
+def plan_crops(paths, aspect_ratio, max_workers=None, use_index=True, index_path=None):
+    """
+    Plans the content-aware crop of many images for one target aspect ratio.
+
+    Boxes already stored in the index are reused if the file has not changed;
+    the rest are planned on a thread pool and stored there for the next render.
+
+    Args:
+        paths (list): The images to crop.
+        aspect_ratio (float): The target aspect ratio (width / height).
+        max_workers (int): Number of threads to use; 1 plans serially.
+        use_index (bool): Read and write the sidecar indexes.
+        index_path (str): The index to use, e.g. that of the folder the images
+                          were scanned from, so a recursive scan keeps one
+                          sidecar. By default each image's own folder has one.
+
+    Returns:
+        CropPlan: Boxes for every readable image.
+    """
+    paths = list(dict.fromkeys(paths))
+    boxes = {}
+    groups = index_groups(paths, index_path)
+
+    with stage('crop', count=len(paths)):
+        if use_index:
+            for group_index, group_paths in groups.items():
+                try:
+                    with ImageIndex(group_index) as index:
+                        boxes.update(index.get_crops(group_paths, aspect_ratio))
+                except (sqlite3.Error, OSError):
+                    pass
+
+        missing = [path for path in paths if path not in boxes]
+        if max_workers == 1 or len(missing) <= 1:
+            planned = [_plan_or_none(path, aspect_ratio) for path in missing]
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                planned = list(executor.map(lambda path: _plan_or_none(path, aspect_ratio), missing))
+        new_boxes = {path: box for path, box in zip(missing, planned) if box is not None}
+        boxes.update(new_boxes)
+
+        if use_index and new_boxes:
+            for group_index, group_paths in groups.items():
+                group_boxes = {path: new_boxes[path] for path in group_paths if path in new_boxes}
+                if not group_boxes:
+                    continue
+                try:
+                    with ImageIndex(group_index) as index:
+                        index.put_crops(group_boxes, aspect_ratio)
+                except (sqlite3.Error, OSError):
+                    pass  # Read-only folder: the boxes are planned again next time
+
+    return CropPlan(aspect_ratio, boxes)
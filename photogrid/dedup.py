@@ -0,0 +1,249 @@
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from photogrid.catalog import ImageCatalog
+from photogrid.image_utils import ORIENTATION_TAG, ORIENTATION_TRANSPOSE
+from photogrid.imaging import Image, open_image
+from photogrid.index import ImageIndex, index_groups
+from photogrid.timing import stage
+
+# Images whose 64-bit dHashes differ in at most this many bits are near-duplicates
+DEDUP_DISTANCE = 6
+
+# Long side of the grayscale proxy that sharpness is measured on; the 1/8 DCT
+# decode is reduced further to about this size.
+HASH_PROXY_SIZE = 256
+
+# Set bits of every byte value, for counting the bits two hashes differ in before numpy 2.0
+_BYTE_BITS = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+def _open_gray_proxy(path):
+    """
+    Decodes an image at reduced size, as oriented, in grayscale.
+    """
+    with open_image(path) as img:
+        orientation = img.getexif().get(ORIENTATION_TAG, 1)
+        if img.format == 'JPEG':
+            img.draft('L', (max(1, img.width // 8), max(1, img.height // 8)))
+        proxy = img.convert('L')
+    factor = max(1, max(proxy.size) // HASH_PROXY_SIZE)
+    if factor > 1:
+        proxy = proxy.reduce(factor)
+    if orientation in ORIENTATION_TRANSPOSE:
+        proxy = proxy.transpose(ORIENTATION_TRANSPOSE[orientation])
+    return proxy
+
+
+def dhash(gray):
+    """
+    Returns the 64-bit difference hash of a grayscale image: one bit per pixel
+    of a 9x8 reduction, set where it is brighter than its right neighbour.
+    """
+    pixels = np.asarray(gray.resize((9, 8), Image.Resampling.BOX), dtype=np.int16)
+    bits = (pixels[:, :-1] > pixels[:, 1:]).ravel()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def sharpness(gray):
+    """
+    Scores how sharp a grayscale image is by the variance of its Laplacian.
+    Only comparable between images of the same proxy size, such as burst frames.
+    """
+    pixels = np.asarray(gray, dtype=np.float32)
+    if min(pixels.shape) < 3:
+        return 0.0
+    laplacian = (pixels[1:-1, :-2] + pixels[1:-1, 2:] + pixels[:-2, 1:-1] + pixels[2:, 1:-1]
+                 - 4 * pixels[1:-1, 1:-1])
+    return float(laplacian.var())
+
+
+def hash_image(path):
+    """
+    Returns (dhash, sharpness) of an image, both measured on one small proxy decode.
+    """
+    gray = _open_gray_proxy(path)
+    return dhash(gray), sharpness(gray)
+
+
+def _hash_or_none(path):
+    try:
+        return hash_image(path)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None  # Unreadable: never counted as a duplicate
+
+
+def hash_images(paths, max_workers=None, use_index=True, index_path=None):
+    """
+    Hashes many images for duplicate detection.
+
+    Hashes already stored in the index are reused if the file has not
+    changed; the rest are computed on a thread pool and stored there for the
+    next run.
+
+    Args:
+        paths (list): The images to hash.
+        max_workers (int): Number of threads to use; 1 hashes serially.
+        use_index (bool): Read and write the sidecar indexes.
+        index_path (str): The index to use, e.g. that of the folder the images
+                          were scanned from, so a recursive scan keeps one
+                          sidecar. By default each image's own folder has one.
+
+    Returns:
+        dict: {path: (dhash, sharpness)} for every readable image.
+    """
+    paths = list(dict.fromkeys(paths))
+    hashes = {}
+    groups = index_groups(paths, index_path)
+
+    with stage('hash', count=len(paths)):
+        if use_index:
+            for group_index, group_paths in groups.items():
+                try:
+                    with ImageIndex(group_index) as index:
+                        hashes.update(index.get_hashes(group_paths))
+                except (sqlite3.Error, OSError):
+                    pass
+
+        missing = [path for path in paths if path not in hashes]
+        if max_workers == 1 or len(missing) <= 1:
+            computed = [_hash_or_none(path) for path in missing]
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                computed = list(executor.map(_hash_or_none, missing))
+        new_hashes = {path: result for path, result in zip(missing, computed) if result is not None}
+        hashes.update(new_hashes)
+
+        if use_index and new_hashes:
+            for group_index, group_paths in groups.items():
+                group_hashes = {path: new_hashes[path] for path in group_paths if path in new_hashes}
+                if not group_hashes:
+                    continue
+                try:
+                    with ImageIndex(group_index) as index:
+                        index.put_hashes(group_hashes)
+                except (sqlite3.Error, OSError):
+                    pass  # Read-only folder: the hashes are computed again next time
+
+    return hashes
+
+
+def hamming_distances(a, b):
+    """
+    Returns the number of bits in which each pair of 64-bit hashes differs.
+    """
+    differing = np.bitwise_xor(np.asarray(a, dtype=np.uint64), np.asarray(b, dtype=np.uint64))
+    if hasattr(np, 'bitwise_count'):  # numpy 2.0 and later
+        return np.bitwise_count(differing)
+    return _BYTE_BITS[differing.view(np.uint8).reshape(-1, 8)].sum(axis=1, dtype=np.int64)
+
+
+def near_duplicate_pairs(hashes, max_distance=DEDUP_DISTANCE):
+    """
+    Finds all pairs of hashes that differ in at most max_distance bits.
+
+    The 64 bits are split into max_distance + 1 bands. Two hashes that close
+    must agree exactly on at least one band, so only hashes sharing a band
+    value are compared, which keeps the work near linear in the number of
+    hashes instead of quadratic.
+
+    Args:
+        hashes (array): 64-bit hashes.
+        max_distance (int): The most bits near-duplicates may differ in.
+
+    Returns:
+        tuple: (first, second) index arrays of the pairs, first < second, each pair once.
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    count = len(hashes)
+    bands = min(max_distance + 1, 64)
+    edges = np.linspace(0, 64, bands + 1).round().astype(int)
+    found = []
+    for low, high in zip(edges[:-1], edges[1:]):
+        keys = (hashes >> np.uint64(low)) & np.uint64((1 << int(high - low)) - 1)
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        # Compare every hash with the ones after it in its band bucket, one offset at a time
+        for offset in range(1, count):
+            same = keys[offset:] == keys[:-offset]
+            if not same.any():
+                break
+            first, second = order[:-offset][same], order[offset:][same]
+            close = hamming_distances(hashes[first], hashes[second]) <= max_distance
+            found.append(np.stack((np.minimum(first, second), np.maximum(first, second)))[:, close])
+    if not found:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    pairs = np.unique(np.concatenate(found, axis=1), axis=1)
+    return pairs[0], pairs[1]
+
+
+def cluster_labels(count, first, second):
+    """
+    Groups count items into the connected components of the given pairs.
+
+    Returns:
+        array: The label of every item: the smallest index in its group.
+    """
+    labels = np.arange(count)
+    while True:
+        smaller = np.minimum(labels[first], labels[second])
+        updated = labels.copy()
+        np.minimum.at(updated, first, smaller)
+        np.minimum.at(updated, second, smaller)
+        updated = updated[updated]
+        if np.array_equal(updated, labels):
+            return labels
+        labels = updated
+
+
+def find_duplicates(paths, max_distance=DEDUP_DISTANCE, max_workers=None, use_index=True, index_path=None):
+    """
+    Groups images that look the same, such as burst shots, by perceptual hash.
+
+    Args:
+        paths (list): The images to compare.
+        max_distance (int): The most dHash bits near-duplicates may differ in.
+        max_workers (int): Number of threads to hash with; see hash_images.
+        use_index (bool): Keep the hashes in the sidecar indexes.
+        index_path (str): The index to keep them in; see hash_images.
+
+    Returns:
+        list: One list of paths per group of two or more near-duplicates, the
+              sharpest first and the rest in the given order.
+    """
+    hashes = hash_images(paths, max_workers, use_index, index_path)
+    hashed = [path for path in dict.fromkeys(paths) if path in hashes]
+    with stage('dedup', count=len(hashed)):
+        values = np.array([hashes[path][0] for path in hashed], dtype=np.uint64)
+        first, second = near_duplicate_pairs(values, max_distance)
+        labels = cluster_labels(len(hashed), first, second).tolist()
+        groups = {}
+        for index, label in enumerate(labels):
+            if label != index:
+                groups.setdefault(label, [label]).append(index)
+        clusters = []
+        for members in groups.values():
+            best = max(members, key=lambda index: (hashes[hashed[index]][1], -index))
+            clusters.append([hashed[best]] + [hashed[index] for index in members if index != best])
+    return clusters
+
+
+def dedupe_images(images, max_distance=DEDUP_DISTANCE, max_workers=None, use_index=True, index_path=None):
+    """
+    Drops near-duplicate images, keeping the sharpest of every group; see find_duplicates.
+
+    Args:
+        images (list): ImageInfo records or an ImageCatalog.
+
+    Returns:
+        The remaining images, in their order and of the type given.
+    """
+    if not isinstance(images, ImageCatalog):
+        images = list(images)
+    paths = images.paths if isinstance(images, ImageCatalog) else [img.path for img in images]
+    dropped = {path for cluster in find_duplicates(paths, max_distance, max_workers, use_index, index_path)
+               for path in cluster[1:]}
+    keep = [i for i, path in enumerate(paths) if path not in dropped]
+    if isinstance(images, ImageCatalog):
+        return images.take(keep)
+    return [images[i] for i in keep]
@@ -0,0 +1,564 @@
+import io
+import os
+import random
+import time
+from collections import namedtuple
+import concurrent.futures
+from concurrent.futures import wait, FIRST_COMPLETED
+import numpy as np
+from photogrid.catalog import ImageCatalog, Placements
+from photogrid.layout import (calculate_target_sizes, target_sizer, calculate_layout_metrics, place_rows,
+                              justified_layout)
+from photogrid.imaging import Image, LazyModule
+from photogrid.layout_cache import image_fingerprint, layout_key
+from photogrid.timing import stage
+
+SEARCH_STEPS = 50
+COVERAGE_GOAL = 0.8
+LAYOUT_MODES = ('greedy', 'justified')
+# Shuffles scored per task by search_shuffles' worker processes
+SHUFFLE_CHUNK = 4
+
+# Only needed to save a collage, so scanning and layout searches do not import them
+_render = LazyModule('photogrid.render')
+_strips = LazyModule('photogrid.strips')
+
+ShuffleSearchResult = namedtuple('ShuffleSearchResult', ['layout', 'score', 'seed', 'shuffles'])
+
+
+def shuffled(images, seed=None):
+    """
+    Returns a shuffled copy of the images. The same seed always gives the same order,
+    for a list and for an ImageCatalog alike, whatever order the images are
+    given in: they are sorted by path before shuffling, so the listing order
+    of a folder, which differs between filesystems, does not matter.
+    """
+    if isinstance(images, ImageCatalog):
+        order = sorted(range(len(images)), key=images.paths.__getitem__)
+        random.Random(seed).shuffle(order)
+        return images.take(order)
+    images = sorted(images, key=lambda img: img.path)
+    random.Random(seed).shuffle(images)
+    return images
+
+
+def _aspect_ratios(images):
+    if isinstance(images, ImageCatalog):
+        return images.aspect_ratios.tolist()
+    return [img.aspect_ratio for img in images]
+
+
+def _average(values):
+    return sum(values) / len(values) if values else 1.0
+
+
+def estimate_target_scale(images, output_w, output_h, min_space):
+    """
+    Guesses the image scale at which the images would roughly fill the canvas.
+    """
+    num_images = len(images)
+    canvas_aspect_ratio = output_w / output_h
+    avg_aspect_ratio = sum(_aspect_ratios(images)) / num_images if num_images > 0 else 1
+
+    # Estimate num columns to guess a width-constrained size
+    est_cols = (num_images * canvas_aspect_ratio / avg_aspect_ratio) ** 0.5
+    est_cols = max(1, round(est_cols))
+
+    # Estimate a target width based on this
+    target_w = (output_w - (est_cols - 1) * min_space) / est_cols
+    target_h = target_w / avg_aspect_ratio
+    target_area = target_w * target_h
+    return max(1, target_area ** 0.5)
+
+
+def size_images(images, scale, output_w, output_h, is_cropping):
+    """
+    Assigns every image its width and height for one candidate scale.
+
+    Returns:
+        list: Dicts with 'path', 'width' and 'height', in the order of images.
+    """
+    if is_cropping:
+        target_aspect_ratio = output_w / output_h
+        img_h = scale
+        img_w = scale * target_aspect_ratio
+        return [{'path': img.path, 'width': img_w, 'height': img_h} for img in images]
+
+    h_imgs = [img for img in images if img.aspect_ratio > 1]
+    v_imgs = [img for img in images if img.aspect_ratio < 1]
+    sizer = calculate_target_sizes(h_imgs, v_imgs)
+    w_h, h_h, w_v, h_v = sizer(scale)
+    sized_images = []
+    for img_info in images:
+        if img_info.aspect_ratio > 1: # Horizontal
+            sized_images.append({'path': img_info.path, 'width': w_h, 'height': h_h})
+        else: # Vertical
+            sized_images.append({'path': img_info.path, 'width': w_v, 'height': h_v})
+    return sized_images
+
+
+def score_rows(rows_of_images, output_w, output_h, min_space):
+    """
+    Scores a set of rows as coverage minus balance penalty, or -1 if they overflow the canvas.
+    """
+    layout_w, layout_h, total_photo_area = calculate_layout_metrics(rows_of_images, min_space)
+
+    if layout_w > output_w or layout_h > output_h:
+        return -1
+
+    coverage_score = total_photo_area / (output_w * output_h)
+    canvas_aspect_ratio = output_w / output_h
+    layout_aspect_ratio = layout_w / layout_h if layout_h > 0 else 0
+    balance_penalty = abs(canvas_aspect_ratio - layout_aspect_ratio) / canvas_aspect_ratio
+    return coverage_score - balance_penalty
+
+
+class LayoutSearch:
+    """
+    Scores every candidate scale of the layout search in one NumPy batch.
+
+    The images are split into two size classes once (horizontal and vertical,
+    or a single class when cropping) and the sizer is evaluated once per scale.
+    Because all images of a class share a size at a given scale, the width of
+    any run of images is a function of how many of each class it contains, so
+    the greedy row breaks of build_rows are found for all scales at once with
+    prefix counts and a binary search, advancing every scale one row per step.
+
+    The scores equal those of build_rows and score_rows up to floating point
+    rounding of the row widths. The images may be a list of ImageInfo or an
+    ImageCatalog; either way they are only read as columns.
+    """
+
+    def __init__(self, images, output_w, output_h, min_space, is_cropping, steps=SEARCH_STEPS):
+        self.images = ImageCatalog.from_infos(images)
+        self.output_w = output_w
+        self.output_h = output_h
+        self.min_space = min_space
+        self.is_cropping = is_cropping
+
+        target_scale = estimate_target_scale(images, output_w, output_h, min_space)
+        self.scales = np.array([target_scale * (0.5 + (i / (steps - 1)) * 2.5) for i in range(steps)])
+
+        # Per-scale size of each class: (width_a, height_a, width_b, height_b)
+        if is_cropping:
+            target_aspect_ratio = output_w / output_h
+            self.is_class_a = np.ones(len(images), dtype=bool)
+            self.sizes = np.array([(scale * target_aspect_ratio, scale, 0.0, 0.0) for scale in self.scales])
+        else:
+            aspect_ratios = self.images.aspect_ratios
+            self.is_class_a = aspect_ratios > 1
+            sizer = target_sizer(_average(aspect_ratios[self.is_class_a].tolist()),
+                                 _average(aspect_ratios[aspect_ratios < 1].tolist()))
+            self.sizes = np.array([sizer(scale) for scale in self.scales])
+
+        self._row_starts = None
+        self._scores = None
+
+    def _find_row_starts(self):
+        """
+        Runs the greedy row breaking for every scale in lockstep.
+
+        Returns:
+            numpy.ndarray: (steps, max_rows) row start indices, padded with -1.
+        """
+        n = len(self.images)
+        steps = len(self.scales)
+        width_a, width_b = self.sizes[:, 0], self.sizes[:, 2]
+
+        # count_a[k]: class-a images among the first k images
+        count_a = np.concatenate(([0], np.cumsum(self.is_class_a)))
+        count_b = np.arange(n + 1) - count_a
+
+        # ends[s, k] = width of the first k images plus k spacings, so images
+        # i..j-1 fit on one row iff ends[j] - ends[i] - min_space <= output_w.
+        ends = (width_a[:, None] * count_a + width_b[:, None] * count_b
+                + np.arange(n + 1) * self.min_space)
+        reach = self.output_w + self.min_space
+
+        # Lay all scales end to end in one increasing array, separated by more
+        # than `reach`, so one searchsorted call serves every scale.
+        offsets = np.concatenate(([0.0], np.cumsum(ends[:, -1] + reach + 1)[:-1]))
+        flat_ends = (ends + offsets[:, None]).ravel()
+        base = np.arange(steps) * (n + 1)
+
+        position = np.zeros(steps, dtype=np.int64)
+        starts = []
+        active = position < n
+        while active.any():
+            starts.append(np.where(active, position, -1))
+            found = np.searchsorted(flat_ends, flat_ends[base + position] + reach, side='right') - 1 - base
+            # A row always takes at least one image
+            position = np.where(active, np.minimum(np.maximum(found, position + 1), n), position)
+            active = position < n
+
+        return np.array(starts, dtype=np.int64).T
+
+    def scores(self):
+        """
+        Returns the score of every candidate scale, as score_rows would compute it.
+        """
+        if self._scores is not None:
+            return self._scores
+
+        n = len(self.images)
+        starts = self._find_row_starts()
+        self._row_starts = starts
+        width_a, height_a, width_b, height_b = (column[:, None] for column in self.sizes.T)
+
+        valid = starts >= 0
+        next_starts = np.concatenate((starts[:, 1:], np.full((len(starts), 1), -1)), axis=1)
+        row_ends = np.where(next_starts >= 0, next_starts, n)
+        safe_starts = np.where(valid, starts, 0)
+        count_a = np.concatenate(([0], np.cumsum(self.is_class_a)))
+        row_a = count_a[row_ends] - count_a[safe_starts]
+        row_len = row_ends - safe_starts
+        row_b = row_len - row_a
+
+        row_width = np.where(valid, width_a * row_a + width_b * row_b + (row_len - 1) * self.min_space, 0)
+        row_height = np.where(valid, np.maximum(np.where(row_a > 0, height_a, 0), np.where(row_b > 0, height_b, 0)), 0)
+
+        num_rows = valid.sum(axis=1)
+        layout_w = row_width.max(axis=1)
+        layout_h = row_height.sum(axis=1) + (num_rows - 1) * self.min_space
+
+        total_a = int(self.is_class_a.sum())
+        total_photo_area = (total_a * width_a * height_a + (n - total_a) * width_b * height_b)[:, 0]
+
+        canvas_aspect_ratio = self.output_w / self.output_h
+        coverage_score = total_photo_area / (self.output_w * self.output_h)
+        layout_aspect_ratio = np.divide(layout_w, layout_h, out=np.zeros_like(layout_w), where=layout_h > 0)
+        balance_penalty = np.abs(canvas_aspect_ratio - layout_aspect_ratio) / canvas_aspect_ratio
+        overflow = (layout_w > self.output_w) | (layout_h > self.output_h)
+        self._scores = np.where(overflow, -1.0, coverage_score - balance_penalty)
+        return self._scores
+
+    def best_index(self):
+        """
+        Returns the index of the best scale; ties go to the smallest scale, as in the original loop.
+        """
+        return int(np.argmax(self.scores()))
+
+    def rows(self, index):
+        """
+        Returns the rows of sized image dicts for one candidate scale.
+        """
+        self.scores()
+        sized_images = size_images(self.images, float(self.scales[index]), self.output_w, self.output_h,
+                                   self.is_cropping)
+        starts = [int(start) for start in self._row_starts[index] if start >= 0]
+        ends = starts[1:] + [len(sized_images)]
+        return [sized_images[start:end] for start, end in zip(starts, ends)]
+
+    def layout(self, index, max_space):
+        """
+        Builds the justified layout for one candidate scale, as construct_layout
+        would from rows(index), without building a dict per image.
+
+        Returns:
+            Placements: The layout.
+        """
+        self.scores()
+        width_a, height_a, width_b, height_b = self.sizes[index].tolist()
+        widths = np.where(self.is_class_a, width_a, width_b)
+        heights = np.where(self.is_class_a, height_a, height_b)
+        starts = [int(start) for start in self._row_starts[index] if start >= 0]
+        return place_rows(self.images.paths, widths, heights, starts, self.output_w, self.min_space, max_space)
+
+
+def search_layout(images, output_w, output_h, min_space, max_space, is_cropping, progress=None, mode='greedy'):
+    """
+    Lays out the images in their given order.
+
+    In 'greedy' mode, SEARCH_STEPS image scales are tried with greedy row
+    building and the best scoring layout is kept. In 'justified' mode, rows
+    are chosen in one pass by justified_layout from the real aspect ratios.
+
+    Args:
+        images (list): ImageInfo records, in placement order.
+        output_w (int): Canvas width.
+        output_h (int): Canvas height.
+        min_space (int): Minimum spacing between images.
+        max_space (int): Maximum spacing between images in a justified row.
+        is_cropping (bool): Crop every image to the canvas aspect ratio.
+        progress (callable): Called with (steps_done, total_steps).
+        mode (str): One of LAYOUT_MODES.
+
+    Returns:
+        Placements: The best layout; empty if there are no images.
+    """
+    if mode not in LAYOUT_MODES:
+        raise ValueError(f"Unknown layout mode: {mode}")
+    if not len(images):
+        return Placements([], [], [], [], [])
+    if progress is not None:
+        progress(0, 1)
+    with stage('search', count=len(images)):
+        if mode == 'justified':
+            best_layout = justified_layout(images, output_w, output_h, min_space, is_cropping)
+        else:
+            search = LayoutSearch(images, output_w, output_h, min_space, is_cropping)
+            best_layout = search.layout(search.best_index(), max_space)
+    if progress is not None:
+        progress(1, 1)
+    return best_layout
+
+
+def seeded_layout(images, output_w, output_h, min_space, max_space, is_cropping, seed, mode='greedy',
+                  cache=None, progress=None):
+    """
+    Lays out the images in the order shuffled(images, seed) gives, as
+    search_layout does, reusing the layout from a LayoutCache if the same
+    images and parameters were laid out with this seed before.
+
+    A seed of None shuffles randomly, and such layouts are never cached.
+
+    Returns:
+        Placements: The layout.
+    """
+    def compute():
+        return search_layout(shuffled(images, seed), output_w, output_h, min_space, max_space, is_cropping,
+                             progress=progress, mode=mode)
+
+    if cache is None or seed is None:
+        return compute()
+    key = layout_key(image_fingerprint(images), (output_w, output_h), min_space, max_space, is_cropping, mode, seed)
+    return cache.get_or_compute(key, compute)
+
+
+def layout_score(layout, output_w, output_h):
+    """
+    Scores a final layout like score_rows: coverage minus balance penalty,
+    measured on the bounding box of the placements, or -1 if it overflows.
+    """
+    placements = Placements.from_dicts(layout)
+    if not len(placements):
+        return -1
+    layout_w = float(np.max(placements.x + placements.width))
+    layout_h = float(np.max(placements.y + placements.height))
+    # Allow for rounding in the row positions
+    if layout_w > output_w + 1e-6 or layout_h > output_h + 1e-6:
+        return -1
+
+    coverage_score = placements.photo_area() / (output_w * output_h)
+    canvas_aspect_ratio = output_w / output_h
+    balance_penalty = abs(canvas_aspect_ratio - layout_w / layout_h) / canvas_aspect_ratio
+    return coverage_score - balance_penalty
+
+
+def score_shuffle(images, seed, output_w, output_h, min_space, max_space, is_cropping, mode='greedy'):
+    """
+    Returns the score of the layout seeded_layout would make with this seed,
+    without building it. Greedy layouts are scored by LayoutSearch, the others
+    by layout_score.
+    """
+    order = shuffled(images, seed)
+    if mode == 'greedy':
+        search = LayoutSearch(order, output_w, output_h, min_space, is_cropping)
+        return float(search.scores()[search.best_index()])
+    return layout_score(justified_layout(order, output_w, output_h, min_space, is_cropping), output_w, output_h)
+
+
+# Per-process state for search_shuffles, set up by _init_shuffle_worker.
+_shuffle_worker = None
+
+
+def _init_shuffle_worker(images, layout_args):
+    global _shuffle_worker
+    _shuffle_worker = (images, layout_args)
+
+
+def _score_shuffle_chunk(candidates, deadline):
+    """
+    Scores (index, seed) candidates until the deadline; at least one is always scored.
+
+    Returns:
+        list: (score, index, seed) per scored candidate.
+    """
+    images, layout_args = _shuffle_worker
+    results = []
+    for index, seed in candidates:
+        if results and time.time() > deadline:
+            break
+        results.append((score_shuffle(images, seed, *layout_args), index, seed))
+    return results
+
+
+def search_shuffles(images, output_w, output_h, min_space, max_space, is_cropping, seed=None, mode='greedy',
+                    time_budget=1.0, max_shuffles=None, workers=None, progress=None, cache=None):
+    """
+    Searches many shuffles of the images, each over all scales as
+    search_layout does, and returns the best scoring layout.
+
+    The shuffles are drawn from a generator seeded with `seed`; the first one
+    is `seed` itself. They are scored in chunks by a process pool, which gets
+    the images once per process, until the time budget is spent or
+    max_shuffles have been scored. Only the winning layout is built, with
+    seeded_layout, so its seed reproduces it exactly. With only max_shuffles
+    set, the result does not depend on the number of workers or the machine.
+
+    Args:
+        images (list): ImageInfo records or an ImageCatalog.
+        output_w (int): Canvas width.
+        output_h (int): Canvas height.
+        min_space (int): Minimum spacing between images.
+        max_space (int): Maximum spacing between images in a justified row.
+        is_cropping (bool): Crop every image to the canvas aspect ratio.
+        seed (int): Seeds the shuffles tried; None picks them at random.
+        mode (str): One of LAYOUT_MODES.
+        time_budget (float): Seconds to search for; None for no limit. The
+                             search overruns it by at most one shuffle per worker.
+        max_shuffles (int): The most shuffles to score; None for no limit.
+        workers (int): Processes; None uses every core, 1 searches in this process.
+        progress (callable): Called with (done, total) as chunks finish: in
+                             seconds of the time budget if there is one, else in shuffles.
+        cache (LayoutCache): Passed on to seeded_layout for the winner.
+
+    Returns:
+        ShuffleSearchResult: (layout, score, seed, shuffles scored).
+    """
+    if mode not in LAYOUT_MODES:
+        raise ValueError(f"Unknown layout mode: {mode}")
+    if time_budget is None and max_shuffles is None:
+        raise ValueError("search_shuffles needs a time_budget or max_shuffles")
+    start = time.time()
+    deadline = start + time_budget if time_budget is not None else float('inf')
+    limit = max_shuffles if max_shuffles is not None else float('inf')
+    images = ImageCatalog.from_infos(images)
+    if not len(images):
+        return ShuffleSearchResult(Placements([], [], [], [], []), -1, seed, 0)
+    layout_args = (output_w, output_h, min_space, max_space, is_cropping, mode)
+
+    rng = random.Random(seed)
+    first_seed = seed if seed is not None else rng.randrange(2 ** 32)
+
+    def next_chunk(count):
+        chunk = []
+        while len(chunk) < SHUFFLE_CHUNK and count + len(chunk) < limit:
+            index = count + len(chunk)
+            chunk.append((index, first_seed if index == 0 else rng.randrange(2 ** 32)))
+        return chunk
+
+    def report(scored):
+        if progress is not None:
+            if time_budget is not None:
+                progress(min(time.time() - start, time_budget), time_budget)
+            else:
+                progress(scored, max_shuffles)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    results = []
+    issued = 0
+    with stage('search', count=0) as record:
+        if workers <= 1 or limit <= SHUFFLE_CHUNK:
+            _init_shuffle_worker(images, layout_args)
+            while issued < limit and (not results or time.time() < deadline):
+                chunk = next_chunk(issued)
+                issued += len(chunk)
+                results.extend(_score_shuffle_chunk(chunk, deadline))
+                report(len(results))
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_shuffle_worker,
+                                                        initargs=(images, layout_args)) as executor:
+                pending = set()
+                try:
+                    while True:
+                        # Keep every worker busy with one chunk queued behind it
+                        while len(pending) < 2 * workers and issued < limit and time.time() < deadline:
+                            chunk = next_chunk(issued)
+                            issued += len(chunk)
+                            pending.add(executor.submit(_score_shuffle_chunk, chunk, deadline))
+                        if not pending:
+                            break
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            results.extend(future.result())
+                        report(len(results))
+                finally:
+                    for future in pending:
+                        future.cancel()
+        record.count = len(results) * len(images)
+
+    # Ties go to the earliest shuffle, so the result does not depend on completion order
+    score, _, best_seed = max(results, key=lambda result: (result[0], -result[1]))
+    layout = seeded_layout(images, output_w, output_h, min_space, max_space, is_cropping, best_seed, mode,
+                           cache=cache)
+    return ShuffleSearchResult(layout, score, best_seed, len(results))
+
+
+def layout_coverage(layout, output_w, output_h):
+    """
+    Returns the fraction of the canvas covered by photos.
+    """
+    if isinstance(layout, Placements):
+        return layout.photo_area() / (output_w * output_h)
+    final_photo_area = sum(img['width'] * img['height'] for img in layout) if layout else 0
+    return final_photo_area / (output_w * output_h)
+
+
+def save_collage(layout, save_path, output_size, background_color='white', crop_aspect_ratio=None,
+                 quality=95, workers=1, progress=None, strip_height=None, cache=None):
+    """
+    Renders a layout and writes it to save_path.
+
+    The image is encoded to a temporary file next to save_path and moved into
+    place once complete, so an interrupted save never leaves a truncated output.
+    With strip_height set, the canvas is never held in memory whole: it is
+    rendered and written as a TIFF one strip at a time by save_collage_strips.
+
+    Args:
+        layout (list): The layout to render.
+        save_path (str): The output file. Its extension selects the format.
+        output_size (tuple): The (width, height) of the canvas.
+        background_color: Any Pillow color specification.
+        crop_aspect_ratio (float): Center-crop every source to this aspect ratio.
+        quality (int): JPEG quality, clamped to 1-100.
+        workers (int): See render_collage.
+        progress (callable): See render_collage.
+        strip_height (int): Render in strips of this many rows; save_path must be a TIFF.
+        cache (TileCache): See render_collage. Not used when rendering in strips.
+    """
+    if strip_height is not None:
+        _strips.save_collage_strips(layout, save_path, output_size, background_color, crop_aspect_ratio,
+                                      strip_height, progress=progress)
+        return
+
+    final_image = _render.render_collage(layout, output_size, background_color, crop_aspect_ratio,
+                                         workers=workers, progress=progress, cache=cache)
+    write_image(final_image, save_path, quality)
+
+
+def encode_image(image, quality=95, image_format='JPEG'):
+    """
+    Encodes a rendered collage in memory, with the options write_image uses.
+
+    Returns:
+        bytes: The encoded image.
+    """
+    buffer = io.BytesIO()
+    with stage('encode') as record:
+        image.save(buffer, format=image_format, quality=max(1, min(100, quality)), optimize=True)
+        record.nbytes = buffer.tell()
+    return buffer.getvalue()
+
+
+def write_image(image, save_path, quality=95):
+    """
+    Encodes a rendered collage to save_path, atomically as save_collage does.
+
+    Args:
+        image (PIL.Image): The rendered collage.
+        save_path (str): The output file. Its extension selects the format.
+        quality (int): JPEG quality, clamped to 1-100.
+    """
+    quality = max(1, min(100, quality))  # Clamp to 1-100 range
+    image_format = Image.registered_extensions().get(os.path.splitext(save_path)[1].lower(), 'JPEG')
+    temp_path = save_path + '.part'
+    try:
+        with stage('encode') as record:
+            image.save(temp_path, format=image_format, quality=quality, optimize=True)
+            record.nbytes = os.path.getsize(temp_path)
+        os.replace(temp_path, save_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
@@ -0,0 +1,240 @@
+import math
+import os
+import shutil
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from photogrid.engine import write_image
+from photogrid.imaging import Image
+from photogrid.render import preview_size
+from photogrid.timing import stage
+
+RENDITION_KINDS = ('image', 'dzi', 'xyz')
+
+# One output of an export:
+#   'image': a single image fitted into max_size x max_size, or the full canvas if max_size is None
+#   'dzi':   a Deep Zoom Image, output.dzi plus its output_files/ tile folders
+#   'xyz':   a {z}/{x}/{y} tile folder at output, as read by Leaflet or OpenLayers
+Rendition = namedtuple('Rendition', ['kind', 'output', 'max_size', 'quality', 'tile_size', 'overlap', 'format'],
+                       defaults=[None, 90, None, 1, 'jpg'])
+
+DEFAULT_TILE_SIZES = {'dzi': 254, 'xyz': 256}
+
+
+def web_renditions(folder, quality=90, web_sizes=(2048, 1024), thumbnail_size=256):
+    """
+    Returns the usual set of renditions for publishing a collage in folder:
+    the full image, web sizes, a thumbnail and a Deep Zoom viewer.
+    """
+    renditions = [Rendition('image', os.path.join(folder, 'full.jpg'), quality=quality)]
+    renditions += [Rendition('image', os.path.join(folder, f'web_{size}.jpg'), size, quality) for size in web_sizes]
+    renditions.append(Rendition('image', os.path.join(folder, 'thumbnail.jpg'), thumbnail_size, quality))
+    renditions.append(Rendition('dzi', os.path.join(folder, 'zoom.dzi'), quality=quality))
+    return renditions
+
+
+def rendition_from_dict(entry, base_dir=''):
+    """
+    Builds a Rendition from a manifest entry, resolving its output against base_dir.
+    """
+    unknown = set(entry) - set(Rendition._fields)
+    if unknown:
+        raise ValueError(f"Unknown rendition fields: {', '.join(sorted(unknown))}")
+    rendition = Rendition(**entry)
+    if rendition.kind not in RENDITION_KINDS:
+        raise ValueError(f"Unknown rendition kind: {rendition.kind}")
+    return rendition._replace(output=os.path.join(base_dir, rendition.output))
+
+
+class Pyramid:
+    """
+    The canvas and its repeated 2x box reductions, down to a single pixel.
+
+    Level 0 is the canvas; level k is about 1/2**k of its size, rounded up as
+    Deep Zoom expects. Each level is reduced from the one above, so the whole
+    pyramid costs about a third of one pass over the canvas.
+    """
+
+    def __init__(self, canvas):
+        self.levels = [canvas]
+        while max(self.levels[-1].size) > 1:
+            self.levels.append(self.levels[-1].reduce(2))
+
+    def __len__(self):
+        return len(self.levels)
+
+    def __getitem__(self, index):
+        return self.levels[index]
+
+    def covering(self, size):
+        """
+        Returns the smallest level that is at least `size` in both dimensions.
+        """
+        for level in reversed(self.levels):
+            if level.size[0] >= size[0] and level.size[1] >= size[1]:
+                return level
+        return self.levels[0]
+
+
+def _image_tasks(pyramid, rendition):
+    canvas = pyramid[0]
+    if rendition.max_size is None:
+        size = canvas.size
+    else:
+        size = preview_size(canvas.size, (rendition.max_size, rendition.max_size))
+
+    def task():
+        source = pyramid.covering(size)
+        image = source if source.size == size else source.resize(size, Image.Resampling.LANCZOS)
+        write_image(image, rendition.output, rendition.quality)
+    return [task]
+
+
+def _save_tile(tile, path, rendition):
+    if rendition.format in ('jpg', 'jpeg'):
+        tile.save(path, format='JPEG', quality=rendition.quality)
+    else:
+        tile.save(path, format=rendition.format.upper())
+
+
+def _dzi_tasks(pyramid, rendition, staging_dir):
+    """
+    Returns the tile writing tasks of a Deep Zoom Image. Level n of the DZI is
+    pyramid level max_level - n, and tiles overlap their neighbours by
+    `overlap` pixels on the sides they share.
+    """
+    tile_size = rendition.tile_size or DEFAULT_TILE_SIZES['dzi']
+    overlap = rendition.overlap
+    max_level = len(pyramid) - 1
+    tasks = []
+    for dzi_level in range(max_level + 1):
+        level = pyramid[max_level - dzi_level]
+        width, height = level.size
+        level_dir = os.path.join(staging_dir, str(dzi_level))
+        os.makedirs(level_dir)
+        for col in range(math.ceil(width / tile_size)):
+            for row in range(math.ceil(height / tile_size)):
+                box = (max(0, col * tile_size - overlap), max(0, row * tile_size - overlap),
+                       min(width, (col + 1) * tile_size + overlap), min(height, (row + 1) * tile_size + overlap))
+                path = os.path.join(level_dir, f"{col}_{row}.{rendition.format}")
+                tasks.append(lambda level=level, box=box, path=path: _save_tile(level.crop(box), path, rendition))
+    return tasks
+
+
+def _xyz_tasks(pyramid, rendition, staging_dir, background_color):
+    """
+    Returns the tile writing tasks of an XYZ tile folder. Zoom 0 fits the
+    whole canvas in one tile; each zoom level doubles the resolution up to the
+    full canvas. Edge tiles are padded with the background color, since XYZ
+    viewers expect every tile to be tile_size square.
+    """
+    tile_size = rendition.tile_size or DEFAULT_TILE_SIZES['xyz']
+    max_zoom = max(0, math.ceil(math.log2(max(pyramid[0].size) / tile_size)))
+    tasks = []
+    for zoom in range(max_zoom + 1):
+        level = pyramid[max_zoom - zoom]
+        width, height = level.size
+        for x in range(math.ceil(width / tile_size)):
+            column_dir = os.path.join(staging_dir, str(zoom), str(x))
+            os.makedirs(column_dir)
+            for y in range(math.ceil(height / tile_size)):
+                box = (x * tile_size, y * tile_size, min(width, (x + 1) * tile_size), min(height, (y + 1) * tile_size))
+                path = os.path.join(column_dir, f"{y}.{rendition.format}")
+
+                def task(level=level, box=box, path=path):
+                    tile = level.crop(box)
+                    if tile.size != (tile_size, tile_size):
+                        padded = Image.new('RGB', (tile_size, tile_size), background_color)
+                        padded.paste(tile, (0, 0))
+                        tile = padded
+                    _save_tile(tile, path, rendition)
+                tasks.append(task)
+    return tasks
+
+
+def _dzi_descriptor(canvas_size, rendition):
+    tile_size = rendition.tile_size or DEFAULT_TILE_SIZES['dzi']
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" Format="{rendition.format}" '
+            f'Overlap="{rendition.overlap}" TileSize="{tile_size}">\n'
+            f'  <Size Width="{canvas_size[0]}" Height="{canvas_size[1]}"/>\n'
+            '</Image>\n')
+
+
+def _tile_set_paths(rendition):
+    """
+    Returns (folder, descriptor path or None) of a tile set rendition.
+    """
+    if rendition.kind == 'dzi':
+        base = os.path.splitext(rendition.output)[0]
+        return base + '_files', base + '.dzi'
+    return rendition.output, None
+
+
+def export_renditions(canvas, renditions, background_color='white', workers=None, progress=None):
+    """
+    Writes every rendition of a rendered collage in one pass.
+
+    The 2x pyramid of the canvas is built once. Each image rendition is
+    resized from the smallest level that still covers it, and every tile set
+    is cut from the pyramid levels, so the full canvas is only read a few
+    times whatever the number of outputs. Images and tiles are encoded on a
+    thread pool; Pillow releases the GIL while encoding, and the threads share
+    the pyramid without copying it.
+
+    Tile sets are written to a staging folder that replaces the previous set
+    once complete, and images are written atomically, so an interrupted export
+    never leaves a partly written output behind.
+
+    Args:
+        canvas (PIL.Image): The rendered collage.
+        renditions (list): Rendition records.
+        background_color: Any Pillow color specification, for padded XYZ tiles.
+        workers (int): Encoding threads; None uses every core.
+        progress (callable): Called with (files_done, total_files).
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    pyramid = Pyramid(canvas)
+
+    tasks = []
+    tile_sets = []
+    for rendition in renditions:
+        if rendition.kind not in RENDITION_KINDS:
+            raise ValueError(f"Unknown rendition kind: {rendition.kind}")
+        if rendition.kind == 'image':
+            os.makedirs(os.path.dirname(rendition.output) or '.', exist_ok=True)
+            tasks.extend(_image_tasks(pyramid, rendition))
+            continue
+        folder, descriptor = _tile_set_paths(rendition)
+        staging_dir = folder + '.part'
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        os.makedirs(staging_dir)
+        if rendition.kind == 'dzi':
+            tasks.extend(_dzi_tasks(pyramid, rendition, staging_dir))
+        else:
+            tasks.extend(_xyz_tasks(pyramid, rendition, staging_dir, background_color))
+        tile_sets.append((rendition, folder, staging_dir, descriptor))
+
+    try:
+        with stage('encode', count=len(tasks)), ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(task) for task in tasks]
+            try:
+                for i, future in enumerate(futures):
+                    future.result()
+                    if progress is not None:
+                        progress(i + 1, len(tasks))
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+
+        for rendition, folder, staging_dir, descriptor in tile_sets:
+            shutil.rmtree(folder, ignore_errors=True)
+            os.replace(staging_dir, folder)
+            if descriptor is not None:
+                with open(descriptor + '.part', 'w') as f:
+                    f.write(_dzi_descriptor(canvas.size, rendition))
+                os.replace(descriptor + '.part', descriptor)
+    finally:
+        for _, _, staging_dir, _ in tile_sets:
+            shutil.rmtree(staging_dir, ignore_errors=True)
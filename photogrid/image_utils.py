@@ -1,70 +1,531 @@
 import os
-from PIL import Image, ImageOps
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from collections import namedtuple
+from photogrid.imaging import IMAGE_PLUGINS, ImageOps, open_image
+from photogrid.timing import stage
 
 ImageInfo = namedtuple('ImageInfo', ['path', 'width', 'height', 'aspect_ratio'])
 
-def analyze_images(folder_path):
+ORIENTATION_TAG = 0x0112
+
+# Transpose that turns stored pixels into displayed pixels, per EXIF orientation,
+# as PIL.Image.Transpose values; plain ints, so that scanning does not import Pillow.
+ORIENTATION_TRANSPOSE = {
+    2: 0,  # FLIP_LEFT_RIGHT
+    3: 3,  # ROTATE_180
+    4: 1,  # FLIP_TOP_BOTTOM
+    5: 5,  # TRANSPOSE
+    6: 4,  # ROTATE_270
+    7: 6,  # TRANSVERSE
+    8: 2,  # ROTATE_90
+}
+
+# Start-of-frame markers carry the image dimensions. 0xC4 (DHT), 0xC8 (JPG)
+# and 0xCC (DAC) share the range but are not frames.
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# Markers that stand alone without a length field.
+_STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7}
+
+
+# TIFF tags read from image headers
+_WIDTH_TAG = 0x0100
+_HEIGHT_TAG = 0x0101
+
+# Paths taken from a folder per probe_images call while streaming a scan
+SCAN_CHUNK = 256
+
+
+def _tiff_endian(header):
     """
-    Scans a directory for JPEG images and categorizes them into horizontal and vertical lists.
+    Returns the struct byte order of a TIFF header, or None if it is not one.
     """
-    horizontal_images = []
-    vertical_images = []
-    
-    valid_extensions = {'.jpg', '.jpeg'}
+    return {b'II': '<', b'MM': '>'}.get(header[:2])
 
-    for filename in os.listdir(folder_path):
-        try:
-            name, ext = os.path.splitext(filename)
-            if ext.lower() not in valid_extensions:
+
+def _ifd_values(data, offset, endian):
+    """
+    Reads the single-valued SHORT and LONG entries of the IFD at `offset` of a TIFF structure.
+
+    Returns:
+        dict: {tag: value}, leaving out entries that do not fit in data.
+    """
+    values = {}
+    if offset + 2 > len(data):
+        return values
+    num_entries = struct.unpack(endian + 'H', data[offset:offset + 2])[0]
+
+    for i in range(num_entries):
+        entry = offset + 2 + i * 12
+        if entry + 12 > len(data):
+            break
+        tag, field_type, count = struct.unpack(endian + 'HHI', data[entry:entry + 8])
+        if count != 1:
+            continue
+        if field_type == 3:  # SHORT
+            values[tag] = struct.unpack(endian + 'H', data[entry + 8:entry + 10])[0]
+        elif field_type == 4:  # LONG
+            values[tag] = struct.unpack(endian + 'I', data[entry + 8:entry + 12])[0]
+    return values
+
+
+def _valid_orientation(values):
+    orientation = values.get(ORIENTATION_TAG, 1)
+    return orientation if 1 <= orientation <= 8 else 1
+
+
+def _tiff_orientation(tiff):
+    """
+    Extracts the Orientation tag from the IFD0 of a TIFF structure held in memory.
+
+    Returns:
+        int: The orientation (1-8), or 1 if it is missing or unreadable.
+    """
+    endian = _tiff_endian(tiff)
+    if endian is None or len(tiff) < 8:
+        return 1
+    ifd_offset = struct.unpack(endian + 'I', tiff[4:8])[0]
+    return _valid_orientation(_ifd_values(tiff, ifd_offset, endian))
+
+
+def _parse_exif_orientation(payload):
+    """
+    Extracts the Orientation tag from the IFD0 of an APP1 Exif payload.
+
+    Returns:
+        int: The orientation (1-8), or 1 if it is missing or unreadable.
+    """
+    if not payload.startswith(b'Exif\x00\x00'):
+        return 1
+    return _tiff_orientation(payload[6:])
+
+
+def read_jpeg_header(path):
+    """
+    Reads the stored dimensions and EXIF orientation of a JPEG without decoding it.
+
+    Only the marker segments before the first scan are read, so the cost does
+    not depend on the size of the compressed image data.
+
+    Args:
+        path (str): Path to the JPEG file.
+
+    Returns:
+        tuple: (width, height, orientation) where width and height are the
+               stored (un-rotated) dimensions.
+
+    Raises:
+        ValueError: If the file is not a JPEG or no frame header is found.
+    """
+    orientation = 1
+    with open(path, 'rb') as f:
+        if f.read(2) != b'\xff\xd8':
+            raise ValueError("Not a JPEG file")
+
+        while True:
+            byte = f.read(1)
+            if not byte:
+                break
+            if byte != b'\xff':
+                continue
+            marker = f.read(1)
+            # Skip fill bytes
+            while marker == b'\xff':
+                marker = f.read(1)
+            if not marker:
+                break
+            marker = marker[0]
+
+            if marker in _STANDALONE_MARKERS:
                 continue
+            if marker in (0xD9, 0xDA):
+                # End of image or start of scan: no frame header follows.
+                break
+
+            length_bytes = f.read(2)
+            if len(length_bytes) < 2:
+                break
+            length = struct.unpack('>H', length_bytes)[0] - 2
+
+            if marker in _SOF_MARKERS:
+                frame = f.read(5)
+                if len(frame) < 5:
+                    break
+                height, width = struct.unpack('>HH', frame[1:5])
+                return width, height, orientation
+            elif marker == 0xE1:
+                payload = f.read(length)
+                if orientation == 1:
+                    orientation = _parse_exif_orientation(payload)
+            else:
+                f.seek(length, os.SEEK_CUR)
+
+    raise ValueError("No JPEG frame header found")
+
+
+def read_png_header(path):
+    """
+    Reads the dimensions of a PNG from its IHDR chunk, and its orientation from
+    an eXIf chunk if one comes before the image data.
+
+    Returns:
+        tuple: (width, height, orientation).
+
+    Raises:
+        ValueError: If the file is not a PNG.
+    """
+    orientation = 1
+    with open(path, 'rb') as f:
+        if f.read(8) != b'\x89PNG\r\n\x1a\n':
+            raise ValueError("Not a PNG file")
+        header = f.read(16)
+        if len(header) < 16 or header[4:8] != b'IHDR':
+            raise ValueError("No PNG image header found")
+        width, height = struct.unpack('>II', header[8:16])
+        f.seek(5 + 4, os.SEEK_CUR)  # Rest of IHDR and its CRC
+
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                break
+            length = struct.unpack('>I', chunk[:4])[0]
+            kind = chunk[4:]
+            if kind in (b'IDAT', b'IEND'):
+                break
+            if kind == b'eXIf':
+                orientation = _tiff_orientation(f.read(length))
+                break
+            f.seek(length + 4, os.SEEK_CUR)
+    return width, height, orientation
+
+
+def _webp_frame_size(kind, data):
+    """
+    Returns the (width, height) stored at the start of a VP8, VP8L or VP8X chunk.
+    """
+    if kind == b'VP8X' and len(data) >= 10:
+        return int.from_bytes(data[4:7], 'little') + 1, int.from_bytes(data[7:10], 'little') + 1
+    if kind == b'VP8 ' and len(data) >= 10 and data[3:6] == b'\x9d\x01\x2a':
+        width, height = struct.unpack('<HH', data[6:10])
+        return width & 0x3FFF, height & 0x3FFF
+    if kind == b'VP8L' and len(data) >= 5 and data[0] == 0x2F:
+        bits = int.from_bytes(data[1:5], 'little')
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    raise ValueError("Invalid WebP frame header")
+
+
+def read_webp_header(path):
+    """
+    Reads the dimensions of a WebP from its first frame chunk, and its
+    orientation from the EXIF chunk if the extended header announces one.
+    Only chunk headers are read on the way there.
 
-            path = os.path.join(folder_path, filename)
-            with Image.open(path) as img:
-                # Apply EXIF orientation before getting dimensions
-                img = ImageOps.exif_transpose(img)
-                width, height = img.size
-                
-                if width == height:
-                    continue # Ignore square images
+    Returns:
+        tuple: (width, height, orientation).
 
-                aspect_ratio = width / height
-                info = ImageInfo(path=path, width=width, height=height, aspect_ratio=aspect_ratio)
+    Raises:
+        ValueError: If the file is not a WebP.
+    """
+    size = None
+    orientation = 1
+    with open(path, 'rb') as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] != b'RIFF' or header[8:] != b'WEBP':
+            raise ValueError("Not a WebP file")
 
-                if aspect_ratio > 1:
-                    horizontal_images.append(info)
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                break
+            kind = chunk[:4]
+            length = struct.unpack('<I', chunk[4:])[0]
+            padded = length + (length & 1)
+            if size is None and kind in (b'VP8 ', b'VP8L', b'VP8X'):
+                data = f.read(min(length, 10))
+                size = _webp_frame_size(kind, data)
+                if kind != b'VP8X' or not data[0] & 0x08:
+                    break  # No EXIF chunk follows
+                f.seek(padded - len(data), os.SEEK_CUR)
+            elif kind == b'EXIF':
+                payload = f.read(length)
+                if payload.startswith(b'Exif'):
+                    orientation = _parse_exif_orientation(payload)
                 else:
-                    vertical_images.append(info)
-        except Exception as e:
-            # Ignore files that are not valid images
-            print(f"Could not process file {filename}: {e}")
-            continue
-            
+                    orientation = _tiff_orientation(payload)
+                break
+            else:
+                f.seek(padded, os.SEEK_CUR)
+
+    if size is None:
+        raise ValueError("No WebP frame header found")
+    return size[0], size[1], orientation
+
+
+def read_tiff_header(path):
+    """
+    Reads the dimensions and orientation of a TIFF from its first IFD.
+
+    Returns:
+        tuple: (width, height, orientation).
+
+    Raises:
+        ValueError: If the file is not a classic TIFF or has no dimensions.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(8)
+        endian = _tiff_endian(header)
+        if endian is None or len(header) < 8 or struct.unpack(endian + 'H', header[2:4])[0] != 42:
+            raise ValueError("Not a TIFF file")
+        f.seek(struct.unpack(endian + 'I', header[4:8])[0])
+        count = f.read(2)
+        if len(count) < 2:
+            raise ValueError("No TIFF image directory found")
+        data = count + f.read(struct.unpack(endian + 'H', count)[0] * 12)
+
+    values = _ifd_values(data, 0, endian)
+    if _WIDTH_TAG not in values or _HEIGHT_TAG not in values:
+        raise ValueError("No TIFF image dimensions found")
+    return values[_WIDTH_TAG], values[_HEIGHT_TAG], _valid_orientation(values)
+
+
+# Header readers by file extension. Each returns the stored (width, height,
+# orientation) of a file without decoding it, and raises ValueError if it
+# cannot; files of an extension without a reader are measured by Pillow.
+FORMAT_PROBES = {}
+
+# Extensions of the files that are scanned
+VALID_EXTENSIONS = FORMAT_PROBES.keys()
+
+
+def register_format(extensions, probe=None, plugin=None):
+    """
+    Makes scans pick up files with the given extensions.
+
+    Args:
+        extensions (iterable): Extensions including the dot, e.g. ('.heic',).
+        probe (callable): Reads (width, height, orientation) from a path, see
+                          FORMAT_PROBES. If None, files are opened with Pillow,
+                          which must then be able to decode them.
+        plugin (str): The module that registers the Pillow plugin decoding
+                      these files, imported before one is opened.
+    """
+    for ext in extensions:
+        FORMAT_PROBES[ext.lower()] = probe
+        if plugin is not None:
+            IMAGE_PLUGINS[ext.lower()] = plugin
+
+
+register_format(('.jpg', '.jpeg'), read_jpeg_header)
+register_format(('.png',), read_png_header)
+register_format(('.webp',), read_webp_header)
+register_format(('.tif', '.tiff'), read_tiff_header)
+
+
+def get_oriented_size(path, header_only=True):
+    """
+    Returns the dimensions of an image as displayed after applying its EXIF orientation.
+
+    Args:
+        path (str): Path to the image file.
+        header_only (bool): Read only the file header, with the format's probe
+                            in FORMAT_PROBES, instead of decoding and
+                            transposing the image. Falls back to a full decode
+                            if the header cannot be parsed.
+
+    Returns:
+        tuple: (width, height, orientation).
+    """
+    probe = FORMAT_PROBES.get(os.path.splitext(path)[1].lower())
+    if header_only and probe is not None:
+        try:
+            width, height, orientation = probe(path)
+            if orientation >= 5:
+                # Orientations 5-8 involve a 90 degree rotation.
+                width, height = height, width
+            return width, height, orientation
+        except (OSError, ValueError, struct.error):
+            pass
+
+    with open_image(path) as img:
+        orientation = img.getexif().get(ORIENTATION_TAG, 1)
+        img = ImageOps.exif_transpose(img)
+        width, height = img.size
+    return width, height, orientation
+
+
+def iter_image_paths(folder_path, recursive=False):
+    """
+    Yields the image files in a directory as they are found, in directory listing order.
+
+    Files are picked by the extension in their directory entry, so nothing is
+    stat'ed or opened. With recursive set, subdirectories are walked depth
+    first after the files of their parent; hidden ones and symbolic links to
+    directories are skipped, and unreadable ones are ignored.
+    """
+    pending = [folder_path]
+    while pending:
+        directory = pending.pop()
+        subdirectories = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if os.path.splitext(entry.name)[1].lower() in FORMAT_PROBES:
+                        yield entry.path
+                    elif recursive and not entry.name.startswith('.') and entry.is_dir(follow_symlinks=False):
+                        subdirectories.append(entry.path)
+        except OSError:
+            if directory is folder_path:
+                raise
+        pending.extend(reversed(subdirectories))
+
+
+def list_image_paths(folder_path, recursive=False):
+    """
+    Lists the image files in a directory, in directory listing order; see iter_image_paths.
+    """
+    return list(iter_image_paths(folder_path, recursive))
+
+
+def _probe_file(path, header_only):
+    """
+    Returns (width, height, orientation) for a single file, or None if it cannot be read.
+    """
+    try:
+        return get_oriented_size(path, header_only)
+    except Exception as e:
+        # Ignore files that are not valid images
+        print(f"Could not process file {os.path.basename(path)}: {e}")
+        return None
+
+
+def probe_images(paths, header_only=True, max_workers=None):
+    """
+    Reads the oriented dimensions of many files, spread over a thread pool.
+
+    Args:
+        paths (list): The files to read.
+        header_only (bool): See get_oriented_size.
+        max_workers (int): Number of threads to use; 1 reads serially.
+
+    Returns:
+        list: A (width, height, orientation) tuple per path, or None for files
+              that could not be read.
+    """
+    if max_workers == 1 or len(paths) <= 1:
+        return [_probe_file(path, header_only) for path in paths]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda path: _probe_file(path, header_only), paths))
+
+
+def make_image_info(path, width, height):
+    """
+    Builds the ImageInfo for an image, or returns None for square images, which are ignored.
+    """
+    if width == height:
+        return None
+    return ImageInfo(path=path, width=width, height=height, aspect_ratio=width / height)
+
+
+def split_by_orientation(images):
+    """
+    Splits ImageInfo records into (horizontal_images, vertical_images), preserving order.
+    """
+    horizontal_images = []
+    vertical_images = []
+    for info in images:
+        if info.aspect_ratio > 1:
+            horizontal_images.append(info)
+        else:
+            vertical_images.append(info)
     return horizontal_images, vertical_images
 
-def crop_to_aspect_ratio(image, target_aspect_ratio):
+
+def scan_images(folder_path, header_only=True, max_workers=None, recursive=False):
     """
-    Crops an image to match a target aspect ratio, cutting from the center.
+    Yields an ImageInfo for every usable image in a directory, or with
+    recursive set in its whole tree, as soon as it is read.
+
+    The tree is walked lazily and read SCAN_CHUNK files at a time, so a caller
+    can show a running count, or start laying out the first images, long
+    before a large tree has been walked. Unreadable and square images are
+    skipped.
 
     Args:
-        image (PIL.Image): The image to crop.
-        target_aspect_ratio (float): The desired aspect ratio (width / height).
+        folder_path (str): The directory to scan.
+        header_only (bool): See get_oriented_size.
+        max_workers (int): See probe_images.
+        recursive (bool): Include subdirectories; see iter_image_paths.
+
+    Yields:
+        ImageInfo: The images, in directory listing order.
+    """
+    paths = iter_image_paths(folder_path, recursive)
+    while True:
+        with stage('scan') as record:
+            chunk = list(islice(paths, SCAN_CHUNK))
+            record.count = len(chunk)
+        if not chunk:
+            return
+        with stage('probe', count=len(chunk)):
+            sizes = probe_images(chunk, header_only, max_workers)
+        for path, size in zip(chunk, sizes):
+            if size is None:
+                continue
+            info = make_image_info(path, size[0], size[1])
+            if info is not None:
+                yield info
+
+
+def analyze_images(folder_path, header_only=True, max_workers=None, recursive=False):
+    """
+    Scans a directory for images and categorizes them into horizontal and vertical lists.
+
+    Args:
+        folder_path (str): The directory to scan.
+        header_only (bool): Read dimensions and orientation from the file header
+                            instead of decoding every image.
+        max_workers (int): Number of threads used to read the files. Defaults to
+                           the ThreadPoolExecutor default; 1 scans serially.
+        recursive (bool): Include subdirectories.
 
     Returns:
-        PIL.Image: The cropped image.
+        tuple: (horizontal_images, vertical_images) as lists of ImageInfo, in
+               directory listing order.
+    """
+    return split_by_orientation(scan_images(folder_path, header_only, max_workers, recursive))
+
+def crop_box(img_width, img_height, target_aspect_ratio):
+    """
+    Calculates the centered box that crop_to_aspect_ratio would cut from an image.
+
+    Returns:
+        tuple: (left, upper, right, lower) as floats.
     """
-    img_width, img_height = image.size
     img_aspect_ratio = img_width / img_height
 
     if img_aspect_ratio > target_aspect_ratio:
         # Image is wider than target, crop the sides
         new_width = int(target_aspect_ratio * img_height)
         offset = (img_width - new_width) / 2
-        box = (offset, 0, img_width - offset, img_height)
+        return (offset, 0, img_width - offset, img_height)
     else:
         # Image is taller than target, crop the top and bottom
         new_height = int(img_width / target_aspect_ratio)
         offset = (img_height - new_height) / 2
-        box = (0, offset, img_width, img_height - offset)
-        
-    return image.crop(box)
+        return (0, offset, img_width, img_height - offset)
+
+
+def crop_to_aspect_ratio(image, target_aspect_ratio):
+    """
+    Crops an image to match a target aspect ratio, cutting from the center.
+
+    Args:
+        image (PIL.Image): The image to crop.
+        target_aspect_ratio (float): The desired aspect ratio (width / height).
+
+    Returns:
+        PIL.Image: The cropped image.
+    """
+    img_width, img_height = image.size
+    return image.crop(crop_box(img_width, img_height, target_aspect_ratio))
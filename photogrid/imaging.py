@@ -0,0 +1,84 @@
+import importlib
+import io
+import os
+
+# Pillow plugins that Image.preinit() does not load, by file extension. Without
+# them, opening such a file makes Pillow import every plugin it has.
+IMAGE_PLUGINS = {
+    '.webp': 'PIL.WebPImagePlugin',
+    '.tif': 'PIL.TiffImagePlugin',
+    '.tiff': 'PIL.TiffImagePlugin',
+}
+
+
+class LazyModule:
+    """
+    Stands in for a module that is only imported when one of its attributes
+    is first used, so code that never touches it does not pay for the import.
+
+    Args:
+        name (str): The module to import.
+        setup (callable): Called with the module once it is imported.
+    """
+
+    def __init__(self, name, setup=None):
+        self._name = name
+        self._setup = setup
+        self._module = None
+
+    def __getattr__(self, attr):
+        if attr.startswith('__'):
+            raise AttributeError(attr)
+        if self._module is None:
+            module = importlib.import_module(self._name)
+            if self._setup is not None:
+                self._setup(module)
+            self._module = module
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f"<lazy module {self._name!r} ({state})>"
+
+
+def _preinit(image_module):
+    # Registers only the common plugins (JPEG, PNG, GIF, BMP, PPM) instead of all of them
+    image_module.preinit()
+
+
+# Pillow, imported on first use. Scanning headers and searching layouts never touch it.
+Image = LazyModule('PIL.Image', setup=_preinit)
+ImageOps = LazyModule('PIL.ImageOps')
+ExifTags = LazyModule('PIL.ExifTags')
+
+
+def open_image(path):
+    """
+    Opens an image with Image.open, first importing just the plugin its
+    extension needs if preinit does not cover it.
+    """
+    plugin = IMAGE_PLUGINS.get(os.path.splitext(path)[1].lower())
+    if plugin is not None:
+        importlib.import_module(plugin)
+    return Image.open(path)
+
+
+def exif_thumbnail(img):
+    """
+    Returns the decoded EXIF thumbnail embedded in an open image, or None.
+    """
+    raw = img.info.get('exif')
+    if not raw:
+        return None
+    try:
+        thumbnail_ifd = img.getexif().get_ifd(ExifTags.IFD.IFD1)
+        offset, length = thumbnail_ifd.get(0x0201), thumbnail_ifd.get(0x0202)
+        if not offset or not length:
+            return None
+        # Offsets count from the TIFF header, which follows the APP1 "Exif" prefix.
+        base = 6 if raw.startswith(b'Exif\x00\x00') else 0
+        thumbnail = Image.open(io.BytesIO(raw[base + offset:base + offset + length]))
+        thumbnail.load()
+        return thumbnail
+    except Exception:
+        return None
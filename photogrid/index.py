@@ -0,0 +1,361 @@
+import os
+import sqlite3
+from itertools import islice
+from photogrid.image_utils import (SCAN_CHUNK, iter_image_paths, probe_images, make_image_info, split_by_orientation,
+                                   analyze_images, scan_images)
+from photogrid.timing import stage
+
+INDEX_FILENAME = '.photogrid_index.sqlite3'
+
+_SCHEMA_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    orientation INTEGER NOT NULL
+)
+"""
+
+# Content-aware crop boxes, in oriented pixels, per image and target aspect ratio
+_CROP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS crops (
+    path TEXT NOT NULL,
+    aspect_ratio REAL NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    left REAL NOT NULL,
+    top REAL NOT NULL,
+    right REAL NOT NULL,
+    bottom REAL NOT NULL,
+    PRIMARY KEY (path, aspect_ratio)
+)
+"""
+
+# Perceptual hashes and sharpness scores for duplicate detection; the 64-bit
+# hashes are stored as signed integers, as SQLite keeps them.
+_HASH_SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    hash INTEGER NOT NULL,
+    sharpness REAL NOT NULL
+)
+"""
+
+
+class ImageIndex:
+    """
+    A persistent SQLite index of image metadata, keyed by path, file size and mtime.
+
+    Rescanning a folder only reads files that are new or have changed since they
+    were last indexed. Files that could not be read are remembered with a zero
+    width so they are not retried until they change. The index also keeps the
+    content-aware crop boxes planned for its images and their perceptual hashes.
+    Those are kept in tables of their own rather than in the scan records, as
+    computing them decodes pixels while a scan reads only headers; they are
+    keyed by size and mtime too, so a changed file invalidates them alike.
+    """
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.connection = sqlite3.connect(index_path)
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != _SCHEMA_VERSION:
+            # Everything stored is keyed to the images table, so it all starts over
+            for table in ('images', 'crops', 'hashes'):
+                self.connection.execute(f"DROP TABLE IF EXISTS {table}")
+            self.connection.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+        self.connection.execute(_SCHEMA)
+        self.connection.execute(_CROP_SCHEMA)
+        self.connection.execute(_HASH_SCHEMA)
+        self.connection.commit()
+
+    @classmethod
+    def for_folder(cls, folder_path):
+        """
+        Opens the sidecar index stored inside an image folder.
+        """
+        return cls(os.path.join(folder_path, INDEX_FILENAME))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def get(self, path):
+        """
+        Returns the indexed (width, height, orientation) for a path, or None if it
+        is not indexed or the file has changed since.
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        row = self.connection.execute(
+            "SELECT size, mtime_ns, width, height, orientation FROM images WHERE path = ?",
+            (os.path.abspath(path),)).fetchone()
+        if row is None or row[0] != stat.st_size or row[1] != stat.st_mtime_ns or row[2] == 0:
+            return None
+        return row[2], row[3], row[4]
+
+    def scan(self, folder_path, header_only=True, max_workers=None, recursive=False):
+        """
+        Scans a folder like analyze_images, reading only files missing from the index.
+
+        Args:
+            folder_path (str): The directory to scan.
+            header_only (bool): See analyze_images.
+            max_workers (int): See analyze_images.
+            recursive (bool): See analyze_images.
+
+        Returns:
+            tuple: (horizontal_images, vertical_images) as lists of ImageInfo,
+                   identical to what analyze_images returns.
+        """
+        return split_by_orientation(self.iter_scan(folder_path, header_only, max_workers, recursive))
+
+    def iter_scan(self, folder_path, header_only=True, max_workers=None, recursive=False):
+        """
+        Scans a folder like scan_images, yielding every image as soon as it is
+        known and reading only files missing from the index. New entries are
+        written as each chunk of the folder is read.
+
+        Yields:
+            ImageInfo: The images, in directory listing order.
+        """
+        known = {row[0]: row[1:] for row in self.connection.execute(
+            "SELECT path, size, mtime_ns, width, height, orientation FROM images")}
+        paths = iter_image_paths(folder_path, recursive)
+        while True:
+            with stage('scan') as record:
+                entries = []
+                stale = []
+                for path in islice(paths, SCAN_CHUNK):
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    key = os.path.abspath(path)
+                    row = known.get(key)
+                    if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+                        entries.append((path, row[2], row[3]))
+                    else:
+                        entries.append((path, None, None))
+                        stale.append((path, key, stat))
+                record.count = len(entries)
+            if not entries:
+                return
+
+            if stale:
+                with stage('probe', count=len(stale)):
+                    sizes = probe_images([path for path, _, _ in stale], header_only, max_workers)
+                probed = {}
+                records = []
+                for (path, key, stat), size in zip(stale, sizes):
+                    width, height, orientation = size if size is not None else (0, 0, 0)
+                    probed[path] = (width, height)
+                    records.append((key, stat.st_size, stat.st_mtime_ns, width, height, orientation))
+                with self.connection:
+                    self.connection.executemany("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?)", records)
+                entries = [(path, *probed[path]) if width is None else (path, width, height)
+                           for path, width, height in entries]
+
+            for path, width, height in entries:
+                if width == 0:
+                    continue # Unreadable file
+                info = make_image_info(path, width, height)
+                if info is not None:
+                    yield info
+
+    def get_crops(self, paths, aspect_ratio):
+        """
+        Returns the stored crop boxes for a target aspect ratio, as {path: (left, top, right, bottom)},
+        leaving out paths without a box and files that have changed since theirs was stored.
+        """
+        rows = self.connection.execute(
+            "SELECT path, size, mtime_ns, left, top, right, bottom FROM crops WHERE aspect_ratio = ?",
+            (round(aspect_ratio, 6),))
+        known = {row[0]: row[1:] for row in rows}
+        boxes = {}
+        for path in paths:
+            row = known.get(os.path.abspath(path))
+            if row is None:
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+                boxes[path] = row[2:]
+        return boxes
+
+    def put_crops(self, boxes, aspect_ratio):
+        """
+        Stores crop boxes for a target aspect ratio, given as {path: (left, top, right, bottom)}.
+        """
+        records = []
+        for path, box in boxes.items():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            records.append((os.path.abspath(path), round(aspect_ratio, 6), stat.st_size, stat.st_mtime_ns, *box))
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO crops VALUES (?, ?, ?, ?, ?, ?, ?, ?)", records)
+
+    def get_hashes(self, paths):
+        """
+        Returns the stored (hash, sharpness) of images, as {path: (hash, sharpness)},
+        leaving out paths without one and files that have changed since theirs was stored.
+        """
+        known = {row[0]: row[1:] for row in
+                 self.connection.execute("SELECT path, size, mtime_ns, hash, sharpness FROM hashes")}
+        hashes = {}
+        for path in paths:
+            row = known.get(os.path.abspath(path))
+            if row is None:
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+                hashes[path] = (row[2] % 2 ** 64, row[3])
+        return hashes
+
+    def put_hashes(self, hashes):
+        """
+        Stores the (hash, sharpness) of images, given as {path: (hash, sharpness)}.
+        """
+        records = []
+        for path, (value, sharpness) in hashes.items():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            signed = value - 2 ** 64 if value >= 2 ** 63 else value
+            records.append((os.path.abspath(path), stat.st_size, stat.st_mtime_ns, signed, sharpness))
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?)", records)
+
+    def invalidate(self, paths=None):
+        """
+        Drops index entries so they are re-read on the next scan.
+
+        Args:
+            paths (list): The files to invalidate, or None to clear the whole index.
+
+        Returns:
+            int: The number of entries removed.
+        """
+        with self.connection:
+            if paths is None:
+                self.connection.execute("DELETE FROM crops")
+                self.connection.execute("DELETE FROM hashes")
+                return self.connection.execute("DELETE FROM images").rowcount
+            keys = [(os.path.abspath(path),) for path in paths]
+            self.connection.executemany("DELETE FROM crops WHERE path = ?", keys)
+            self.connection.executemany("DELETE FROM hashes WHERE path = ?", keys)
+            cursor = self.connection.executemany("DELETE FROM images WHERE path = ?", keys)
+            return cursor.rowcount
+
+    def compact(self):
+        """
+        Removes entries for files that no longer exist and reclaims their space on disk.
+
+        Returns:
+            int: The number of entries removed.
+        """
+        missing = [(path,) for (path,) in self.connection.execute("SELECT path FROM images")
+                   if not os.path.exists(path)]
+        with self.connection:
+            self.connection.executemany("DELETE FROM images WHERE path = ?", missing)
+            self.connection.executemany("DELETE FROM crops WHERE path = ?", missing)
+            self.connection.executemany("DELETE FROM hashes WHERE path = ?", missing)
+        self.connection.execute("VACUUM")
+        return len(missing)
+
+
+def index_groups(paths, index_path=None):
+    """
+    Groups images by the index their crop boxes and hashes are kept in: the
+    given index_path for all of them, usually that of the folder they were
+    scanned from, or else the sidecar index of each image's own folder.
+
+    Returns:
+        dict: {index path: [image paths]}
+    """
+    if index_path is not None:
+        return {index_path: list(paths)}
+    groups = {}
+    for path in paths:
+        folder = os.path.dirname(os.path.abspath(path))
+        groups.setdefault(os.path.join(folder, INDEX_FILENAME), []).append(path)
+    return groups
+
+
+def analyze_images_cached(folder_path, index_path=None, **kwargs):
+    """
+    Scans a folder through its persistent index, falling back to a plain
+    analyze_images scan if the index cannot be opened or written.
+
+    Args:
+        folder_path (str): The directory to scan.
+        index_path (str): Where to keep the index. Defaults to a sidecar file
+                          inside the folder.
+        **kwargs: Passed on to the scan.
+
+    Returns:
+        tuple: (horizontal_images, vertical_images).
+    """
+    if index_path is None:
+        index_path = os.path.join(folder_path, INDEX_FILENAME)
+    try:
+        with ImageIndex(index_path) as index:
+            return index.scan(folder_path, **kwargs)
+    except sqlite3.Error as e:
+        print(f"Could not use image index {index_path}: {e}")
+        return analyze_images(folder_path, **kwargs)
+
+
+def scan_images_cached(folder_path, index_path=None, **kwargs):
+    """
+    Streams a folder scan through its persistent index like analyze_images_cached,
+    yielding ImageInfo records as scan_images does.
+
+    If the index cannot be opened or written, the scan goes on without it,
+    skipping the images already yielded.
+
+    Args:
+        folder_path (str): The directory to scan.
+        index_path (str): Where to keep the index. Defaults to a sidecar file
+                          inside the folder.
+        **kwargs: Passed on to the scan.
+
+    Yields:
+        ImageInfo: The images, in directory listing order.
+    """
+    if index_path is None:
+        index_path = os.path.join(folder_path, INDEX_FILENAME)
+    yielded = 0
+    try:
+        with ImageIndex(index_path) as index:
+            for info in index.iter_scan(folder_path, **kwargs):
+                yield info
+                yielded += 1
+            return
+    except sqlite3.Error as e:
+        print(f"Could not use image index {index_path}: {e}")
+    yield from islice(scan_images(folder_path, **kwargs), yielded, None)
@@ -1,4 +1,11 @@
 import math
+import numpy as np
+from photogrid.catalog import ImageCatalog, Placements
+
+# Default upper bound on the images per row considered by partition_rows
+MAX_ROW_WINDOW = 1024
+# partition_rows forms no row taller than this many target heights, unless no other partition exists
+MAX_ROW_HEIGHT_FACTOR = 3
 
 def calculate_target_sizes(horizontal_images, vertical_images):
     """
@@ -21,7 +28,12 @@ def calculate_target_sizes(horizontal_images, vertical_images):
     
     avg_ar_h = sum(img.aspect_ratio for img in horizontal_images) / len(horizontal_images) if horizontal_images else 1.0
     avg_ar_v = sum(img.aspect_ratio for img in vertical_images) / len(vertical_images) if vertical_images else 1.0
+    return target_sizer(avg_ar_h, avg_ar_v)
 
+def target_sizer(avg_ar_h, avg_ar_v):
+    """
+    Returns the sizer of calculate_target_sizes for already averaged aspect ratios.
+    """
     def sizer(scale):
         # For horizontal images, scale is the height
         h_h = scale
@@ -51,22 +63,24 @@ def build_rows(images, output_width, min_spacing):
 
     # Start with the first image in the first row
     rows = [[images[0]]]
+    # Running total of the image widths in the current row
+    current_row_width = images[0]['width']
     
     # Iterate over the rest of the images
     for image in images[1:]:
         current_row = rows[-1]
         
-        # Calculate the width of the current row if we add the new image
-        current_row_width = sum(img['width'] for img in current_row)
         # The number of spaces in the potential new row is len(current_row)
         potential_width = current_row_width + (len(current_row) * min_spacing) + image['width']
 
         if potential_width <= output_width:
             # Add the image to the current row
             current_row.append(image)
+            current_row_width += image['width']
         else:
             # Start a new row
             rows.append([image])
+            current_row_width = image['width']
             
     return rows
 
@@ -99,3 +113,297 @@ def justify_row(row, output_width, min_spacing, max_spacing):
         current_x += image['width'] + final_spacing
         
     return positions
+
+def calculate_layout_metrics(rows_of_images, min_space):
+    """
+    Measures a set of rows stacked top to bottom with min_space between them.
+
+    Returns:
+        tuple: (layout_w, layout_h, total_photo_area).
+    """
+    layout_w = 0
+    layout_h = 0
+    total_photo_area = 0
+    current_y = 0
+    for row in rows_of_images:
+        row_height = max(img['height'] for img in row)
+        row_width = sum(img['width'] for img in row) + (len(row) - 1) * min_space if len(row) > 1 else sum(img['width'] for img in row)
+        layout_w = max(layout_w, row_width)
+        layout_h = current_y + row_height
+        current_y += row_height + min_space
+        total_photo_area += sum(img['width'] * img['height'] for img in row)
+    return layout_w, layout_h, total_photo_area
+
+def construct_layout(rows_of_images, output_w, min_space, max_space):
+    """
+    Justifies each row and stacks the rows into the final layout.
+
+    Returns:
+        list: Dicts with 'path', 'x', 'y', 'width' and 'height' per image.
+    """
+    final_layout = []
+    current_y = 0
+    for row in rows_of_images:
+        row_height = max(img['height'] for img in row)
+        justified_positions = justify_row(row, output_w, min_space, max_space)
+        for pos_info in justified_positions:
+            final_layout.append({
+                'path': pos_info['image']['path'],
+                'x': pos_info['x'], 'y': current_y,
+                'width': pos_info['image']['width'], 'height': pos_info['image']['height']
+            })
+        current_y += row_height + min_space
+    return final_layout
+
+def place_rows(paths, widths, heights, starts, output_w, min_space, max_space):
+    """
+    Justifies and stacks rows like construct_layout, reading the image sizes
+    from arrays and returning Placements instead of a dict per image.
+
+    Args:
+        paths (list): The path of every image, in placement order.
+        widths (array): The width of every image.
+        heights (array): The height of every image.
+        starts (list): The index at which each row starts.
+        output_w (int): Canvas width.
+        min_space (int): Minimum spacing between images and rows.
+        max_space (int): Maximum spacing between images in a row.
+
+    Returns:
+        Placements: The final layout.
+    """
+    widths = np.asarray(widths, dtype=float)
+    heights = np.asarray(heights, dtype=float)
+    x = np.zeros(len(paths))
+    y = np.empty(len(paths))
+    width_list = widths.tolist()
+    ends = list(starts[1:]) + [len(paths)]
+
+    current_y = 0
+    for start, end in zip(starts, ends):
+        if end - start > 1:
+            # Same spacing as justify_row
+            num_gaps = end - start - 1
+            leftover_space = output_w - sum(width_list[start:end]) - num_gaps * min_space
+            extra_spacing_per_gap = leftover_space / num_gaps if leftover_space > 0 else 0
+            final_spacing = min(min_space + extra_spacing_per_gap, max_space)
+            x[start + 1:end] = np.cumsum(widths[start:end - 1] + final_spacing)
+        y[start:end] = current_y
+        current_y += heights[start:end].max() + min_space
+    return Placements(paths, x, y, widths, heights)
+
+def estimate_row_height(aspect_ratios, output_w, output_h, min_spacing):
+    """
+    Estimates the row height at which the images, laid out in full-width rows,
+    would stack to exactly the canvas height.
+
+    At row height t a row holds about (output_w + s) / (t * a + s) images, where
+    a is the average aspect ratio and s the spacing, so n images need
+    n * (t * a + s) / (output_w + s) rows of height t + s. Setting that equal to
+    output_h + s gives a quadratic in t. When the spacing alone would not fit
+    on the canvas there is no positive solution, and one pixel is returned.
+    """
+    n = len(aspect_ratios)
+    total_aspect_ratio = sum(aspect_ratios)
+    a = total_aspect_ratio
+    b = (total_aspect_ratio + n) * min_spacing
+    c = n * min_spacing * min_spacing - (output_w + min_spacing) * (output_h + min_spacing)
+    return max(1.0, (-b + math.sqrt(b * b - 4 * a * c)) / (2 * a))
+
+def partition_rows(aspect_ratios, output_w, target_height, min_spacing, window=None):
+    """
+    Splits a sequence of images into full-width rows, minimizing the squared
+    relative deviation of every row height from target_height.
+
+    This is a Knuth-Plass style dynamic program over break points. Each row is
+    scaled so that its images fill output_w exactly, which gives it the height
+    (output_w - gaps) / sum(aspect ratios). Only rows of at most `window`
+    images are considered, so the cost is O(n * window).
+
+    Rows taller than MAX_ROW_HEIGHT_FACTOR times the target height are left
+    out. Then no row can start within the first images after a break, so the
+    best breaks of a whole block of row ends depend only on breaks found
+    before it. Each block is scored in one NumPy pass, which leaves a few
+    Python iterations per row instead of one per image. If no partition
+    remains without such rows, the search is repeated with them allowed.
+
+    Args:
+        aspect_ratios (list): The aspect ratio of each image, in order.
+        output_w (float): The row width.
+        target_height (float): The ideal row height.
+        min_spacing (float): The spacing between images in a row.
+        window (int): The most images a row may hold. Defaults to twice the
+                      number that fit on a row at the target height, capped
+                      at MAX_ROW_WINDOW.
+
+    Returns:
+        list: The index at which each row starts.
+    """
+    n = len(aspect_ratios)
+    if n == 0:
+        return []
+
+    aspect_ratios = np.asarray(aspect_ratios, dtype=float)
+    if window is None:
+        window = max(1, min(MAX_ROW_WINDOW, math.ceil(2 * output_w / (target_height * aspect_ratios.mean()))))
+    if min_spacing > 0:
+        window = min(window, math.ceil(output_w / min_spacing))  # Longer rows are all gaps
+    window = min(window, n)
+
+    prefix = np.concatenate(([0.0], np.cumsum(aspect_ratios)))
+    best_start = _best_row_starts(prefix, output_w, target_height, min_spacing, window,
+                                  MAX_ROW_HEIGHT_FACTOR * target_height)
+    if best_start is None:
+        best_start = _best_row_starts(prefix, output_w, target_height, min_spacing, window, math.inf)
+
+    starts = []
+    end = n
+    while end > 0:
+        end = int(best_start[end])
+        starts.append(end)
+    starts.reverse()
+    return starts
+
+def _best_row_starts(prefix, output_w, target_height, min_spacing, window, max_height):
+    """
+    Runs the dynamic program of partition_rows over rows at most max_height tall.
+
+    Returns:
+        array: The best start of the last row ending before each image index,
+               or None if the images cannot be partitioned into such rows.
+    """
+    n = len(prefix) - 1
+    best_cost = np.full(n + 1, np.inf)
+    best_cost[0] = 0.0
+    best_start = np.zeros(n + 1, dtype=np.int64)
+
+    settled = 0
+    while settled < n:
+        # The block grows while the widest row that could start inside it is still too
+        # tall: images settled+1 .. settled+count for a block of count+1 row ends
+        counts = np.arange(1, min(window, n - settled))
+        widths = output_w - (counts - 1) * min_spacing
+        fits = (widths > 0) & (widths <= max_height * (prefix[settled + 1 + counts] - prefix[settled + 1]))
+        size = int(np.argmax(fits)) + 1 if fits.any() else len(counts) + 1
+
+        # Every row end of the block shares the candidate starts, longest rows first
+        starts = np.arange(max(0, settled + 1 - window), settled + 1)
+        ends = np.arange(settled + 1, settled + size + 1)
+        counts = ends[:, None] - starts
+        widths = output_w - (counts - 1) * min_spacing
+        heights = widths / (prefix[ends][:, None] - prefix[starts])
+        deviations = (heights - target_height) / target_height
+        costs = best_cost[starts] + deviations * deviations
+        costs[(counts > window) | (widths <= 0) | (heights > max_height)] = np.inf
+        choices = np.argmin(costs, axis=1)
+        best_cost[ends] = costs[np.arange(size), choices]
+        best_start[ends] = starts[choices]
+        settled += size
+
+    if not np.isfinite(best_cost[n]):
+        return None
+    return best_start
+
+def _justified_rows(aspect_ratios, output_w, output_h, min_spacing, target_height, window):
+    """
+    Partitions the images for one target height and fits the rows to the canvas.
+
+    Returns:
+        tuple: (starts, row_heights, natural_height, coverage) where row_heights
+               are already scaled down to fit the canvas and natural_height is
+               the unscaled height of the stacked rows.
+    """
+    starts = partition_rows(aspect_ratios, output_w, target_height, min_spacing, window)
+    ends = starts[1:] + [len(aspect_ratios)]
+
+    row_heights = [(output_w - (end - start - 1) * min_spacing) / sum(aspect_ratios[start:end])
+                   for start, end in zip(starts, ends)]
+    gaps = (len(row_heights) - 1) * min_spacing
+    natural_height = sum(row_heights) + gaps
+    if natural_height > output_h:
+        factor = max(0.0, output_h - gaps) / sum(row_heights)
+        row_heights = [row_height * factor for row_height in row_heights]
+
+    photo_area = sum(row_height * row_height * sum(aspect_ratios[start:end])
+                     for start, end, row_height in zip(starts, ends, row_heights))
+    return starts, row_heights, natural_height, photo_area / (output_w * output_h)
+
+def justified_layout(images, output_w, output_h, min_spacing, is_cropping=False, window=None, passes=4):
+    """
+    Lays out images in full-width rows using each image's real aspect ratio.
+
+    The row breaks come from partition_rows with a row height estimated to fill
+    the canvas height. If the stacked rows miss the canvas height by more than
+    a few percent, which happens mostly with few images, the target height is
+    corrected and the partition repeated, up to `passes` times in total; the
+    layout with the best coverage wins. Rows taller than the canvas are scaled
+    down to fit, and the width they give up goes into their gaps, or around a
+    row of one image, so every row still spans the canvas. Otherwise the
+    spacing is min_spacing.
+
+    Args:
+        images (list): ImageInfo records, in placement order.
+        output_w (int): Canvas width.
+        output_h (int): Canvas height.
+        min_spacing (int): Spacing between images and rows.
+        is_cropping (bool): Treat every image as cropped to the canvas aspect ratio.
+        window (int): See partition_rows.
+        passes (int): The most partitions to try.
+
+    Returns:
+        Placements: The layout; it reads like a list of dicts with 'path', 'x',
+                    'y', 'width' and 'height' per image.
+    """
+    if not len(images):
+        return Placements([], [], [], [], [])
+
+    catalog = ImageCatalog.from_infos(images)
+    if is_cropping:
+        aspect_ratios = [output_w / output_h] * len(catalog)
+    else:
+        aspect_ratios = catalog.aspect_ratios.tolist()
+
+    target_height = estimate_row_height(aspect_ratios, output_w, output_h, min_spacing)
+    best = None
+    for _ in range(passes):
+        result = _justified_rows(aspect_ratios, output_w, output_h, min_spacing, target_height, window)
+        if best is None or result[3] > best[3]:
+            best = result
+        natural_height = result[2]
+        if abs(natural_height - output_h) <= 0.02 * output_h:
+            break
+        target_height = max(1.0, target_height * output_h / natural_height)
+
+    starts, row_heights = best[0], best[1]
+    ends = starts[1:] + [len(catalog)]
+
+    aspect_ratios = np.asarray(aspect_ratios)
+    x = np.zeros(len(catalog))
+    y = np.empty(len(catalog))
+    widths = np.empty(len(catalog))
+    heights = np.empty(len(catalog))
+    current_y = 0
+    for start, end, height in zip(starts, ends, row_heights):
+        widths[start:end] = height * aspect_ratios[start:end]
+        heights[start:end] = height
+        # Rows scaled down to fit the canvas still span its width, as justify_row spreads them
+        leftover_space = output_w - widths[start:end].sum()
+        if end - start > 1:
+            spacing = max(min_spacing, leftover_space / (end - start - 1))
+            x[start + 1:end] = np.cumsum(widths[start:end - 1] + spacing)
+        else:
+            x[start] = max(0.0, leftover_space / 2)
+        y[start:end] = current_y
+        current_y += height + min_spacing
+    return Placements(catalog.paths, x, y, widths, heights)
+
+def scale_layout(layout, factor):
+    """
+    Scales the positions and sizes of a final layout by a constant factor,
+    e.g. to map a full-resolution layout onto a preview canvas.
+    """
+    if isinstance(layout, Placements):
+        return layout.scaled(factor)
+    return [dict(img_layout, x=img_layout['x'] * factor, y=img_layout['y'] * factor,
+                 width=img_layout['width'] * factor, height=img_layout['height'] * factor)
+            for img_layout in layout]
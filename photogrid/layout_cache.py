@@ -0,0 +1,148 @@
+import hashlib
+import os
+import threading
+import zipfile
+from collections import OrderedDict
+import numpy as np
+from photogrid.catalog import ImageCatalog, Placements
+
+DEFAULT_MAX_ENTRIES = 64
+
+# Part of every key; bump it when a change to the layout code changes its results.
+LAYOUT_VERSION = 1
+
+
+def image_fingerprint(images):
+    """
+    Returns a hex digest identifying an image set by the path and dimensions
+    of every image, which is all the layout code reads. The images are sorted
+    by path first, as shuffled does, so their order does not matter.
+    """
+    catalog = ImageCatalog.from_infos(images)
+    catalog = catalog.take(sorted(range(len(catalog)), key=catalog.paths.__getitem__))
+    digest = hashlib.sha1()
+    digest.update('\0'.join(catalog.paths).encode('utf-8', 'surrogateescape'))
+    for column in (catalog.widths, catalog.heights, catalog.aspect_ratios):
+        digest.update(np.ascontiguousarray(column, dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+def layout_key(fingerprint, output_size, min_space, max_space, is_cropping, mode, seed):
+    """
+    Returns the cache key of a seeded layout: a hash of the image set
+    fingerprint and every parameter that changes the placements.
+    """
+    if mode == 'justified':
+        max_space = None  # Justified rows always use min_space
+    parameters = (LAYOUT_VERSION, fingerprint, tuple(output_size), min_space, max_space, bool(is_cropping), mode, seed)
+    return hashlib.sha1(repr(parameters).encode('utf-8')).hexdigest()
+
+
+class LayoutCache:
+    """
+    A cache of finished layouts, so re-requesting a collage with the same
+    images, parameters and seed skips the layout search.
+
+    Like TileCache it has two tiers: an in-memory LRU of the most recent
+    layouts, and an optional on-disk store of one .npz file per layout that
+    persists across runs and may be shared by several processes. Only seeded
+    layouts are worth caching, since an unseeded shuffle never repeats.
+    Layouts take a few bytes per image, so the disk tier is not trimmed.
+
+    Args:
+        max_entries (int): Layouts held in memory.
+        cache_dir (str): Directory of the disk tier; None disables it.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, cache_dir=None):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def __len__(self):
+        return len(self._memory)
+
+    def get(self, key):
+        """
+        Returns the cached Placements for a key, or None.
+        """
+        with self._lock:
+            placements = self._memory.get(key)
+            if placements is not None:
+                self._memory.move_to_end(key)
+        if placements is None:
+            placements = self._get_disk(key)
+            if placements is not None:
+                self._put_memory(key, placements)
+        if placements is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return placements
+
+    def put(self, key, layout):
+        """
+        Stores a layout, given as Placements or a list of layout dicts.
+        """
+        placements = Placements.from_dicts(layout)
+        self._put_memory(key, placements)
+        self._put_disk(key, placements)
+
+    def get_or_compute(self, key, compute):
+        """
+        Returns the cached layout for a key, calling compute() to make it on a miss.
+        """
+        placements = self.get(key)
+        if placements is None:
+            placements = Placements.from_dicts(compute())
+            self.put(key, placements)
+        return placements
+
+    def clear(self):
+        """
+        Empties the in-memory tier. The disk tier is kept.
+        """
+        with self._lock:
+            self._memory.clear()
+
+    def _put_memory(self, key, placements):
+        with self._lock:
+            self._memory[key] = placements
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.npz')
+
+    def _get_disk(self, key):
+        if self.cache_dir is None:
+            return None
+        try:
+            with np.load(self._disk_path(key)) as data:
+                paths = data['paths'].tobytes().decode('utf-8', 'surrogateescape')
+                return Placements(paths.split('\0') if paths else [], data['x'], data['y'],
+                                  data['width'], data['height'])
+        except (OSError, EOFError, KeyError, ValueError, zipfile.BadZipFile):
+            return None
+
+    def _put_disk(self, key, placements):
+        if self.cache_dir is None:
+            return
+        path = self._disk_path(key)
+        paths = np.frombuffer('\0'.join(placements.paths).encode('utf-8', 'surrogateescape'), dtype=np.uint8)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Written under a unique name and renamed, so readers never see a partial layout.
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+            with open(temp_path, 'wb') as f:
+                np.savez(f, paths=paths, x=placements.x, y=placements.y, width=placements.width,
+                         height=placements.height)
+            os.replace(temp_path, path)
+        except OSError:
+            return
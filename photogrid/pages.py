@@ -0,0 +1,137 @@
+import json
+import math
+import os
+from collections import namedtuple
+import numpy as np
+from photogrid.catalog import ImageCatalog
+
+PageResult = namedtuple('PageResult', ['output', 'images', 'coverage'])
+
+
+def page_count(count, page_size):
+    """
+    Returns the number of pages that count images need at page_size images per page.
+    """
+    return max(1, math.ceil(count / page_size))
+
+
+def paginate(images, page_size, is_cropping=False):
+    """
+    Splits images into pages of about page_size images each.
+
+    The images are taken in file name order, so photos shot one after another
+    end up on the same or neighbouring pages. Pages are cut where their summed
+    aspect ratios are equal, so laid out on the same canvas every page gets
+    tiles of about the same size, however its landscape and portrait photos
+    are mixed. With is_cropping, every image takes the canvas shape and the
+    pages simply get equal counts.
+
+    Args:
+        images (list): ImageInfo records or an ImageCatalog.
+        page_size (int): The number of images a page should hold.
+        is_cropping (bool): The pages will be laid out with cropping.
+
+    Returns:
+        list: One ImageCatalog per page, none of them empty.
+    """
+    if page_size < 1:
+        raise ValueError("page_size must be at least 1")
+    images = ImageCatalog.from_infos(images)
+    if not len(images):
+        return []
+    images = images.take(sorted(range(len(images)), key=images.paths.__getitem__))
+    pages = page_count(len(images), page_size)
+
+    weights = np.ones(len(images)) if is_cropping else images.aspect_ratios
+    # Every image goes to the page its middle falls on
+    middles = np.cumsum(weights) - weights / 2
+    cuts = np.searchsorted(middles, weights.sum() * np.arange(1, pages) / pages)
+    bounds = [0]
+    for page, cut in enumerate(cuts.tolist(), 1):
+        bounds.append(min(max(cut, bounds[-1] + 1), len(images) - (pages - page)))
+    bounds.append(len(images))
+    return [images[start:stop] for start, stop in zip(bounds, bounds[1:])]
+
+
+def page_path(output, index, pages):
+    """
+    Returns the numbered output of one page, e.g. archive_007.jpg for the 7th page of archive.jpg.
+    """
+    stem, ext = os.path.splitext(output)
+    digits = max(3, len(str(pages)))
+    return f"{stem}_{index + 1:0{digits}d}{ext}"
+
+
+def page_report_path(output):
+    """
+    Returns where the coverage report of a paginated output is written.
+    """
+    return os.path.splitext(output)[0] + '_pages.json'
+
+
+def page_result_path(page_output):
+    """
+    Returns where the result of one rendered page is kept until its set is complete.
+    """
+    return os.path.splitext(page_output)[0] + '_page.json'
+
+
+def write_page_result(result):
+    """
+    Records a rendered page, so a restarted run need not render it again.
+    """
+    path = page_result_path(result.output)
+    temp_path = path + '.part'
+    with open(temp_path, 'w') as f:
+        json.dump({'images': result.images, 'coverage': result.coverage}, f)
+    os.replace(temp_path, path)
+
+
+def read_page_result(page_output):
+    """
+    Returns the PageResult recorded for a page, or None if the page or its record is missing.
+    """
+    if not os.path.exists(page_output):
+        return None
+    try:
+        with open(page_result_path(page_output)) as f:
+            record = json.load(f)
+        return PageResult(page_output, int(record['images']), float(record['coverage']))
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def write_page_report(output, results):
+    """
+    Writes the combined coverage report of a paginated output. It is written
+    once all pages are done, atomically, so its presence marks the set complete,
+    and the results recorded for the single pages are then removed.
+
+    Args:
+        output (str): The output the pages are numbered after.
+        results (list): A PageResult per page, in page order.
+
+    Returns:
+        dict: The report: its 'pages', the total 'images' and the 'mean', 'min'
+              and 'max' coverage of the pages.
+    """
+    coverages = [result.coverage for result in results]
+    report = {
+        'pages': [{'output': os.path.basename(result.output), 'images': result.images,
+                   'coverage': result.coverage} for result in results],
+        'images': sum(result.images for result in results),
+        'mean': sum(coverages) / len(coverages),
+        'min': min(coverages),
+        'max': max(coverages),
+    }
+    path = page_report_path(output)
+    temp_path = path + '.part'
+    with open(temp_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    os.replace(temp_path, path)
+    for result in results:
+        try:
+            os.remove(page_result_path(result.output))
+        except OSError:
+            pass
+    return report
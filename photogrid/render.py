@@ -0,0 +1,514 @@
+import io
+import math
+import mmap
+import os
+import tempfile
+import time
+import concurrent.futures
+import numpy as np
+from photogrid.catalog import Placements
+from photogrid.crop import source_crop_box
+from photogrid.image_utils import ORIENTATION_TAG, ORIENTATION_TRANSPOSE
+from photogrid.imaging import Image, exif_thumbnail, open_image
+from photogrid.layout import scale_layout
+from photogrid.tile_cache import TileCache
+from photogrid.timing import current, recording, stage
+
+def _unorient_box(box, orientation, stored_width, stored_height):
+    """
+    Maps a box given in displayed (oriented) coordinates back to stored pixel coordinates.
+    """
+    x0, y0, x1, y1 = box
+    sw, sh = stored_width, stored_height
+    if orientation == 2:
+        return (sw - x1, y0, sw - x0, y1)
+    if orientation == 3:
+        return (sw - x1, sh - y1, sw - x0, sh - y0)
+    if orientation == 4:
+        return (x0, sh - y1, x1, sh - y0)
+    if orientation == 5:
+        return (y0, x0, y1, x1)
+    if orientation == 6:
+        return (y0, sh - x1, y1, sh - x0)
+    if orientation == 7:
+        return (sw - y1, sh - x1, sw - y0, sh - x0)
+    if orientation == 8:
+        return (sw - y1, x0, sw - y0, x1)
+    return box
+
+
+def _resizable(img):
+    """
+    Converts a decoded image that Pillow can only resize with NEAREST, such as
+    a palette PNG or a 1-bit or 16-bit TIFF, so the requested filter applies.
+    """
+    if img.mode in ('RGB', 'RGBA', 'L', 'LA', 'CMYK'):
+        return img
+    return img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+
+
+def render_tile(path, size, crop_aspect_ratio=None, resample=None, draft=True, rows=None):
+    """
+    Renders one collage tile from a source image in a single resampling pass.
+
+    JPEG sources are decoded at the smallest DCT scale (1/2, 1/4 or 1/8) that
+    still covers the tile, the crop is applied as the resize box rather than as a
+    separate copy, and the EXIF orientation is applied to the small result.
+
+    Args:
+        path (str): Path to the source image.
+        size (tuple): The (width, height) of the tile, as displayed.
+        crop_aspect_ratio (float): If given, the source is center-cropped to this
+                                   aspect ratio, as crop_to_aspect_ratio does. A
+                                   CropPlan crops to its box for the path instead.
+        resample (int): The resampling filter; LANCZOS by default.
+        draft (bool): Allow reduced-resolution JPEG decoding.
+        rows (tuple): If given, only the (top, bottom) pixel rows of the tile
+                      are rendered, e.g. the part of it that falls in one strip.
+
+    Returns:
+        PIL.Image: The rendered tile, exactly `size` pixels, or its `rows` slice.
+    """
+    if resample is None:
+        resample = Image.Resampling.LANCZOS
+    width, height = size
+    top, bottom = rows if rows is not None else (0, height)
+    with open_image(path) as img:
+        orientation = img.getexif().get(ORIENTATION_TAG, 1)
+        stored_width, stored_height = img.size
+        rotated = orientation >= 5
+
+        if rotated:
+            oriented_width, oriented_height = stored_height, stored_width
+        else:
+            oriented_width, oriented_height = stored_width, stored_height
+
+        full_box = source_crop_box(crop_aspect_ratio, path, oriented_width, oriented_height)
+        box = full_box
+        if rows is not None:
+            row_scale = (box[3] - box[1]) / height
+            box = (box[0], box[1] + top * row_scale, box[2], box[1] + bottom * row_scale)
+        box = _unorient_box(box, orientation, stored_width, stored_height)
+
+        # Tile size in stored orientation
+        tile_width, tile_height = (bottom - top, width) if rotated else (width, bottom - top)
+
+        if draft and img.format == 'JPEG':
+            # The scale is chosen for the whole tile, so every slice of it is decoded alike
+            full_box = _unorient_box(full_box, orientation, stored_width, stored_height)
+            full_width, full_height = (height, width) if rotated else (width, height)
+            box_width = max(full_box[2] - full_box[0], 1)
+            box_height = max(full_box[3] - full_box[1], 1)
+            requested = (max(1, math.ceil(full_width * stored_width / box_width)),
+                         max(1, math.ceil(full_height * stored_height / box_height)))
+            drafted = img.draft(None, requested)
+            if drafted is not None:
+                # The reduced image covers the original at exactly 1/scale.
+                scale = stored_width / drafted[1][2]
+                box = tuple(coord / scale for coord in box)
+
+        with stage('decode') as record:
+            img.load()
+            record.nbytes = img.size[0] * img.size[1] * len(img.getbands())
+            source = _resizable(img)
+        with stage('resample'):
+            tile = source.resize((tile_width, tile_height), resample, box=box)
+
+    if orientation in ORIENTATION_TRANSPOSE:
+        with stage('orient'):
+            tile = tile.transpose(ORIENTATION_TRANSPOSE[orientation])
+    return tile
+
+
+def render_proxy_tile(path, size, crop_aspect_ratio=None, resample=None):
+    """
+    Renders a rough tile as cheaply as possible, for a draft preview.
+
+    The embedded EXIF thumbnail is used when it has about the photo's
+    proportions (cameras often pad 3:2 photos to a 4:3 thumbnail, while a few
+    percent of stretch does not show in a draft) and at least half the tile's
+    resolution;
+    otherwise JPEGs are decoded at 1/8 scale. Either way a fast filter is used.
+
+    Args:
+        path (str): Path to the source image.
+        size (tuple): The (width, height) of the tile, as displayed.
+        crop_aspect_ratio (float): See render_tile.
+        resample (int): The resampling filter, BOX (the default) or NEAREST.
+
+    Returns:
+        PIL.Image: The tile, exactly `size` pixels.
+    """
+    if resample is None:
+        resample = Image.Resampling.BOX
+    width, height = size
+    with open_image(path) as img:
+        orientation = img.getexif().get(ORIENTATION_TAG, 1)
+        stored_width, stored_height = img.size
+        rotated = orientation >= 5
+        oriented_width, oriented_height = (stored_height, stored_width) if rotated else (stored_width, stored_height)
+
+        box = source_crop_box(crop_aspect_ratio, path, oriented_width, oriented_height)
+        box = _unorient_box(box, orientation, stored_width, stored_height)
+        tile_size = (height, width) if rotated else (width, height)
+
+        source = exif_thumbnail(img)
+        if source is not None:
+            scale_x = source.size[0] / stored_width
+            scale_y = source.size[1] / stored_height
+            source_box = (box[0] * scale_x, box[1] * scale_y, box[2] * scale_x, box[3] * scale_y)
+            if (abs(scale_x - scale_y) > 0.08 * scale_x
+                    or (source_box[2] - source_box[0]) * 2 < tile_size[0]
+                    or (source_box[3] - source_box[1]) * 2 < tile_size[1]):
+                source = None
+
+        if source is None:
+            source_box = box
+            if img.format == 'JPEG':
+                drafted = img.draft(None, (1, 1))  # The smallest DCT scale
+                if drafted is not None:
+                    scale = stored_width / drafted[1][2]
+                    source_box = tuple(coord / scale for coord in box)
+            source = _resizable(img)
+
+        tile = source.resize(tile_size, resample, box=source_box)
+
+    if orientation in ORIENTATION_TRANSPOSE:
+        tile = tile.transpose(ORIENTATION_TRANSPOSE[orientation])
+    return tile
+
+
+def _background_pixel(background_color):
+    """
+    Resolves any Pillow color specification to an RGB triple.
+    """
+    return Image.new('RGB', (1, 1), background_color).getpixel((0, 0))
+
+
+def _tile_box(img_layout):
+    """
+    Returns the integer (x, y, width, height) a layout entry is pasted at.
+    """
+    return (int(img_layout['x']), int(img_layout['y']),
+            int(img_layout['width']), int(img_layout['height']))
+
+
+def _tile_tasks(layout):
+    """
+    Returns (path, x, y, width, height) per layout entry, in whole pixels.
+    """
+    if isinstance(layout, Placements):
+        return layout.tile_tasks()
+    return [(img_layout['path'], *_tile_box(img_layout)) for img_layout in layout]
+
+
+def _get_tile(path, size, crop_aspect_ratio, resample, cache):
+    """
+    Renders a tile, or takes it from the tile cache if one is given.
+    """
+    if cache is None:
+        return render_tile(path, size, crop_aspect_ratio, resample)
+    return cache.get_tile(path, size, crop_aspect_ratio, resample,
+                          lambda: render_tile(path, size, crop_aspect_ratio, resample))
+
+
+def _render_serial(layout, output_size, background_color, crop_aspect_ratio, resample, progress, cache):
+    canvas = Image.new('RGB', output_size, background_color)
+    for i, (path, x, y, width, height) in enumerate(_tile_tasks(layout)):
+        if width > 0 and height > 0:
+            tile = _get_tile(path, (width, height), crop_aspect_ratio, resample, cache)
+            with stage('paste', nbytes=width * height * 3):
+                canvas.paste(tile, (x, y))
+        if progress is not None:
+            progress(i + 1, len(layout))
+    return canvas
+
+
+# Per-process state for parallel rendering, set up by _init_canvas_worker.
+_worker_canvas = None
+
+
+def _init_canvas_worker(canvas_path, output_size, crop_aspect_ratio, resample, cache_dir, timed):
+    global _worker_canvas
+    canvas_file = open(canvas_path, 'r+b')
+    # Workers share only the disk tier of the tile cache.
+    cache = TileCache(memory_bytes=0, cache_dir=cache_dir) if cache_dir is not None else None
+    _worker_canvas = (mmap.mmap(canvas_file.fileno(), 0), output_size, crop_aspect_ratio, resample, cache, timed)
+    canvas_file.close()
+
+
+def _visible_size(canvas_size, x, y, width, height):
+    return min(width, canvas_size[0] - x), min(height, canvas_size[1] - y)
+
+
+def _write_tile_rows(canvas, canvas_width, tile, x, y, visible_width, visible_height):
+    """
+    Copies the visible rows of a tile into a raw RGB canvas buffer.
+    """
+    if tile.mode != 'RGB':
+        tile = tile.convert('RGB')
+    width = tile.size[0]
+    row_bytes = visible_width * 3
+    with stage('paste', nbytes=row_bytes * visible_height):
+        pixels = tile.tobytes()
+        for row in range(visible_height):
+            src = row * width * 3
+            dst = ((y + row) * canvas_width + x) * 3
+            canvas[dst:dst + row_bytes] = pixels[src:src + row_bytes]
+
+
+def _render_into_canvas(tile_task):
+    """
+    Renders one tile and writes its visible rows straight into the mapped canvas.
+
+    Returns the stage timings of the tile if the parent is recording, else None.
+    """
+    canvas, canvas_size, crop_aspect_ratio, resample, cache, timed = _worker_canvas
+    path, x, y, width, height = tile_task
+
+    visible_width, visible_height = _visible_size(canvas_size, x, y, width, height)
+    if visible_width <= 0 or visible_height <= 0:
+        return None
+
+    with recording() as timings:
+        tile = _get_tile(path, (width, height), crop_aspect_ratio, resample, cache)
+        _write_tile_rows(canvas, canvas_size[0], tile, x, y, visible_width, visible_height)
+    return timings.as_dict() if timed else None
+
+
+def render_collage(layout, output_size, background_color='white', crop_aspect_ratio=None,
+                   workers=1, resample=None, progress=None, cache=None):
+    """
+    Composites a layout onto a new canvas.
+
+    With more than one worker, tiles are rendered by a process pool directly into
+    a memory-mapped RGB canvas at their offsets, so only the layout entries are
+    sent to the workers and no tile pixels are sent back. The result is
+    byte-identical to the serial path.
+
+    With a TileCache, tiles already held in its memory tier are copied into
+    the canvas directly; worker processes read and fill only its disk tier.
+
+    Args:
+        layout (list): Dicts with 'path', 'x', 'y', 'width' and 'height', or Placements.
+        output_size (tuple): The (width, height) of the canvas.
+        background_color: Any Pillow color specification.
+        crop_aspect_ratio (float): Center-crop every source to this aspect ratio.
+        workers (int): Number of processes; None uses every core, 1 renders serially.
+        resample (int): The resampling filter; LANCZOS by default.
+        progress (callable): Called with (tiles_done, total_tiles) as tiles
+                             complete. An exception raised by it aborts the render.
+        cache (TileCache): Reuse tiles rendered by earlier calls.
+
+    Returns:
+        PIL.Image: The composited RGB image.
+    """
+    if resample is None:
+        resample = Image.Resampling.LANCZOS
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(layout))
+    if workers <= 1:
+        return _render_serial(layout, output_size, background_color, crop_aspect_ratio, resample, progress, cache)
+
+    canvas_width, canvas_height = output_size
+    fd, canvas_path = tempfile.mkstemp(prefix='photogrid-', suffix='.rgb')
+    try:
+        background_row = bytes(_background_pixel(background_color)) * canvas_width
+        with os.fdopen(fd, 'wb') as canvas_file:
+            for _ in range(canvas_height):
+                canvas_file.write(background_row)
+
+        tile_tasks = _tile_tasks(layout)
+        done = 0
+        if cache is not None:
+            tile_tasks, done = _paste_memory_hits(canvas_path, output_size, tile_tasks, crop_aspect_ratio,
+                                                  resample, cache)
+            if progress is not None and done:
+                progress(done, len(layout))
+
+        chunksize = max(1, len(tile_tasks) // (workers * 4))
+        cache_dir = cache.cache_dir if cache is not None else None
+        timings = current()
+        executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_canvas_worker,
+            initargs=(canvas_path, output_size, crop_aspect_ratio, resample, cache_dir, timings is not None))
+        try:
+            for i, tile_timings in enumerate(executor.map(_render_into_canvas, tile_tasks, chunksize=chunksize)):
+                if tile_timings is not None:
+                    timings.merge(tile_timings)
+                if progress is not None:
+                    progress(done + i + 1, len(layout))
+        finally:
+            # On an error or abort, drop the chunks that have not started yet.
+            executor.shutdown(cancel_futures=True)
+
+        with open(canvas_path, 'rb') as canvas_file:
+            return Image.frombytes('RGB', output_size, canvas_file.read())
+    finally:
+        os.remove(canvas_path)
+
+
+def _paste_memory_hits(canvas_path, output_size, tile_tasks, crop_aspect_ratio, resample, cache):
+    """
+    Writes the tiles found in the cache's memory tier into the canvas file.
+
+    Returns:
+        tuple: The tile tasks still to render, and the number written.
+    """
+    remaining = []
+    with open(canvas_path, 'r+b') as canvas_file, mmap.mmap(canvas_file.fileno(), 0) as canvas:
+        for path, x, y, width, height in tile_tasks:
+            visible_width, visible_height = _visible_size(output_size, x, y, width, height)
+            if visible_width <= 0 or visible_height <= 0:
+                remaining.append((path, x, y, width, height))
+                continue
+            tile = cache.memory_tile(path, (width, height), crop_aspect_ratio, resample)
+            if tile is None:
+                remaining.append((path, x, y, width, height))
+            else:
+                _write_tile_rows(canvas, output_size[0], tile, x, y, visible_width, visible_height)
+    return remaining, len(tile_tasks) - len(remaining)
+
+
+def preview_size(output_size, max_size):
+    """
+    Returns the size a canvas is shown at when fitted into max_size, as
+    Image.thumbnail would do. Canvases are never enlarged.
+    """
+    output_w, output_h = output_size
+    factor = min(max_size[0] / output_w, max_size[1] / output_h, 1)
+    return max(1, round(output_w * factor)), max(1, round(output_h * factor))
+
+
+def render_preview(layout, output_size, max_size, background_color='white', crop_aspect_ratio=None,
+                   resample=None, progress=None, cache=None):
+    """
+    Renders a layout directly at preview resolution.
+
+    The layout is scaled to the preview canvas and every tile is decoded and
+    resampled only to its preview size, so a preview costs a fraction of a
+    full-resolution render.
+
+    Args:
+        layout (list): The full-resolution layout.
+        output_size (tuple): The (width, height) the layout was made for.
+        max_size (tuple): The (width, height) the preview must fit in.
+        background_color: Any Pillow color specification.
+        crop_aspect_ratio (float): Center-crop every source to this aspect ratio.
+        resample (int): The resampling filter; see render_collage.
+        progress (callable): See render_collage.
+        cache (TileCache): See render_collage.
+
+    Returns:
+        PIL.Image: The preview image.
+    """
+    size = preview_size(output_size, max_size)
+    factor = size[0] / output_size[0]
+    return render_collage(scale_layout(layout, factor), size, background_color, crop_aspect_ratio,
+                          resample=resample, progress=progress, cache=cache)
+
+
+def coverage_mask(layout, size):
+    """
+    Returns a (height, width) boolean array that is True wherever a tile of the
+    layout is pasted on a canvas of the given size.
+
+    The tile boxes are summed into the mask with a 2-D difference array, so no
+    per-tile Python work is done.
+    """
+    placements = Placements.from_dicts(layout)
+    width, height = size
+    x, y = placements.x.astype(np.int64), placements.y.astype(np.int64)
+    x0, y0 = np.clip(x, 0, width), np.clip(y, 0, height)
+    x1 = np.clip(x + placements.width.astype(np.int64), 0, width)
+    y1 = np.clip(y + placements.height.astype(np.int64), 0, height)
+
+    stride = width + 1
+    corners = np.concatenate((y0 * stride + x0, y0 * stride + x1, y1 * stride + x0, y1 * stride + x1))
+    signs = np.repeat([1, -1, -1, 1], len(x0))
+    edges = np.bincount(corners, weights=signs, minlength=(height + 1) * stride).reshape(height + 1, stride)
+    return edges.cumsum(axis=0).cumsum(axis=1)[:height, :width] > 0
+
+
+def recolor_background(canvas, mask, background_color):
+    """
+    Returns a copy of a rendered canvas with every pixel outside the mask, as
+    returned by coverage_mask, set to background_color. The result equals
+    rendering the layout on that background in the first place.
+    """
+    pixels = np.array(canvas.convert('RGB'))
+    pixels[~mask] = _background_pixel(background_color)
+    return Image.fromarray(pixels, 'RGB')
+
+
+def _placeholder_canvas(size, placements, background_color, placeholder_color):
+    """
+    Paints every tile box of the placements in placeholder_color on a new canvas.
+    """
+    width, height = size
+    pixels = np.empty((height, width, 3), dtype=np.uint8)
+    pixels[:] = _background_pixel(background_color)
+    pixels[coverage_mask(placements, size)] = _background_pixel(placeholder_color)
+    return Image.fromarray(pixels, 'RGB')
+
+
+def progressive_preview(layout, output_size, max_size, background_color='white', crop_aspect_ratio=None,
+                        resample=None, cache=None, interval=0.1, placeholder_color='#c8c8c8'):
+    """
+    Renders a preview in three passes, yielding the canvas as it improves.
+
+    1. 'placeholder': every tile's box is filled with placeholder_color. No
+       file is opened, so the layout shows at once for any number of images.
+    2. 'draft': every tile is painted from render_proxy_tile.
+    3. 'refine': every tile is rendered as render_preview renders it, which
+       replaces its draft. The last canvas equals render_preview's result.
+
+    The same canvas is updated in place and yielded again, so a caller that
+    hands it to another thread must copy it. Within a pass it is yielded at
+    most every `interval` seconds, and always at the end of the pass. A draft
+    tile that cannot be rendered keeps its placeholder.
+
+    Args:
+        layout (list): The full-resolution layout.
+        output_size (tuple): The (width, height) the layout was made for.
+        max_size (tuple): The (width, height) the preview must fit in.
+        background_color: Any Pillow color specification.
+        crop_aspect_ratio (float): Center-crop every source to this aspect ratio.
+        resample (int): The resampling filter of the refine pass; LANCZOS by default.
+        cache (TileCache): Reuse refined tiles rendered by earlier calls.
+        interval (float): Seconds between yields within a pass.
+        placeholder_color: Any Pillow color specification.
+
+    Yields:
+        tuple: (canvas, pass name, tiles_done, total_tiles).
+    """
+    if resample is None:
+        resample = Image.Resampling.LANCZOS
+    size = preview_size(output_size, max_size)
+    factor = size[0] / output_size[0]
+    placements = Placements.from_dicts(scale_layout(layout, factor))
+    total = int(np.count_nonzero((placements.width >= 1) & (placements.height >= 1)))
+
+    canvas = _placeholder_canvas(size, placements, background_color, placeholder_color)
+    yield canvas, 'placeholder', 0, total
+
+    tile_tasks = [task for task in placements.tile_tasks() if task[3] > 0 and task[4] > 0]
+
+    passes = (('draft', lambda path, tile_size: render_proxy_tile(path, tile_size, crop_aspect_ratio)),
+              ('refine', lambda path, tile_size: _get_tile(path, tile_size, crop_aspect_ratio, resample, cache)))
+    for name, render in passes:
+        last_yield = time.perf_counter()
+        for i, (path, x, y, width, height) in enumerate(tile_tasks):
+            try:
+                tile = render(path, (width, height))
+            except Exception:
+                if name == 'refine':
+                    raise
+                continue
+            canvas.paste(tile, (x, y))
+            now = time.perf_counter()
+            if now - last_yield >= interval and i + 1 < total:
+                last_yield = now
+                yield canvas, name, i + 1, total
+        yield canvas, name, total, total
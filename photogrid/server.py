@@ -0,0 +1,437 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qsl, urlsplit
+from photogrid.batch import CollageJob, job_crop, job_from_dict, job_layout
+from photogrid.catalog import ImageCatalog, Placements
+from photogrid.engine import encode_image, layout_coverage
+from photogrid.index import scan_images_cached
+from photogrid.layout_cache import LayoutCache
+from photogrid.render import render_collage, render_preview
+from photogrid.tile_cache import default_cache_dir
+from photogrid.timing import Timings, recording
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# Distinct jobs queued or running at once; further requests get 503 until one finishes.
+MAX_PENDING_JOBS = 16
+
+MAX_BODY_BYTES = 1024 * 1024
+
+# Seconds a client may take to send its request
+REQUEST_TIMEOUT = 30
+
+# Response bodies are written in pieces of this size, waiting for slow clients in between
+STREAM_CHUNK = 64 * 1024
+
+# Job fields a request may set; the output is the response itself
+REQUEST_FIELDS = frozenset(CollageJob._fields) - {'output', 'strip_height', 'renditions', 'page_size'}
+
+_INT_FIELDS = ('width', 'height', 'min_spacing', 'max_spacing', 'quality')
+
+
+class HTTPError(Exception):
+    """
+    An error answered with the given status and message.
+    """
+
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+# --- Jobs, run in the worker processes ---
+
+_worker_layout_cache = None
+
+
+def _init_worker(layout_cache_dir):
+    global _worker_layout_cache
+    _worker_layout_cache = LayoutCache(cache_dir=layout_cache_dir)
+
+
+def _folder_images(folder, recursive):
+    images = list(scan_images_cached(folder, recursive=recursive))
+    if not images:
+        raise ValueError(f"No compatible images found in {folder}")
+    return ImageCatalog.from_infos(images)
+
+
+def _seeded(job):
+    """
+    Gives a job without a seed a random one, so the response can say how to reproduce it.
+    """
+    return job if job.seed is not None else job._replace(seed=random.randrange(2 ** 32))
+
+
+def scan_job(folder, recursive):
+    """
+    Returns ({'count', 'images'}, timings) for a folder scan.
+    """
+    with recording() as timings:
+        images = list(scan_images_cached(folder, recursive=recursive))
+    result = {'count': len(images),
+              'images': [{'path': info.path, 'width': info.width, 'height': info.height} for info in images]}
+    return result, timings.as_dict()
+
+
+def layout_job(job, recursive):
+    """
+    Returns ({'seed', 'coverage', 'layout'}, timings) for a collage job.
+    """
+    job = _seeded(job)
+    with recording() as timings:
+        layout = Placements.from_dicts(job_layout(job, _folder_images(job.folder, recursive), _worker_layout_cache))
+    result = {'seed': job.seed, 'coverage': layout_coverage(layout, job.width, job.height),
+              'layout': layout.to_dicts()}
+    return result, timings.as_dict()
+
+
+def render_job(job, recursive, max_size):
+    """
+    Returns ((JPEG bytes, seed), timings) for a collage job, rendered to fit
+    max_size if given, else at full size.
+    """
+    job = _seeded(job)
+    output_size = (job.width, job.height)
+    with recording() as timings:
+        layout = job_layout(job, _folder_images(job.folder, recursive), _worker_layout_cache)
+        crop = job_crop(job, layout)
+        if max_size is not None:
+            canvas = render_preview(layout, output_size, max_size, job.background, crop)
+        else:
+            canvas = render_collage(layout, output_size, job.background, crop)
+        data = encode_image(canvas, job.quality)
+    return (data, job.seed), timings.as_dict()
+
+
+# --- HTTP front end ---
+
+def _query_value(text):
+    """
+    Reads a query string value as JSON if it is valid JSON, else as a string.
+    """
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def _request_params(target, body):
+    """
+    Merges the query string of a request with its JSON object body, if any.
+    """
+    params = {name: _query_value(value) for name, value in parse_qsl(urlsplit(target).query)}
+    if body:
+        try:
+            data = json.loads(body)
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "The request body is not valid JSON") from None
+        if not isinstance(data, dict):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "The request body must be a JSON object")
+        params.update(data)
+    return params
+
+
+def _job_from_params(params):
+    """
+    Builds the CollageJob of a layout or render request.
+
+    Returns:
+        tuple: (job, recursive)
+    """
+    params = dict(params)
+    recursive = bool(params.pop('recursive', True))
+    if 'folder' not in params:
+        raise ValueError("Missing parameter: folder")
+    unknown = set(params) - REQUEST_FIELDS
+    if unknown:
+        raise ValueError(f"Unknown parameters: {', '.join(sorted(unknown))}")
+    job = job_from_dict({**params, 'output': ''})
+    for name in _INT_FIELDS:
+        value = getattr(job, name)
+        if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+            raise ValueError(f"{name} must be a non-negative integer")
+    if job.width == 0 or job.height == 0:
+        raise ValueError("width and height must be positive")
+    return job, recursive
+
+
+def _parse_max_size(value):
+    if value is None:
+        return None
+    if (not isinstance(value, (list, tuple)) or len(value) != 2
+            or not all(isinstance(v, int) and not isinstance(v, bool) and v > 0 for v in value)):
+        raise ValueError("max_size must be [width, height]")
+    return tuple(value)
+
+
+def server_timing(stages, **extra):
+    """
+    Formats stage timings, as returned by Timings.as_dict(), and extra
+    durations in seconds as a Server-Timing header value.
+    """
+    timings = Timings()
+    timings.merge(stages)
+    entries = [(stage, seconds) for stage, (seconds, _, _) in timings.items()] + list(extra.items())
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in entries)
+
+
+async def _read_request(reader):
+    """
+    Reads one HTTP/1.1 request.
+
+    Returns:
+        tuple: (method, target, headers, body)
+    """
+    request_line = (await reader.readline()).decode('latin-1').rstrip('\r\n')
+    parts = request_line.split(' ')
+    if len(parts) != 3 or not parts[2].startswith('HTTP/'):
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Malformed request line")
+    method, target, _ = parts
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Invalid Content-Length") from None
+    if length > MAX_BODY_BYTES:
+        raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "The request body is too large")
+    body = await reader.readexactly(length) if length > 0 else b''
+    return method, target, headers, body
+
+
+async def _send_response(writer, status, headers, body):
+    """
+    Writes a response, streaming the body in STREAM_CHUNK pieces so a slow
+    client holds back the writer instead of filling its buffers.
+    """
+    lines = [f"HTTP/1.1 {status.value} {status.phrase}"]
+    headers = {'Content-Length': str(len(body)), 'Connection': 'close', **headers}
+    lines.extend(f"{name}: {value}" for name, value in headers.items())
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1'))
+    view = memoryview(body)
+    for offset in range(0, len(view), STREAM_CHUNK):
+        writer.write(view[offset:offset + STREAM_CHUNK])
+        await writer.drain()
+    await writer.drain()
+
+
+def _json_body(data):
+    return json.dumps(data).encode('utf-8')
+
+
+class RenderService:
+    """
+    A local HTTP service that scans folders and lays out and renders collages.
+
+    Endpoints take their parameters from the query string or a JSON object body:
+
+        GET  /health  Service status.
+        POST /scan    folder, recursive: the images found, as JSON.
+        POST /layout  The fields of a CollageJob except output, strip_height,
+                      renditions and page_size, plus recursive: the seed,
+                      coverage and layout, as JSON.
+        POST /render  As /layout, plus max_size [width, height] for a preview:
+                      the collage as a JPEG.
+
+    Every job runs in a process pool, and a job already queued or running for
+    an identical request is joined instead of started again. At most
+    max_pending distinct jobs are pending; requests beyond that are answered
+    503 with a Retry-After header. Responses carry the worker's stage
+    timings, the time the request waited for its job and the total time in a
+    Server-Timing header, and say whether they joined a running job in
+    X-PhotoGrid-Coalesced. Requests without a seed get a random one, returned
+    in X-PhotoGrid-Seed.
+
+    Args:
+        workers (int): Worker processes; None uses every core.
+        max_pending (int): Distinct jobs queued or running at once.
+        layout_cache_dir (str): Directory where the workers cache seeded
+                                layouts; None keeps them in memory only.
+        executor (Executor): Runs the jobs instead of a new process pool;
+                             it is not shut down by close().
+    """
+
+    def __init__(self, workers=None, max_pending=MAX_PENDING_JOBS, layout_cache_dir=None, executor=None):
+        self.max_pending = max_pending
+        self.jobs_started = 0
+        self.coalesced = 0
+        self._owns_executor = executor is None
+        if executor is None:
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                           initargs=(layout_cache_dir,))
+        else:
+            _init_worker(layout_cache_dir)
+        self._executor = executor
+        self._pending = {}
+        self._server = None
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        """
+        Starts listening. Port 0 picks a free port.
+
+        Returns:
+            tuple: The (host, port) listened on.
+        """
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def close(self):
+        """
+        Stops listening and, if the service made its process pool, shuts it down.
+        """
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self._owns_executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def run_job(self, key, fn, *args):
+        """
+        Runs fn(*args) in the pool, or joins the pending job with the same key.
+
+        Returns:
+            tuple: (result, timings, coalesced) where fn returns (result, timings).
+
+        Raises:
+            HTTPError: 503 if max_pending jobs are already pending.
+        """
+        future = self._pending.get(key)
+        coalesced = future is not None
+        if coalesced:
+            self.coalesced += 1
+        else:
+            if len(self._pending) >= self.max_pending:
+                raise HTTPError(HTTPStatus.SERVICE_UNAVAILABLE, "Too many pending jobs", {'Retry-After': '1'})
+            future = asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+            self._pending[key] = future
+            self.jobs_started += 1
+            future.add_done_callback(lambda done: self._finish_job(key, done))
+        # Shielded, so a client hanging up does not cancel a job others may share
+        result, timings = await asyncio.shield(future)
+        return result, timings, coalesced
+
+    def _finish_job(self, key, future):
+        if self._pending.get(key) is future:
+            del self._pending[key]
+        if not future.cancelled():
+            future.exception()  # Retrieved, in case every requester has gone
+
+    async def _handle(self, reader, writer):
+        start = time.perf_counter()
+        try:
+            try:
+                method, target, _, body = await asyncio.wait_for(_read_request(reader), REQUEST_TIMEOUT)
+                status, headers, body = await self._dispatch(method, target, body, start)
+            except HTTPError as e:
+                status, headers, body = e.status, e.headers, _json_body({'error': str(e)})
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                return
+            headers.setdefault('Content-Type', 'application/json')
+            await _send_response(writer, status, headers, body)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method, target, body, start):
+        path = urlsplit(target).path.rstrip('/') or '/'
+        if path == '/health':
+            return HTTPStatus.OK, {}, _json_body({'status': 'ok', 'pending': self.pending,
+                                                  'max_pending': self.max_pending})
+        if path not in ('/scan', '/layout', '/render'):
+            raise HTTPError(HTTPStatus.NOT_FOUND, f"No such endpoint: {path}")
+        if method not in ('GET', 'POST'):
+            raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED, f"{method} is not supported", {'Allow': 'GET, POST'})
+
+        params = _request_params(target, body)
+        try:
+            if path == '/scan':
+                if 'folder' not in params:
+                    raise ValueError("Missing parameter: folder")
+                call = (scan_job, params['folder'], bool(params.get('recursive', True)))
+            else:
+                max_size = _parse_max_size(params.pop('max_size', None)) if path == '/render' else None
+                job, recursive = _job_from_params(params)
+                if path == '/layout':
+                    call = (layout_job, job, recursive)
+                else:
+                    call = (render_job, job, recursive, max_size)
+            # Identical requests have identical job arguments
+            key = (path, json.dumps(call[1:], default=repr))
+            submitted = time.perf_counter()
+            result, stages, coalesced = await self.run_job(key, *call)
+        except ValueError as e:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, str(e)) from None
+        except FileNotFoundError as e:
+            raise HTTPError(HTTPStatus.NOT_FOUND, str(e)) from None
+        except HTTPError:
+            raise
+        except Exception as e:
+            raise HTTPError(HTTPStatus.INTERNAL_SERVER_ERROR, f"{type(e).__name__}: {e}") from None
+
+        finished = time.perf_counter()
+        headers = {'X-PhotoGrid-Coalesced': '1' if coalesced else '0',
+                   'Server-Timing': server_timing(stages, job=finished - submitted, total=finished - start)}
+        if path == '/render':
+            data, seed = result
+            headers['Content-Type'] = 'image/jpeg'
+            headers['X-PhotoGrid-Seed'] = str(seed)
+            return HTTPStatus.OK, headers, data
+        if 'seed' in result:
+            headers['X-PhotoGrid-Seed'] = str(result['seed'])
+        return HTTPStatus.OK, headers, _json_body(result)
+
+
+async def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, **kwargs):
+    """
+    Runs a RenderService until cancelled.
+    """
+    service = RenderService(**kwargs)
+    try:
+        host, port = await service.start(host, port)
+        print(f"Serving collages on http://{host}:{port}")
+        await service._server.serve_forever()
+    finally:
+        await service.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m photogrid.server',
+                                     description="Serve photo grid scans, layouts and renders over HTTP.")
+    parser.add_argument('--host', default=DEFAULT_HOST, help=f"address to listen on (default: {DEFAULT_HOST})")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f"port to listen on (default: {DEFAULT_PORT})")
+    parser.add_argument('--workers', type=int, default=None, help="number of worker processes (default: all cores)")
+    parser.add_argument('--max-pending', type=int, default=MAX_PENDING_JOBS,
+                        help=f"distinct jobs queued or running before requests are refused (default: {MAX_PENDING_JOBS})")
+    parser.add_argument('--layout-cache', metavar='DIR', default=default_cache_dir('layouts'),
+                        help="directory where seeded layouts are cached")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, workers=args.workers, max_pending=args.max_pending,
+                          layout_cache_dir=args.layout_cache))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
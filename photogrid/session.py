@@ -0,0 +1,333 @@
+import threading
+from photogrid.catalog import Placements
+from photogrid.crop import CROP_MODES, plan_crops
+from photogrid.engine import LayoutSearch, LAYOUT_MODES, shuffled, write_image
+from photogrid.export import export_renditions
+from photogrid.layout import justified_layout, scale_layout
+from photogrid.layout_cache import image_fingerprint, layout_key
+from photogrid.render import (render_collage, progressive_preview, render_preview, preview_size, coverage_mask,
+                              recolor_background)
+from photogrid.timing import stage
+
+# Full-resolution renders larger than this are not kept between saves.
+MAX_KEPT_RENDER_PIXELS = 50_000_000
+
+DEFAULT_PARAMETERS = {
+    'images': (),
+    'seed': None,
+    'output_size': (1920, 1080),
+    'min_space': 10,
+    'max_space': 50,
+    'is_cropping': False,
+    'crop_mode': CROP_MODES[0],
+    'mode': LAYOUT_MODES[0],
+    'background_color': 'white',
+    'index_path': None,  # Where crop boxes are kept, see plan_crops
+}
+
+
+class CollageSession:
+    """
+    Holds the parameters of one collage and the intermediate results derived
+    from them, and recomputes only the stages whose inputs changed.
+
+    Every stage is stored with the inputs it was computed from, which include
+    the inputs of the stages it depends on:
+
+        order       images, seed
+        search      order, output size, min spacing, cropping, mode
+        placements  search, max spacing (greedy mode only)
+        crop_plan   images, output size, index path (content-aware cropping only)
+        tiles       placements, output size, cropping, preview or full size
+        composite   tiles, background color
+
+    So a new background color only recolors the background of the rendered
+    tiles, and a new max spacing only re-justifies the rows of the chosen
+    scale. A new JPEG quality needs no stage at all: save() re-encodes the
+    kept render. Tiles themselves are also reused across sizes and layouts
+    through the tile cache, if one is given.
+
+    With a LayoutCache, seeded placements are also looked up there before
+    searching, so a collage requested again in a later session or by another
+    front end skips the search.
+
+    The names of the stages computed by the last call are kept in `recomputed`.
+    Calls may come from any thread; they are serialized.
+
+    Args:
+        cache (TileCache): Reuse rendered tiles across calls and stages.
+        layout_cache (LayoutCache): Reuse seeded layouts across sessions.
+        **parameters: Initial values for any of the keys of DEFAULT_PARAMETERS.
+    """
+
+    def __init__(self, cache=None, layout_cache=None, **parameters):
+        self.cache = cache
+        self.layout_cache = layout_cache
+        self.parameters = dict(DEFAULT_PARAMETERS)
+        self.recomputed = []
+        self._images_version = 0
+        self._results = {}
+        self._lock = threading.RLock()
+        self.update(**parameters)
+
+    def update(self, **parameters):
+        """
+        Sets parameters of the collage. Nothing is recomputed until a result is asked for.
+
+        Returns:
+            set: The names of the parameters whose value changed.
+        """
+        changed = set()
+        with self._lock:
+            for name, value in parameters.items():
+                if name not in DEFAULT_PARAMETERS:
+                    raise TypeError(f"Unknown collage parameter: {name}")
+                if name == 'output_size':
+                    value = tuple(value)
+                if name == 'mode' and value not in LAYOUT_MODES:
+                    raise ValueError(f"Unknown layout mode: {value}")
+                if name == 'crop_mode' and value not in CROP_MODES:
+                    raise ValueError(f"Unknown crop mode: {value}")
+                if name == 'images':
+                    # Compared by identity: image lists can be long, and a rescan gives a new list.
+                    if value is not self.parameters['images']:
+                        self._images_version += 1
+                        changed.add(name)
+                elif value != self.parameters[name]:
+                    changed.add(name)
+                self.parameters[name] = value
+        return changed
+
+    def clear(self):
+        """
+        Drops every stored result.
+        """
+        with self._lock:
+            self._results.clear()
+
+    @property
+    def crop_aspect_ratio(self):
+        output_w, output_h = self.parameters['output_size']
+        return output_w / output_h if self.parameters['is_cropping'] else None
+
+    def _crop(self):
+        """
+        Returns what the render functions crop by: None, the target aspect
+        ratio, or the CropPlan of the images for it in content-aware mode.
+        """
+        aspect_ratio = self.crop_aspect_ratio
+        if aspect_ratio is None or self.parameters['crop_mode'] == 'center':
+            return aspect_ratio
+        paths = [image.path for image in self.parameters['images']]
+        index_path = self.parameters['index_path']
+        return self._stage('crop_plan', (self._images_version, aspect_ratio, index_path),
+                           lambda: plan_crops(paths, aspect_ratio, index_path=index_path))
+
+    def _crop_inputs(self):
+        return (self.crop_aspect_ratio, self.parameters['crop_mode'] if self.parameters['is_cropping'] else None)
+
+    def _stage(self, name, inputs, compute):
+        """
+        Returns the stored result of a stage if it was computed from the same
+        inputs, else computes and stores it.
+        """
+        stored = self._results.get(name)
+        if stored is not None and stored[0] == inputs:
+            return stored[1]
+        result = compute()
+        self._results[name] = (inputs, result)
+        self.recomputed.append(name)
+        return result
+
+    def _order_inputs(self):
+        return (self._images_version, self.parameters['seed'])
+
+    def _search_inputs(self):
+        p = self.parameters
+        return (self._order_inputs(), p['output_size'], p['min_space'], p['is_cropping'], p['mode'])
+
+    def _placements_inputs(self):
+        p = self.parameters
+        return (self._search_inputs(), p['max_space'] if p['mode'] == 'greedy' else None)
+
+    def _order(self):
+        p = self.parameters
+        return self._stage('order', self._order_inputs(), lambda: shuffled(p['images'], p['seed']))
+
+    def _search(self, progress):
+        def compute():
+            images = self._order()
+            (output_w, output_h), min_space = p['output_size'], p['min_space']
+            if progress is not None:
+                progress(0, 1)
+            with stage('search', count=len(images)):
+                if not len(images):
+                    result = Placements([], [], [], [], [])
+                elif p['mode'] == 'justified':
+                    result = justified_layout(images, output_w, output_h, min_space, p['is_cropping'])
+                else:
+                    result = LayoutSearch(images, output_w, output_h, min_space, p['is_cropping'])
+                    result.best_index()
+            if progress is not None:
+                progress(1, 1)
+            return result
+
+        p = self.parameters
+        return self._stage('search', self._search_inputs(), compute)
+
+    def layout(self, progress=None):
+        """
+        Returns the layout for the current parameters, as search_layout would
+        lay out the images shuffled with the current seed.
+
+        Args:
+            progress (callable): Called with (steps_done, total_steps) if the search runs.
+
+        Returns:
+            Placements: The layout.
+        """
+        with self._lock:
+            self.recomputed = []
+
+            def search():
+                result = self._search(progress)
+                if isinstance(result, LayoutSearch):
+                    return result.layout(result.best_index(), p['max_space'])
+                return result
+
+            def compute():
+                if self.layout_cache is None or p['seed'] is None:
+                    return search()
+                fingerprint = self._stage('fingerprint', self._images_version,
+                                          lambda: image_fingerprint(p['images']))
+                key = layout_key(fingerprint, p['output_size'], p['min_space'], p['max_space'], p['is_cropping'],
+                                 p['mode'], p['seed'])
+                return self.layout_cache.get_or_compute(key, search)
+
+            p = self.parameters
+            return self._stage('placements', self._placements_inputs(), compute)
+
+    def preview_frames(self, max_size, progressive=True, progress=None):
+        """
+        Renders the preview of the current layout, yielding it as it improves.
+
+        A preview whose tiles are already rendered for this layout and size is
+        only recolored if needed and yielded once. Otherwise it is rendered
+        with progressive_preview (or render_preview if progressive is False)
+        and kept for the next call.
+
+        Args:
+            max_size (tuple): The (width, height) the preview must fit in.
+            progressive (bool): Yield the placeholder and draft passes too.
+            progress (callable): See render_collage; only used if not progressive.
+
+        Yields:
+            tuple: (canvas, pass name, tiles_done, total_tiles), as progressive_preview.
+                   The last canvas is the finished preview.
+        """
+        # The session is only locked while its stages are read and stored, never
+        # across a yield, so a consumer that stops early cannot block other calls.
+        with self._lock:
+            layout = self.layout()
+            p = dict(self.parameters)
+            inputs = (self._placements_inputs(), preview_size(p['output_size'], max_size), self._crop_inputs())
+            stored = self._results.get('preview_tiles')
+            kept = stored is not None and stored[0] == inputs
+            if kept:
+                final = self._composite('preview')
+            else:
+                crop = self._crop()
+        if kept:
+            yield final, 'refine', len(layout), len(layout)
+            return
+
+        if progressive:
+            canvas = None
+            for canvas, phase, done, total in progressive_preview(layout, p['output_size'], max_size,
+                                                                  p['background_color'], crop, cache=self.cache):
+                yield canvas, phase, done, total
+        else:
+            canvas = render_preview(layout, p['output_size'], max_size, p['background_color'], crop,
+                                    progress=progress, cache=self.cache)
+        factor = canvas.size[0] / p['output_size'][0]
+        with self._lock:
+            self._keep_tiles('preview_tiles', inputs, canvas, scale_layout(layout, factor), p['background_color'])
+            final = self._composite('preview')
+        yield final, 'refine', len(layout), len(layout)
+
+    def preview(self, max_size, progress=None):
+        """
+        Returns the finished preview of the current layout; see preview_frames.
+        """
+        canvas = None
+        for canvas, _, _, _ in self.preview_frames(max_size, progressive=False, progress=progress):
+            pass
+        return canvas
+
+    def render(self, workers=1, progress=None):
+        """
+        Renders the current layout at full resolution, reusing the last render
+        if only the background color changed since.
+
+        Args:
+            workers (int): See render_collage.
+            progress (callable): See render_collage.
+
+        Returns:
+            PIL.Image: The collage.
+        """
+        with self._lock:
+            layout = self.layout()
+            p = self.parameters
+            inputs = (self._placements_inputs(), self._crop_inputs())
+            stored = self._results.get('full_tiles')
+            if stored is None or stored[0] != inputs:
+                canvas = render_collage(layout, p['output_size'], p['background_color'], self._crop(),
+                                        workers=workers, progress=progress, cache=self.cache)
+                if canvas.size[0] * canvas.size[1] > MAX_KEPT_RENDER_PIXELS:
+                    self._results.pop('full_tiles', None)
+                    self._results.pop('full', None)
+                    return canvas
+                self._keep_tiles('full_tiles', inputs, canvas, layout, p['background_color'])
+            return self._composite('full')
+
+    def save(self, save_path, quality=95, workers=1, progress=None):
+        """
+        Renders the current layout at full resolution and writes it to save_path.
+        Saving again with only a different quality just re-encodes the image.
+        """
+        with self._lock:
+            write_image(self.render(workers, progress), save_path, quality)
+
+    def export(self, renditions, workers=1, progress=None, encode_workers=None):
+        """
+        Renders the current layout at full resolution, reusing the kept render,
+        and writes all renditions of it with export_renditions.
+
+        Args:
+            renditions (list): Rendition records.
+            workers (int): Render processes; see render_collage.
+            progress (callable): Called with (done, total) while rendering, then while encoding.
+            encode_workers (int): Encoding threads; None uses every core.
+        """
+        with self._lock:
+            canvas = self.render(workers, progress)
+            export_renditions(canvas, renditions, self.parameters['background_color'], encode_workers, progress)
+
+    def _keep_tiles(self, name, inputs, canvas, layout, background_color):
+        """
+        Stores a canvas rendered on background_color together with the mask of
+        its tile pixels, so its background can be recolored later.
+        """
+        self._results[name] = (inputs, (canvas, background_color, coverage_mask(layout, canvas.size)))
+        self.recomputed.append(name)
+
+    def _composite(self, name):
+        """
+        Returns the kept canvas of a tiles stage on the current background color.
+        """
+        tiles_inputs, (canvas, rendered_color, mask) = self._results[f'{name}_tiles']
+        color = self.parameters['background_color']
+        if color == rendered_color:
+            return canvas
+        return self._stage(name, (tiles_inputs, color), lambda: recolor_background(canvas, mask, color))
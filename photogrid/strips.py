@@ -0,0 +1,253 @@
+import os
+import struct
+import zlib
+from photogrid.imaging import Image
+from photogrid.render import render_tile, _tile_tasks
+from photogrid.timing import stage
+
+DEFAULT_STRIP_HEIGHT = 256
+
+# Tiles that cross strip boundaries are rendered whole and kept until their
+# last strip, while they fit in this many strips' worth of memory.
+HELD_TILE_STRIPS = 8
+STRIP_FORMATS = {'.tif', '.tiff'}
+
+# TIFF field types
+_SHORT = 3
+_LONG = 4
+_LONG8 = 16
+
+_TIFF_COMPRESSION = {'none': 1, 'deflate': 8}
+
+
+def iter_collage_strips(layout, output_size, background_color='white', crop_aspect_ratio=None,
+                        strip_height=DEFAULT_STRIP_HEIGHT, resample=None, progress=None):
+    """
+    Composites a layout one horizontal strip at a time, top to bottom.
+
+    Only the tiles that intersect a strip are rendered for it. A tile that
+    crosses strip boundaries is rendered once and its rows are pasted strip by
+    strip, so memory use is bounded by the canvas width times strip_height
+    plus HELD_TILE_STRIPS strips of held tiles, however large the canvas is.
+    Tiles beyond that are rendered slice by slice instead.
+
+    Args:
+        layout (list): Dicts with 'path', 'x', 'y', 'width' and 'height'.
+        output_size (tuple): The (width, height) of the canvas.
+        background_color: Any Pillow color specification.
+        crop_aspect_ratio (float): Center-crop every source to this aspect ratio.
+        strip_height (int): Rows per strip; the last strip may be shorter.
+        resample (int): The resampling filter; LANCZOS by default.
+        progress (callable): Called with (tiles_done, total_tiles) as the last
+                             slice of each tile is composited.
+
+    Yields:
+        PIL.Image: RGB strips of the full canvas width.
+    """
+    if strip_height < 1:
+        raise ValueError("strip_height must be at least 1")
+    canvas_width, canvas_height = output_size
+
+    tiles = [(x, y, width, height, path) for path, x, y, width, height in _tile_tasks(layout)]
+    tiles = sorted((tile for tile in tiles if tile[2] > 0 and tile[3] > 0), key=lambda tile: tile[1])
+    skipped = len(layout) - len(tiles)
+    done = 0
+    next_tile = 0
+    active = []
+    held_budget = canvas_width * strip_height * 3 * HELD_TILE_STRIPS
+    held_bytes = 0
+
+    for strip_top in range(0, canvas_height, strip_height):
+        strip_bottom = min(strip_top + strip_height, canvas_height)
+        while next_tile < len(tiles) and tiles[next_tile][1] < strip_bottom:
+            active.append(tiles[next_tile] + (None,))
+            next_tile += 1
+
+        strip = Image.new('RGB', (canvas_width, strip_bottom - strip_top), background_color)
+        remaining = []
+        for x, y, width, height, path, rendered in active:
+            top = max(strip_top, y) - y
+            bottom = min(strip_bottom, y + height) - y
+            continues = y + height > strip_bottom and strip_bottom < canvas_height
+            if bottom > top:
+                if rendered is None and top == 0 and continues and held_bytes + width * height * 3 <= held_budget:
+                    rendered = render_tile(path, (width, height), crop_aspect_ratio, resample)
+                    held_bytes += width * height * 3
+                if rendered is not None:
+                    tile = rendered.crop((0, top, width, bottom))
+                else:
+                    tile = render_tile(path, (width, height), crop_aspect_ratio, resample, rows=(top, bottom))
+                with stage('paste', nbytes=width * (bottom - top) * 3):
+                    strip.paste(tile, (x, y + top - strip_top))
+            if continues:
+                remaining.append((x, y, width, height, path, rendered))
+            else:
+                if rendered is not None:
+                    held_bytes -= width * height * 3
+                done += 1
+                if progress is not None:
+                    progress(done + skipped, len(layout))
+        active = remaining
+        yield strip
+
+    # Tiles that lie entirely below the canvas
+    if progress is not None and next_tile < len(tiles):
+        progress(len(layout), len(layout))
+
+
+class StripedTiffWriter:
+    """
+    Writes an RGB TIFF incrementally, one strip at a time.
+
+    Each strip is compressed and written as soon as it arrives and the image
+    directory goes at the end of the file, so the writer holds no more than one
+    strip in memory. Canvases whose raw size could exceed 4 GiB are written as
+    BigTIFF.
+
+    Args:
+        path (str): The output file.
+        size (tuple): The (width, height) of the image.
+        rows_per_strip (int): The height of every strip but the last.
+        compression (str): 'deflate' or 'none'.
+        bigtiff (bool): Force BigTIFF; by default it is used only when needed.
+    """
+
+    def __init__(self, path, size, rows_per_strip, compression='deflate', bigtiff=None):
+        if compression not in _TIFF_COMPRESSION:
+            raise ValueError(f"Unknown TIFF compression: {compression}")
+        self.size = size
+        self.rows_per_strip = rows_per_strip
+        self.compression = compression
+        if bigtiff is None:
+            bigtiff = size[0] * size[1] * 3 > 0xFFFFFFFF - (1 << 24)
+        self.bigtiff = bigtiff
+        self._offsets = []
+        self._byte_counts = []
+        self._rows_written = 0
+        self._file = open(path, 'wb')
+        if bigtiff:
+            self._file.write(b'II' + struct.pack('<HHHQ', 43, 8, 0, 0))
+        else:
+            self._file.write(b'II' + struct.pack('<HI', 42, 0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+
+    def write(self, strip):
+        """
+        Appends the next strip. It must span the full width of the image.
+        """
+        if strip.size[0] != self.size[0]:
+            raise ValueError("Strip width does not match the image width")
+        if strip.mode != 'RGB':
+            strip = strip.convert('RGB')
+        data = strip.tobytes()
+        if self.compression == 'deflate':
+            data = zlib.compress(data, 6)
+        self._offsets.append(self._file.tell())
+        self._byte_counts.append(len(data))
+        self._file.write(data)
+        self._rows_written += strip.size[1]
+
+    def close(self):
+        """
+        Writes the image directory and closes the file.
+        """
+        if self._file.closed:
+            return
+        width, height = self.size
+        if self._rows_written != height:
+            self._file.close()
+            raise ValueError(f"Wrote {self._rows_written} of {height} rows")
+
+        offset_type = _LONG8 if self.bigtiff else _LONG
+        entries = [
+            (256, _LONG, [width]),
+            (257, _LONG, [height]),
+            (258, _SHORT, [8, 8, 8]),
+            (259, _SHORT, [_TIFF_COMPRESSION[self.compression]]),
+            (262, _SHORT, [2]),  # RGB
+            (273, offset_type, self._offsets),
+            (277, _SHORT, [3]),
+            (278, _LONG, [self.rows_per_strip]),
+            (279, offset_type, self._byte_counts),
+            (284, _SHORT, [1]),  # Chunky
+        ]
+        self._write_directory(entries)
+        self._file.close()
+
+    def _write_directory(self, entries):
+        value_size = 8 if self.bigtiff else 4
+        type_formats = {_SHORT: 'H', _LONG: 'I', _LONG8: 'Q'}
+
+        # Values too large for their entry go out of line, before the directory.
+        packed = []
+        for tag, field_type, values in entries:
+            data = struct.pack(f'<{len(values)}{type_formats[field_type]}', *values)
+            if len(data) > value_size:
+                if self._file.tell() % 2:
+                    self._file.write(b'\0')
+                packed.append((tag, field_type, len(values), struct.pack('<Q' if self.bigtiff else '<I',
+                                                                         self._file.tell())))
+                self._file.write(data)
+            else:
+                packed.append((tag, field_type, len(values), data.ljust(value_size, b'\0')))
+
+        if self._file.tell() % 2:
+            self._file.write(b'\0')
+        directory_offset = self._file.tell()
+        if self.bigtiff:
+            self._file.write(struct.pack('<Q', len(packed)))
+            for tag, field_type, count, value in packed:
+                self._file.write(struct.pack('<HHQ', tag, field_type, count) + value)
+            self._file.write(struct.pack('<Q', 0))
+            self._file.seek(8)
+            self._file.write(struct.pack('<Q', directory_offset))
+        else:
+            self._file.write(struct.pack('<H', len(packed)))
+            for tag, field_type, count, value in packed:
+                self._file.write(struct.pack('<HHI', tag, field_type, count) + value)
+            self._file.write(struct.pack('<I', 0))
+            self._file.seek(4)
+            self._file.write(struct.pack('<I', directory_offset))
+
+
+def save_collage_strips(layout, save_path, output_size, background_color='white', crop_aspect_ratio=None,
+                        strip_height=DEFAULT_STRIP_HEIGHT, compression='deflate', progress=None):
+    """
+    Renders a layout strip by strip straight into a TIFF file, for canvases too
+    large to hold in memory.
+
+    As with save_collage, the file is written next to save_path and moved into
+    place once complete.
+
+    Args:
+        layout (list): The layout to render.
+        save_path (str): The output file; it must have a .tif or .tiff extension.
+        output_size (tuple): The (width, height) of the canvas.
+        background_color: Any Pillow color specification.
+        crop_aspect_ratio (float): Center-crop every source to this aspect ratio.
+        strip_height (int): Rows rendered and written at a time.
+        compression (str): 'deflate' or 'none'.
+        progress (callable): See iter_collage_strips.
+    """
+    if os.path.splitext(save_path)[1].lower() not in STRIP_FORMATS:
+        raise ValueError("Strip rendering can only write TIFF files")
+
+    temp_path = save_path + '.part'
+    try:
+        with StripedTiffWriter(temp_path, output_size, strip_height, compression) as writer:
+            for strip in iter_collage_strips(layout, output_size, background_color, crop_aspect_ratio,
+                                             strip_height, progress=progress):
+                with stage('encode', nbytes=strip.size[0] * strip.size[1] * 3):
+                    writer.write(strip)
+        os.replace(temp_path, save_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
@@ -0,0 +1,227 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from photogrid.crop import CropPlan
+from photogrid.imaging import Image
+
+DEFAULT_MEMORY_BYTES = 256 * 1024 * 1024
+DEFAULT_DISK_BYTES = 2 * 1024 * 1024 * 1024
+
+# Holds the running byte total of a disk tier, so caches opened by new
+# processes need not walk the whole directory to know it.
+USAGE_FILENAME = 'usage'
+
+
+def default_cache_dir(name='tiles'):
+    """
+    Returns the per-user directory for one kind of cached data, following XDG_CACHE_HOME.
+    """
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'photogrid', name)
+
+
+class TileCache:
+    """
+    A two-tier cache of rendered tiles: an in-memory LRU bounded by a byte
+    budget, backed by an on-disk store.
+
+    Tiles are keyed by (path, mtime, crop, width, height, resample filter),
+    where crop is the crop flag and target aspect, or for a content-aware
+    crop its box, so editing a source or changing how it is cropped or sized
+    never returns a stale tile. Tiles evicted from memory stay on disk, where
+    they are stored as raw RGB and read back without decoding the source.
+    The disk tier may be shared by several processes.
+
+    Args:
+        memory_bytes (int): Byte budget of the in-memory tier; 0 disables it.
+        cache_dir (str): Directory of the disk tier; None disables it.
+        disk_bytes (int): Byte budget of the disk tier. The least recently
+                          written tiles are removed first. Concurrent writers
+                          may undercount the total a little; it is recounted
+                          whenever tiles are removed.
+    """
+
+    def __init__(self, memory_bytes=DEFAULT_MEMORY_BYTES, cache_dir=None, disk_bytes=DEFAULT_DISK_BYTES):
+        self.memory_bytes = memory_bytes
+        self.cache_dir = cache_dir
+        self.disk_bytes = disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._memory_used = 0
+        self._lock = threading.Lock()
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def __len__(self):
+        return len(self._memory)
+
+    @staticmethod
+    def make_key(path, size, crop_aspect_ratio, resample):
+        """
+        Returns the cache key of one tile. Raises OSError if the source is missing.
+
+        The crop is a single element, whatever its kind, so the tile size is
+        always at key[3] and key[4].
+        """
+        mtime_ns = os.stat(path).st_mtime_ns
+        if isinstance(crop_aspect_ratio, CropPlan):
+            crop = crop_aspect_ratio.key(path)
+        else:
+            crop = (crop_aspect_ratio is not None, crop_aspect_ratio)
+        return (os.path.abspath(path), mtime_ns, crop, size[0], size[1], int(resample))
+
+    def get_tile(self, path, size, crop_aspect_ratio, resample, render):
+        """
+        Returns the tile for the given parameters, calling render() to produce
+        it on a miss and storing the result in both tiers.
+        """
+        key = self.make_key(path, size, crop_aspect_ratio, resample)
+        tile = self._get_memory(key)
+        if tile is None:
+            tile = self._get_disk(key)
+            if tile is not None:
+                self._put_memory(key, tile)
+        if tile is not None:
+            self.hits += 1
+            return tile
+
+        self.misses += 1
+        tile = render()
+        if tile.mode != 'RGB':
+            tile = tile.convert('RGB')
+        self._put_memory(key, tile)
+        self._put_disk(key, tile)
+        return tile
+
+    def memory_tile(self, path, size, crop_aspect_ratio, resample):
+        """
+        Returns the tile if it is held in memory, else None, without touching the disk tier.
+        """
+        try:
+            key = self.make_key(path, size, crop_aspect_ratio, resample)
+        except OSError:
+            return None
+        tile = self._get_memory(key)
+        if tile is not None:
+            self.hits += 1
+        return tile
+
+    def clear(self):
+        """
+        Empties the in-memory tier. The disk tier is kept.
+        """
+        with self._lock:
+            self._memory.clear()
+            self._memory_used = 0
+
+    def _get_memory(self, key):
+        with self._lock:
+            tile = self._memory.get(key)
+            if tile is not None:
+                self._memory.move_to_end(key)
+            return tile
+
+    def _put_memory(self, key, tile):
+        nbytes = tile.size[0] * tile.size[1] * 3
+        if nbytes > self.memory_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                return
+            self._memory[key] = tile
+            self._memory_used += nbytes
+            while self._memory_used > self.memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_used -= evicted.size[0] * evicted.size[1] * 3
+
+    def _disk_path(self, key):
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest + '.rgb')
+
+    def _get_disk(self, key):
+        if self.cache_dir is None:
+            return None
+        size = key[3], key[4]
+        try:
+            with open(self._disk_path(key), 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        if len(data) != size[0] * size[1] * 3:
+            return None
+        return Image.frombytes('RGB', size, data)
+
+    def _put_disk(self, key, tile):
+        if self.cache_dir is None:
+            return
+        path = self._disk_path(key)
+        data = tile.tobytes()
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Written under a unique name and renamed, so readers never see a partial tile.
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError:
+            return
+        with self._lock:
+            used = self._read_usage()
+            if used is None:
+                # No total yet: count the directory once, this tile included
+                used = sum(size for _, size, _ in self._disk_entries())
+            else:
+                used += len(data)
+            if used > self.disk_bytes:
+                self._trim_disk()
+            else:
+                self._write_usage(used)
+
+    def _usage_path(self):
+        return os.path.join(self.cache_dir, USAGE_FILENAME)
+
+    def _read_usage(self):
+        try:
+            with open(self._usage_path()) as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def _write_usage(self, used):
+        path = self._usage_path()
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+        try:
+            with open(temp_path, 'w') as f:
+                f.write(str(used))
+            os.replace(temp_path, path)
+        except OSError:
+            pass
+
+    def _disk_entries(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith('.rgb'):
+                    file_path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(file_path)
+                    except OSError:
+                        continue
+                    yield file_path, stat.st_size, stat.st_mtime_ns
+
+    def _trim_disk(self):
+        """
+        Removes the oldest tiles until the disk tier is back to 3/4 of its budget.
+        """
+        entries = sorted(self._disk_entries(), key=lambda entry: entry[2])
+        used = sum(size for _, size, _ in entries)
+        for file_path, size, _ in entries:
+            if used <= self.disk_bytes * 3 // 4:
+                break
+            try:
+                os.remove(file_path)
+            except OSError:
+                continue
+            used -= size
+        self._write_usage(used)
@@ -0,0 +1,144 @@
+import contextvars
+import cProfile
+import time
+from contextlib import contextmanager
+
+# Stages in pipeline order, for reports
+STAGE_ORDER = ('scan', 'probe', 'hash', 'dedup', 'search', 'crop', 'decode', 'resample', 'orient', 'paste', 'encode')
+
+_current = contextvars.ContextVar('photogrid_timings', default=None)
+
+
+class StageRecord:
+    """
+    The count and byte total of one timed stage, which the timed code may fill in.
+    """
+
+    def __init__(self, count=1, nbytes=0):
+        self.count = count
+        self.nbytes = nbytes
+
+
+class Timings:
+    """
+    Accumulates per-stage durations, counts and bytes for one run.
+
+    Instrumented code reports into the Timings made active by recording(); code
+    run without an active Timings is not measured. Stages run on worker threads
+    or processes are only seen if their own results are merged back in.
+
+    Args:
+        hook (callable): Called with (stage, seconds, count, nbytes) for every
+                         measurement, on the thread that made it.
+    """
+
+    def __init__(self, hook=None):
+        self.hook = hook
+        self.stages = {}
+
+    def add(self, stage, seconds, count=1, nbytes=0):
+        totals = self.stages.setdefault(stage, [0.0, 0, 0])
+        totals[0] += seconds
+        totals[1] += count
+        totals[2] += nbytes
+        if self.hook is not None:
+            self.hook(stage, seconds, count, nbytes)
+
+    def merge(self, stages):
+        """
+        Adds the totals of another run, as returned by as_dict().
+        """
+        for stage, (seconds, count, nbytes) in stages.items():
+            self.add(stage, seconds, count, nbytes)
+
+    def as_dict(self):
+        """
+        Returns {stage: (seconds, count, nbytes)}; picklable and JSON-friendly.
+        """
+        return {stage: tuple(totals) for stage, totals in self.stages.items()}
+
+    def items(self):
+        """
+        Returns (stage, (seconds, count, nbytes)) pairs in pipeline order.
+        """
+        return [(stage, tuple(self.stages[stage])) for stage in sorted(self.stages, key=_stage_sort_key)]
+
+    def summary(self):
+        """
+        Returns a one-line summary such as "scan 0.12s · decode 1.50s (40)".
+        """
+        parts = []
+        for stage, (seconds, count, _) in self.items():
+            parts.append(f"{stage} {seconds:.2f}s" + (f" ({count})" if count > 1 else ""))
+        return " · ".join(parts)
+
+    def report(self):
+        """
+        Returns a table of all stages, one per line.
+        """
+        lines = [f"{'stage':10} {'seconds':>9} {'count':>8} {'MB':>9}"]
+        for stage, (seconds, count, nbytes) in self.items():
+            lines.append(f"{stage:10} {seconds:9.3f} {count:8d} {nbytes / 1e6:9.1f}")
+        return "\n".join(lines)
+
+
+def _stage_sort_key(stage):
+    return (STAGE_ORDER.index(stage) if stage in STAGE_ORDER else len(STAGE_ORDER), stage)
+
+
+def current():
+    """
+    Returns the active Timings of this thread, or None.
+    """
+    return _current.get()
+
+
+@contextmanager
+def recording(timings=None):
+    """
+    Makes a Timings active for the enclosed code on this thread and yields it.
+    """
+    if timings is None:
+        timings = Timings()
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def stage(name, count=1, nbytes=0):
+    """
+    Times the enclosed code as one measurement of a stage, if a Timings is active.
+
+    Yields a StageRecord whose count and nbytes the enclosed code may update.
+    """
+    timings = _current.get()
+    record = StageRecord(count, nbytes)
+    if timings is None:
+        yield record
+        return
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        timings.add(name, time.perf_counter() - start, record.count, record.nbytes)
+
+
+@contextmanager
+def profiling(path):
+    """
+    Runs the enclosed code under cProfile and dumps the stats to path, for
+    reading with pstats or snakeviz. A path of None disables profiling.
+    """
+    if path is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
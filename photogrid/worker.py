@@ -0,0 +1,141 @@
+import queue
+import threading
+
+
+class CancelledError(Exception):
+    """
+    Raised inside a job at its next checkpoint once the job has been cancelled.
+    """
+
+
+class Job:
+    """
+    A handle for one piece of background work.
+
+    The job function receives its Job as the first argument and should call
+    report_progress (or check_cancelled) regularly; both raise CancelledError
+    once the job is cancelled, which ends it quietly.
+    """
+
+    def __init__(self, worker, on_done, on_error, on_progress, on_partial=None):
+        self._worker = worker
+        self._cancelled = threading.Event()
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.on_partial = on_partial
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def check_cancelled(self):
+        if self._cancelled.is_set():
+            raise CancelledError()
+
+    def report_progress(self, done, total, message=None):
+        """
+        Posts a progress update to the GUI thread, raising CancelledError if the job was cancelled.
+        """
+        self.check_cancelled()
+        if self.on_progress is not None:
+            self._worker._messages.put((self, 'progress', (done, total, message)))
+
+    def report_partial(self, result):
+        """
+        Posts an intermediate result to the GUI thread, raising CancelledError if the job was cancelled.
+
+        The result is handed over as is, so the job must not modify it afterwards.
+        """
+        self.check_cancelled()
+        if self.on_partial is not None:
+            self._worker._messages.put((self, 'partial', result))
+
+
+class BackgroundWorker:
+    """
+    Runs one job at a time on a background thread and hands its results back to
+    the GUI thread.
+
+    Callbacks never run on the background thread: they are queued and delivered
+    by poll(), which the GUI calls from its event loop (e.g. through Tk's after()).
+    Submitting a new job cancels the one still running, and messages from
+    cancelled jobs are dropped.
+    """
+
+    def __init__(self):
+        self._messages = queue.Queue()
+        self._current = None
+
+    @property
+    def busy(self):
+        return self._current is not None
+
+    def submit(self, fn, *args, on_done=None, on_error=None, on_progress=None, on_partial=None):
+        """
+        Cancels the running job, if any, and starts fn(job, *args) in the background.
+
+        Args:
+            fn (callable): The work to run. Its return value is passed to on_done.
+            *args: Extra arguments for fn.
+            on_done (callable): Called with the result.
+            on_error (callable): Called with the exception if fn fails.
+            on_progress (callable): Called with (done, total, message).
+            on_partial (callable): Called with each intermediate result.
+
+        Returns:
+            Job: The handle of the new job.
+        """
+        self.cancel()
+        job = Job(self, on_done, on_error, on_progress, on_partial)
+        self._current = job
+        thread = threading.Thread(target=self._run, args=(job, fn, args), daemon=True)
+        thread.start()
+        return job
+
+    def _run(self, job, fn, args):
+        try:
+            result = fn(job, *args)
+        except CancelledError:
+            return
+        except Exception as e:
+            self._messages.put((job, 'error', e))
+        else:
+            self._messages.put((job, 'done', result))
+
+    def cancel(self):
+        """
+        Cancels the running job. Its callbacks will not be called.
+        """
+        if self._current is not None:
+            self._current.cancel()
+            self._current = None
+
+    def poll(self):
+        """
+        Delivers queued callbacks. Must be called from the GUI thread.
+        """
+        while True:
+            try:
+                job, kind, payload = self._messages.get_nowait()
+            except queue.Empty:
+                return
+
+            if job.cancelled:
+                continue
+            if kind == 'progress':
+                job.on_progress(*payload)
+                continue
+            if kind == 'partial':
+                job.on_partial(payload)
+                continue
+
+            if job is self._current:
+                self._current = None
+            if kind == 'done' and job.on_done is not None:
+                job.on_done(payload)
+            elif kind == 'error' and job.on_error is not None:
+                job.on_error(payload)
@@ -0,0 +1,161 @@
+import unittest
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
+from PIL import Image
+from photogrid import batch, render
+from photogrid.batch import CollageJob, load_manifest, run_manifest, main
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.image_dir = os.path.join(self.test_dir, 'images')
+        os.mkdir(self.image_dir)
+        for i in range(4):
+            size = (60, 40) if i % 2 else (40, 60)
+            Image.new('RGB', size, (60 * i, 0, 0)).save(os.path.join(self.image_dir, f'{i}.jpg'))
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def write_manifest(self, name, content):
+        path = os.path.join(self.test_dir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_load_manifest_formats(self):
+        """
+        Tests that list, object and JSON-lines manifests load with defaults and
+        paths relative to the manifest.
+        """
+        jobs = [{'folder': 'images', 'output': 'out/a.jpg', 'seed': 1},
+                {'folder': 'images', 'output': 'out/b.jpg', 'width': 320, 'height': 240, 'crop': True}]
+        expected = [CollageJob(folder=self.image_dir, output=os.path.join(self.test_dir, 'out/a.jpg'), seed=1),
+                    CollageJob(folder=self.image_dir, output=os.path.join(self.test_dir, 'out/b.jpg'),
+                               width=320, height=240, crop=True)]
+
+        for name, content in (('list.json', json.dumps(jobs)),
+                              ('object.json', json.dumps({'jobs': jobs})),
+                              ('lines.jsonl', '\n'.join(json.dumps(job) for job in jobs))):
+            self.assertEqual(load_manifest(self.write_manifest(name, content)), expected)
+
+        with self.assertRaises(ValueError):
+            load_manifest(self.write_manifest('bad.json', json.dumps([{'folder': 'x', 'output': 'y', 'colour': 1}])))
+
+    def test_run_manifest_resumes(self):
+        """
+        Tests that jobs render their outputs and that a rerun skips finished outputs.
+        """
+        manifest = self.write_manifest('jobs.json', json.dumps([
+            {'folder': 'images', 'output': 'out/a.jpg', 'width': 320, 'height': 240, 'seed': 1},
+            {'folder': 'images', 'output': 'out/b.jpg', 'width': 240, 'height': 240, 'seed': 2, 'crop': True},
+            {'folder': 'missing', 'output': 'out/c.jpg'},
+        ]))
+        jobs = load_manifest(manifest)
+        lines = []
+
+        counts = run_manifest(jobs, workers=2, report=lines.append)
+        self.assertEqual(counts, {'done': 2, 'skipped': 0, 'failed': 1})
+        with Image.open(os.path.join(self.test_dir, 'out', 'a.jpg')) as img:
+            self.assertEqual(img.size, (320, 240))
+
+        counts = run_manifest(jobs[:2], workers=2, report=lines.append)
+        self.assertEqual(counts, {'done': 0, 'skipped': 2, 'failed': 0})
+
+        self.assertEqual(main([manifest, '--workers', '1', '--force']), 1)
+
+    def test_run_manifest_with_renditions(self):
+        """
+        Tests that a job writes its renditions along with its output.
+        """
+        manifest = self.write_manifest('jobs.json', json.dumps([
+            {'folder': 'images', 'output': 'out/a.jpg', 'width': 320, 'height': 240, 'seed': 1,
+             'renditions': [{'kind': 'image', 'output': 'out/a_small.jpg', 'max_size': 100},
+                            {'kind': 'dzi', 'output': 'out/a.dzi'}]},
+        ]))
+        counts = run_manifest(load_manifest(manifest), workers=0, report=lambda line: None)
+        self.assertEqual(counts, {'done': 1, 'skipped': 0, 'failed': 0})
+        with Image.open(os.path.join(self.test_dir, 'out', 'a_small.jpg')) as img:
+            self.assertEqual(img.size, (100, 75))
+        for name in ('a.jpg', 'a.dzi', 'a_files'):
+            self.assertTrue(os.path.exists(os.path.join(self.test_dir, 'out', name)))
+
+    def test_run_manifest_with_pages(self):
+        """
+        Tests that a paginated job writes numbered pages and a coverage report, and is skipped on rerun.
+        """
+        manifest = self.write_manifest('jobs.json', json.dumps([
+            {'folder': 'images', 'output': 'out/sheet.jpg', 'width': 320, 'height': 240, 'seed': 1,
+             'page_size': 2},
+            {'folder': 'images', 'output': 'out/bad.jpg', 'page_size': 2,
+             'renditions': [{'kind': 'dzi', 'output': 'out/bad.dzi'}]},
+        ]))
+        jobs = load_manifest(manifest)
+        lines = []
+        counts = run_manifest(jobs[:1], workers=2, report=lines.append)
+        self.assertEqual(counts, {'done': 1, 'skipped': 0, 'failed': 0})
+        self.assertIn('2 pages', lines[0])
+        with open(os.path.join(self.test_dir, 'out', 'sheet_pages.json')) as f:
+            pages = json.load(f)
+        self.assertEqual([page['output'] for page in pages['pages']], ['sheet_001.jpg', 'sheet_002.jpg'])
+        self.assertEqual(pages['images'], 4)
+        self.assertAlmostEqual(pages['mean'], sum(page['coverage'] for page in pages['pages']) / 2)
+        with Image.open(os.path.join(self.test_dir, 'out', 'sheet_002.jpg')) as img:
+            self.assertEqual(img.size, (320, 240))
+        self.assertFalse(os.path.exists(os.path.join(self.test_dir, 'out', 'sheet.jpg')))
+
+        self.assertEqual(run_manifest(jobs[:1], workers=0, report=lines.append)['skipped'], 1)
+        self.assertEqual(run_manifest(jobs[1:], workers=0, report=lines.append)['failed'], 1)
+        with self.assertRaises(ValueError):
+            load_manifest(self.write_manifest('bad.json', json.dumps([{'folder': 'x', 'output': 'y',
+                                                                        'page_size': 0}])))
+
+    def test_interrupted_pages_are_not_rendered_again(self):
+        """
+        Tests that a rerun renders only the pages an earlier run did not finish.
+        """
+        manifest = self.write_manifest('jobs.json', json.dumps([
+            {'folder': 'images', 'output': 'out/sheet.jpg', 'width': 320, 'height': 240, 'seed': 1,
+             'page_size': 2},
+        ]))
+        jobs = load_manifest(manifest)
+        run_job = batch.run_job
+
+        def fail_second_page(job, *args):
+            if job.output.endswith('_002.jpg'):
+                raise OSError("interrupted")
+            return run_job(job, *args)
+
+        with mock.patch.object(batch, 'run_job', side_effect=fail_second_page):
+            self.assertEqual(run_manifest(jobs, workers=0, report=lambda line: None)['failed'], 1)
+        with mock.patch.object(batch, 'run_job', wraps=run_job) as rerun:
+            self.assertEqual(run_manifest(jobs, workers=0, report=lambda line: None)['done'], 1)
+        self.assertEqual([call.args[0].output for call in rerun.call_args_list],
+                         [os.path.join(self.test_dir, 'out', 'sheet_002.jpg')])
+        with open(os.path.join(self.test_dir, 'out', 'sheet_pages.json')) as f:
+            self.assertEqual(len(json.load(f)['pages']), 2)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.test_dir, 'out'))),
+                         ['sheet_001.jpg', 'sheet_002.jpg', 'sheet_pages.json'])
+
+    def test_jobs_share_a_tile_cache(self):
+        """
+        Tests that a job rendering the tiles of an earlier one reads them from the run's tile cache.
+        """
+        manifest = self.write_manifest('jobs.json', json.dumps([
+            {'folder': 'images', 'output': 'out/a.jpg', 'width': 320, 'height': 240, 'seed': 1},
+            {'folder': 'images', 'output': 'out/a.png', 'width': 320, 'height': 240, 'seed': 1},
+        ]))
+        cache_dir = os.path.join(self.test_dir, 'tiles')
+        with mock.patch.object(render, 'render_tile', wraps=render.render_tile) as render_tile:
+            counts = run_manifest(load_manifest(manifest), workers=0, report=lambda line: None,
+                                  tile_cache_dir=cache_dir)
+        self.assertEqual(counts['done'], 2)
+        self.assertEqual(render_tile.call_count, 4)
+        self.assertTrue(os.listdir(cache_dir))
+
+if __name__ == '__main__':
+    unittest.main()
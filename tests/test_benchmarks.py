@@ -0,0 +1,57 @@
+import unittest
+import shutil
+import tempfile
+import time
+from photogrid.engine import search_layout
+from photogrid.image_utils import ImageInfo, analyze_images
+from benchmarks.corpus import generate_corpus
+from benchmarks.scenarios import compare_results
+
+class TestBenchmarks(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_corpus_matches_its_counts(self):
+        """
+        Tests that the scanner sees the landscape and portrait photos the generator
+        reports, and skips the square and broken files.
+        """
+        counts = generate_corpus(self.test_dir, 20, sizes=((64, 48),), square_fraction=0.2,
+                                 broken_fraction=0.2, seed=3)
+        self.assertEqual(sum(counts.values()), 20)
+        h, v = analyze_images(self.test_dir)
+        self.assertEqual(len(h), counts['landscape'])
+        self.assertEqual(len(v), counts['portrait'])
+
+    def test_justified_search_keeps_up_with_greedy(self):
+        """
+        Tests that the justified search of 16,000 images costs no more than a few
+        greedy searches of them, best of three runs each, so it scales as well.
+        """
+        images = [ImageInfo(f'{i}.jpg', 3000, 2000, 1.5) if i % 3 else ImageInfo(f'{i}.jpg', 2000, 3000, 2 / 3)
+                  for i in range(16000)]
+        seconds = {}
+        for mode in ('greedy', 'justified'):
+            times = []
+            for _ in range(3):
+                start = time.perf_counter()
+                search_layout(images, 1920, 1080, 10, 50, False, mode=mode)
+                times.append(time.perf_counter() - start)
+            seconds[mode] = min(times)
+        self.assertLess(seconds['justified'], 4 * seconds['greedy'])
+
+    def test_compare_flags_slowdowns(self):
+        baseline = {'scenarios': {'scan': {'wall_time': 1.0}, 'save': {'wall_time': 2.0}}}
+        current = {'scenarios': {'scan': {'wall_time': 1.05}, 'save': {'wall_time': 2.5}, 'new': {'wall_time': 1.0}}}
+        rows = {row[0]: row for row in compare_results(baseline, current, threshold=0.1)}
+        self.assertEqual(set(rows), {'scan', 'save'})
+        self.assertFalse(rows['scan'][4])
+        self.assertTrue(rows['save'][4])
+        self.assertAlmostEqual(rows['save'][3], 1.25)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+import random
+from photogrid.image_utils import ImageInfo
+from photogrid.catalog import ImageCatalog, Placements
+from photogrid.layout import build_rows, construct_layout, place_rows, scale_layout, justified_layout
+from photogrid.engine import shuffled, search_layout, layout_coverage
+from photogrid.render import _tile_box
+
+def make_images(count, seed=0):
+    rng = random.Random(seed)
+    images = []
+    for i in range(count):
+        width, height = rng.choice(((400, 300), (300, 400), (600, 400), (350, 500)))
+        images.append(ImageInfo(path=f'{i}.jpg', width=width, height=height, aspect_ratio=width / height))
+    return images
+
+class TestCatalog(unittest.TestCase):
+
+    def test_catalog_reads_like_a_list(self):
+        images = make_images(10)
+        catalog = ImageCatalog.from_infos(images)
+        self.assertEqual(len(catalog), 10)
+        self.assertEqual(list(catalog), images)
+        self.assertEqual(catalog[3], images[3])
+        self.assertEqual(list(catalog[2:5]), images[2:5])
+        self.assertEqual(catalog.widths.dtype.itemsize, 4)
+        self.assertIs(ImageCatalog.from_infos(catalog), catalog)
+
+    def test_shuffled_catalog_matches_shuffled_list(self):
+        images = make_images(30)
+        self.assertEqual(list(shuffled(ImageCatalog.from_infos(images), 7)), shuffled(images, 7))
+
+    def test_layouts_from_catalog_match_lists(self):
+        """
+        Tests that both layout modes give the same placements for a catalog as
+        for the equivalent list of ImageInfo.
+        """
+        images = make_images(200)
+        catalog = ImageCatalog.from_infos(images)
+        for mode in ('greedy', 'justified'):
+            for is_cropping in (False, True):
+                expected = search_layout(images, 1920, 1080, 10, 50, is_cropping, mode=mode)
+                actual = search_layout(catalog, 1920, 1080, 10, 50, is_cropping, mode=mode)
+                self.assertIsInstance(actual, Placements)
+                self.assertEqual(actual, expected)
+        self.assertEqual(len(search_layout(ImageCatalog([], [], []), 100, 100, 1, 2, False)), 0)
+
+    def test_place_rows_matches_construct_layout(self):
+        rng = random.Random(1)
+        sized = [{'path': f'{i}.jpg', 'width': rng.uniform(50, 300), 'height': rng.uniform(50, 200)}
+                 for i in range(120)]
+        rows = build_rows(sized, 1000, 8)
+        starts = [0]
+        for row in rows[:-1]:
+            starts.append(starts[-1] + len(row))
+
+        placements = place_rows([img['path'] for img in sized], [img['width'] for img in sized],
+                                [img['height'] for img in sized], starts, 1000, 8, 40)
+        self.assertEqual(placements, construct_layout(rows, 1000, 8, 40))
+
+    def test_placements_adapt_to_the_dict_api(self):
+        layout = justified_layout(make_images(40), 800, 600, 5)
+        dicts = layout.to_dicts()
+        self.assertEqual(Placements.from_dicts(dicts), layout)
+        self.assertEqual(layout[0], dicts[0])
+        self.assertEqual(scale_layout(layout, 0.5), scale_layout(dicts, 0.5))
+        self.assertAlmostEqual(layout_coverage(layout, 800, 600), layout_coverage(dicts, 800, 600))
+        self.assertEqual(layout.tile_tasks(), [(img['path'], *_tile_box(img)) for img in dicts])
+
+if __name__ == '__main__':
+    unittest.main()
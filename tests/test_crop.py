@@ -0,0 +1,140 @@
+import unittest
+import os
+import shutil
+import tempfile
+from unittest import mock
+from PIL import Image, ImageChops, ImageOps, ImageStat
+from photogrid import crop
+from photogrid.crop import CropPlan, plan_crop, plan_crops, source_crop_box
+from photogrid.image_utils import ImageInfo, crop_box
+from photogrid.index import INDEX_FILENAME, ImageIndex
+from photogrid.render import render_tile
+from photogrid.session import CollageSession
+
+class TestContentCrop(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def save_subject_image(self, name, size, subject_box, orientation=1):
+        """
+        Saves a flat gray image with a detailed red subject in subject_box (in displayed pixels).
+        """
+        img = Image.new('RGB', size, (128, 128, 128))
+        noise = Image.effect_noise((subject_box[2] - subject_box[0], subject_box[3] - subject_box[1]), 80)
+        black = Image.new('L', noise.size)
+        img.paste(Image.merge('RGB', (noise, black, black)), subject_box[:2])
+        # Store the pixels so that the orientation tag turns them back into img
+        inverse = {6: Image.Transpose.ROTATE_90, 8: Image.Transpose.ROTATE_270, 3: Image.Transpose.ROTATE_180}
+        if orientation in inverse:
+            img = img.transpose(inverse[orientation])
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        path = os.path.join(self.test_dir, name)
+        img.save(path, exif=exif, quality=95)
+        return path
+
+    def test_crop_follows_the_subject(self):
+        """
+        Tests that the window slides toward a subject near an edge, in displayed coordinates.
+        """
+        path = self.save_subject_image('top.jpg', (800, 1600), (200, 50, 600, 350))
+        left, top, right, bottom = plan_crop(path, 1.0)
+        self.assertEqual((left, right), (0, 800))
+        self.assertEqual(bottom - top, 800)
+        self.assertLess(top, 100)
+
+        path = self.save_subject_image('right.jpg', (1600, 800), (1250, 200, 1550, 600), orientation=6)
+        left, top, right, bottom = plan_crop(path, 1.0)
+        self.assertEqual(right - left, 800)
+        self.assertGreater(left, 700)
+
+    def test_exif_thumbnail_serves_as_proxy(self):
+        """
+        Tests that a photo with an EXIF thumbnail is planned without decoding the
+        photo, to about the box its 1/8 scale decode gives.
+        """
+        path = os.path.join(os.path.dirname(__file__), '..', 'test-images', '1991_0046.jpg')
+        with mock.patch.object(Image.Image, 'draft', autospec=True, wraps=Image.Image.draft) as draft:
+            box = plan_crop(path, 1.0)
+        draft.assert_not_called()
+        with mock.patch.object(crop, 'exif_thumbnail', return_value=None):
+            decoded = plan_crop(path, 1.0)
+        self.assertEqual((box[0], box[2]), (decoded[0], decoded[2]))
+        self.assertLess(abs(box[1] - decoded[1]), 0.02 * 5698)
+
+    def test_flat_image_keeps_center_crop(self):
+        """
+        Tests that an image without a subject is cropped like the center crop.
+        """
+        path = os.path.join(self.test_dir, 'flat.jpg')
+        Image.new('RGB', (1200, 800), (90, 120, 150)).save(path)
+        self.assertEqual(plan_crop(path, 1.0), crop_box(1200, 800, 1.0))
+
+    def test_plans_are_stored_in_the_index(self):
+        """
+        Tests that planned boxes are kept in the folder's index and dropped when the file changes.
+        """
+        path = self.save_subject_image('a.jpg', (800, 1600), (200, 50, 600, 350))
+        missing = os.path.join(self.test_dir, 'missing.jpg')
+        plan = plan_crops([path, missing], 1.0, max_workers=1)
+        self.assertEqual(set(plan.boxes), {path})
+        with ImageIndex.for_folder(self.test_dir) as index:
+            self.assertEqual(index.get_crops([path], 1.0), {path: plan.boxes[path]})
+            self.assertEqual(index.get_crops([path], 0.5), {})
+
+        os.utime(path, ns=(0, 0))
+        with ImageIndex.for_folder(self.test_dir) as index:
+            self.assertEqual(index.get_crops([path], 1.0), {})
+
+    def test_scanned_tree_keeps_one_index(self):
+        """
+        Tests that with the scanned root's index, images in subfolders get no sidecar of their own.
+        """
+        os.mkdir(os.path.join(self.test_dir, 'day2'))
+        path = self.save_subject_image(os.path.join('day2', 'c.jpg'), (800, 1600), (200, 50, 600, 350))
+        index_path = os.path.join(self.test_dir, INDEX_FILENAME)
+        plan = plan_crops([path], 1.0, max_workers=1, index_path=index_path)
+        self.assertEqual(os.listdir(os.path.join(self.test_dir, 'day2')), ['c.jpg'])
+        with ImageIndex(index_path) as index:
+            self.assertEqual(index.get_crops([path], 1.0), plan.boxes)
+
+    def test_render_tile_uses_the_plan(self):
+        """
+        Tests that a tile rendered with a CropPlan shows the planned box, and that
+        images without a box in the plan are center-cropped.
+        """
+        path = self.save_subject_image('b.jpg', (800, 1600), (200, 50, 600, 350))
+        plan = plan_crops([path], 1.0, max_workers=1, use_index=False)
+        with Image.open(path) as img:
+            img = ImageOps.exif_transpose(img)
+            expected = img.resize((100, 100), box=plan.boxes[path])
+            centered = img.resize((100, 100), box=crop_box(800, 1600, 1.0))
+        tile = render_tile(path, (100, 100), plan)
+        self.assertLess(max(ImageStat.Stat(ImageChops.difference(tile, expected)).mean), 4)
+        self.assertGreater(max(ImageStat.Stat(ImageChops.difference(tile, centered)).mean), 10)
+
+        self.assertEqual(source_crop_box(CropPlan(1.0), path, 800, 1600), crop_box(800, 1600, 1.0))
+        self.assertEqual(source_crop_box(None, path, 800, 1600), (0, 0, 800, 1600))
+
+    def test_session_crop_mode(self):
+        """
+        Tests that switching the crop mode re-renders without searching the layout again.
+        """
+        paths = [self.save_subject_image(f'{i}.jpg', (400, 300), (0, 0, 100, 100)) for i in range(4)]
+        images = [ImageInfo(path, 400, 300, 4 / 3) for path in paths]
+        session = CollageSession(images=images, seed=1, output_size=(400, 400), is_cropping=True)
+        center = session.preview((200, 200))
+        self.assertEqual(session.update(crop_mode='content'), {'crop_mode'})
+        content = session.preview((200, 200))
+        self.assertIn('crop_plan', session.recomputed)
+        self.assertNotIn('search', session.recomputed)
+        self.assertNotEqual(center.tobytes(), content.tobytes())
+        with self.assertRaises(ValueError):
+            session.update(crop_mode='face')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import unittest
+import os
+import shutil
+import tempfile
+from unittest import mock
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+from photogrid import dedup
+from photogrid.batch import CollageJob, job_layout
+from photogrid.catalog import ImageCatalog
+from photogrid.dedup import (cluster_labels, dedupe_images, find_duplicates, hamming_distances, hash_images,
+                             near_duplicate_pairs)
+from photogrid.image_utils import ImageInfo
+from photogrid.index import INDEX_FILENAME, ImageIndex
+
+class TestDedup(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def save_scene(self, name, shapes, blur=0, shift=0):
+        """
+        Saves a 600x400 scene of rectangles, optionally blurred or shifted a little, as burst frames are.
+        """
+        img = Image.new('RGB', (600, 400), (40, 60, 90))
+        draw = ImageDraw.Draw(img)
+        for i, (x, y) in enumerate(shapes):
+            draw.rectangle((x + shift, y, x + shift + 120, y + 90), fill=(250 - 40 * i, 200, 40 * i))
+        if blur:
+            img = img.filter(ImageFilter.GaussianBlur(blur))
+        path = os.path.join(self.test_dir, name)
+        img.save(path, quality=90)
+        return path
+
+    def burst(self):
+        scene = [(30, 40), (300, 60), (150, 250)]
+        paths = [self.save_scene('a_soft.jpg', scene, blur=3),
+                 self.save_scene('b_sharp.jpg', scene, shift=2),
+                 self.save_scene('c_softer.jpg', scene, blur=5)]
+        other = self.save_scene('d_other.jpg', [(400, 20), (20, 200), (250, 150)])
+        return paths, other
+
+    def test_find_duplicates_keeps_the_sharpest(self):
+        """
+        Tests that frames of one scene form a group led by the sharpest, apart from a different scene.
+        """
+        (soft, sharp, softer), other = self.burst()
+        clusters = find_duplicates([soft, sharp, other, softer], max_workers=1, use_index=False)
+        self.assertEqual(clusters, [[sharp, soft, softer]])
+
+        images = ImageCatalog([soft, sharp, other, softer], [600] * 4, [400] * 4)
+        kept = dedupe_images(images, max_workers=1, use_index=False)
+        self.assertIsInstance(kept, ImageCatalog)
+        self.assertEqual(kept.paths, [sharp, other])
+        self.assertEqual([img.path for img in dedupe_images(list(images), use_index=False)], [sharp, other])
+
+    def test_hashes_are_stored_in_the_index(self):
+        """
+        Tests that hashes are reused from the folder's index until the file changes.
+        """
+        (soft, sharp, _), _ = self.burst()
+        hashes = hash_images([soft, sharp], max_workers=1)
+        with mock.patch.object(dedup, 'hash_image') as hash_image:
+            self.assertEqual(hash_images([soft, sharp], max_workers=1), hashes)
+            hash_image.assert_not_called()
+        self.assertTrue(all(0 <= value < 2 ** 64 for value, _ in hashes.values()))
+
+        os.utime(sharp, ns=(0, 0))
+        with ImageIndex.for_folder(self.test_dir) as index:
+            self.assertEqual(set(index.get_hashes([soft, sharp])), {soft})
+            index.invalidate([soft])
+            self.assertEqual(index.get_hashes([soft, sharp]), {})
+
+    def test_scanned_tree_keeps_one_index(self):
+        """
+        Tests that with the scanned root's index, frames in subfolders get no sidecar of their own.
+        """
+        (soft, sharp, _), _ = self.burst()
+        os.mkdir(os.path.join(self.test_dir, 'day2'))
+        moved = os.path.join(self.test_dir, 'day2', 'b_sharp.jpg')
+        os.rename(sharp, moved)
+        index_path = os.path.join(self.test_dir, INDEX_FILENAME)
+        self.assertEqual(find_duplicates([soft, moved], max_workers=1, index_path=index_path), [[moved, soft]])
+        self.assertEqual(os.listdir(os.path.join(self.test_dir, 'day2')), ['b_sharp.jpg'])
+        with ImageIndex(index_path) as index:
+            self.assertEqual(set(index.get_hashes([soft, moved])), {soft, moved})
+
+    def test_near_duplicate_pairs_match_brute_force(self):
+        """
+        Tests the banded search against comparing every pair, and that clusters are transitive.
+        """
+        rng = np.random.default_rng(0)
+        base = rng.integers(0, 2 ** 63, 400, dtype=np.uint64) * np.uint64(2)
+        flipped = base[:100] ^ (np.uint64(1) << rng.integers(0, 64, 100).astype(np.uint64))
+        far = base[:100] ^ np.uint64(0xFF00FF)
+        hashes = np.concatenate((base, flipped, far))
+
+        for max_distance in (0, 3, 8):
+            first, second = near_duplicate_pairs(hashes, max_distance)
+            rows, columns = np.triu_indices(len(hashes), 1)
+            close = hamming_distances(hashes[rows], hashes[columns]) <= max_distance
+            self.assertEqual(set(zip(first.tolist(), second.tolist())),
+                             set(zip(rows[close].tolist(), columns[close].tolist())))
+        self.assertEqual(near_duplicate_pairs([], 6)[0].size, 0)
+
+        labels = cluster_labels(6, np.array([4, 1, 2]), np.array([5, 4, 3]))
+        self.assertEqual(labels.tolist(), [0, 1, 2, 2, 1, 1])
+
+    def test_job_dedupe(self):
+        """
+        Tests that a job with dedupe set lays out one frame per scene.
+        """
+        paths, other = self.burst()
+        images = [ImageInfo(path, 600, 400, 1.5) for path in paths + [other]]
+        job = CollageJob(folder=self.test_dir, output='', width=800, height=400, seed=1)
+        self.assertEqual(len(job_layout(job, images)), 4)
+        self.assertEqual(len(job_layout(job._replace(dedupe=True), images)), 2)
+
+if __name__ == '__main__':
+    unittest.main()
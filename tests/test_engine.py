@@ -0,0 +1,132 @@
+import unittest
+import random
+import os
+import shutil
+import tempfile
+from PIL import Image
+from photogrid.image_utils import ImageInfo
+from photogrid.layout import build_rows, construct_layout
+from photogrid.engine import (shuffled, search_layout, layout_coverage, save_collage, LayoutSearch,
+                              estimate_target_scale, size_images, score_rows, SEARCH_STEPS, search_shuffles,
+                              seeded_layout, score_shuffle, layout_score)
+
+def make_images(count):
+    images = []
+    for i in range(count):
+        if i % 3 == 0:
+            images.append(ImageInfo(path=f'v{i}.jpg', width=300, height=400, aspect_ratio=3/4))
+        else:
+            images.append(ImageInfo(path=f'h{i}.jpg', width=400, height=300, aspect_ratio=4/3))
+    return images
+
+class TestEngine(unittest.TestCase):
+
+    def test_shuffled_is_reproducible(self):
+        """
+        Tests that a seeded shuffle is deterministic and leaves the input untouched.
+        """
+        images = make_images(20)
+        self.assertEqual(shuffled(images, 42), shuffled(images, 42))
+        self.assertNotEqual(shuffled(images, 42), images)
+        self.assertEqual(images, make_images(20))
+
+    def test_search_layout_fits_canvas(self):
+        """
+        Tests that the searched layout places every image inside the canvas.
+        """
+        for is_cropping in (False, True):
+            layout = search_layout(make_images(30), 1920, 1080, 10, 50, is_cropping)
+            self.assertEqual(len(layout), 30)
+            for placement in layout:
+                self.assertLessEqual(placement['x'] + placement['width'], 1920 + 1e-6)
+                self.assertLessEqual(placement['y'] + placement['height'], 1080 + 1e-6)
+            self.assertGreater(layout_coverage(layout, 1920, 1080), 0.3)
+
+    def test_layout_search_matches_greedy_scoring(self):
+        """
+        Tests that the batched search scores every scale like build_rows and
+        score_rows do, and picks the same layout.
+        """
+        rng = random.Random(7)
+        for trial in range(20):
+            images = []
+            for i in range(rng.randint(1, 200)):
+                aspect_ratio = rng.choice([rng.uniform(1.2, 1.8), rng.uniform(0.5, 0.8)])
+                images.append(ImageInfo(path=f'{i}.jpg', width=1000, height=1000 / aspect_ratio, aspect_ratio=aspect_ratio))
+            output_w, output_h = rng.choice([(1920, 1080), (1080, 1920), (3000, 3000)])
+            min_space = rng.choice([0, 5, 10])
+            is_cropping = rng.random() < 0.4
+
+            target_scale = estimate_target_scale(images, output_w, output_h, min_space)
+            expected_scores = []
+            best_layout, max_score = None, -float('inf')
+            for i in range(SEARCH_STEPS):
+                scale = target_scale * (0.5 + (i / (SEARCH_STEPS - 1)) * 2.5)
+                rows = build_rows(size_images(images, scale, output_w, output_h, is_cropping), output_w, min_space)
+                score = score_rows(rows, output_w, output_h, min_space)
+                expected_scores.append(score)
+                if score > max_score:
+                    best_layout, max_score = construct_layout(rows, output_w, min_space, 50), score
+
+            search = LayoutSearch(images, output_w, output_h, min_space, is_cropping)
+            for actual, expected in zip(search.scores(), expected_scores):
+                self.assertAlmostEqual(actual, expected, places=9)
+            self.assertEqual(search_layout(images, output_w, output_h, min_space, 50, is_cropping), best_layout)
+
+    def test_save_collage_writes_atomically(self):
+        """
+        Tests that save_collage writes the output without leaving a temporary file.
+        """
+        test_dir = tempfile.mkdtemp()
+        try:
+            source = os.path.join(test_dir, 'h.jpg')
+            Image.new('RGB', (40, 30), 'red').save(source)
+            output = os.path.join(test_dir, 'out.jpg')
+            save_collage([{'path': source, 'x': 0, 'y': 0, 'width': 40, 'height': 30}], output, (50, 40))
+            self.assertEqual(sorted(os.listdir(test_dir)), ['h.jpg', 'out.jpg'])
+            with Image.open(output) as img:
+                self.assertEqual((img.format, img.size), ('JPEG', (50, 40)))
+        finally:
+            shutil.rmtree(test_dir)
+
+    def test_search_shuffles_keeps_the_best_shuffle(self):
+        """
+        Tests that the shuffle search returns the best of the shuffles it scored,
+        reproducibly by its seed and independently of the number of workers.
+        """
+        images = make_images(25)
+        for mode in ('greedy', 'justified'):
+            single = search_shuffles(images, 1920, 1080, 10, 50, False, seed=9, mode=mode, time_budget=None,
+                                     max_shuffles=1, workers=1)
+            self.assertEqual((single.seed, single.shuffles), (9, 1))
+            self.assertEqual(single.layout, seeded_layout(images, 1920, 1080, 10, 50, False, 9, mode))
+
+            serial = search_shuffles(images, 1920, 1080, 10, 50, False, seed=9, mode=mode, time_budget=None,
+                                     max_shuffles=12, workers=1)
+            parallel = search_shuffles(images, 1920, 1080, 10, 50, False, seed=9, mode=mode, time_budget=None,
+                                       max_shuffles=12, workers=2)
+            self.assertEqual((serial.seed, serial.score, serial.shuffles), (parallel.seed, parallel.score, 12))
+            self.assertEqual(serial.layout, seeded_layout(images, 1920, 1080, 10, 50, False, serial.seed, mode))
+            self.assertEqual(serial.score, score_shuffle(images, serial.seed, 1920, 1080, 10, 50, False, mode))
+            self.assertGreaterEqual(serial.score, single.score)
+
+    def test_search_shuffles_time_budget(self):
+        """
+        Tests that a time-limited search stops near its budget and scores at least one shuffle.
+        """
+        result = search_shuffles(make_images(30), 1920, 1080, 10, 50, False, time_budget=0.2, workers=1)
+        self.assertGreaterEqual(result.shuffles, 1)
+        self.assertEqual(len(result.layout), 30)
+        with self.assertRaises(ValueError):
+            search_shuffles(make_images(3), 800, 600, 10, 50, False, time_budget=None)
+
+    def test_layout_score(self):
+        """
+        Tests that layout_score is coverage minus balance penalty, and -1 for overflowing layouts.
+        """
+        layout = [{'path': 'a.jpg', 'x': 0, 'y': 0, 'width': 100, 'height': 100}]
+        self.assertAlmostEqual(layout_score(layout, 200, 100), 0.5 - 0.5)
+        self.assertEqual(layout_score(layout, 50, 100), -1)
+
+if __name__ == '__main__':
+    unittest.main()
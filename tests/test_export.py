@@ -0,0 +1,98 @@
+import unittest
+import os
+import shutil
+import tempfile
+from PIL import Image
+from photogrid.export import Pyramid, Rendition, export_renditions, rendition_from_dict, web_renditions
+
+class TestExport(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.canvas = Image.linear_gradient('L').resize((1000, 600)).convert('RGB')
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_pyramid_halves_rounding_up(self):
+        """
+        Tests that every pyramid level is half the one above, rounded up, down to one pixel.
+        """
+        pyramid = Pyramid(self.canvas)
+        self.assertEqual([level.size for level in pyramid.levels][:4], [(1000, 600), (500, 300), (250, 150), (125, 75)])
+        self.assertEqual(pyramid[len(pyramid) - 1].size, (1, 1))
+        self.assertEqual(len(pyramid), 11)  # ceil(log2(1000)) + 1
+        self.assertEqual(pyramid.covering((200, 100)).size, (250, 150))
+
+    def test_image_renditions(self):
+        """
+        Tests that image renditions fit their max size, and that the full one keeps the canvas size.
+        """
+        folder = os.path.join(self.test_dir, 'out')
+        export_renditions(self.canvas, [Rendition('image', os.path.join(folder, 'full.png')),
+                                        Rendition('image', os.path.join(folder, 'web.jpg'), 400),
+                                        Rendition('image', os.path.join(folder, 'big.jpg'), 5000)], workers=2)
+        with Image.open(os.path.join(folder, 'full.png')) as img:
+            self.assertEqual(img.tobytes(), self.canvas.tobytes())
+        with Image.open(os.path.join(folder, 'web.jpg')) as img:
+            self.assertEqual(img.size, (400, 240))
+        with Image.open(os.path.join(folder, 'big.jpg')) as img:
+            self.assertEqual(img.size, (1000, 600))
+
+    def test_deep_zoom_layout(self):
+        """
+        Tests the DZI descriptor, the number of levels and the overlap of the tiles.
+        """
+        output = os.path.join(self.test_dir, 'zoom.dzi')
+        export_renditions(self.canvas, [Rendition('dzi', output, tile_size=254, overlap=1)])
+        with open(output) as f:
+            descriptor = f.read()
+        self.assertIn('TileSize="254"', descriptor)
+        self.assertIn('<Size Width="1000" Height="600"/>', descriptor)
+
+        files = os.path.join(self.test_dir, 'zoom_files')
+        self.assertEqual(sorted(int(name) for name in os.listdir(files)), list(range(11)))
+        self.assertEqual(sorted(os.listdir(os.path.join(files, '0'))), ['0_0.jpg'])
+        self.assertEqual(len(os.listdir(os.path.join(files, '10'))), 4 * 3)
+        sizes = {}
+        for name in ('0_0', '1_0', '3_2'):
+            with Image.open(os.path.join(files, '10', f'{name}.jpg')) as img:
+                sizes[name] = img.size
+        self.assertEqual(sizes, {'0_0': (255, 255), '1_0': (256, 255), '3_2': (1000 - 761, 600 - 507)})
+        self.assertFalse(os.path.exists(files + '.part'))
+
+    def test_xyz_tiles_are_padded(self):
+        """
+        Tests that XYZ tiles are all tile_size square, and zoom 0 holds the whole canvas.
+        """
+        output = os.path.join(self.test_dir, 'tiles')
+        export_renditions(self.canvas, [Rendition('xyz', output, tile_size=256)], background_color='black')
+        self.assertEqual(sorted(os.listdir(output)), ['0', '1', '2'])
+        self.assertEqual(sorted(os.listdir(os.path.join(output, '2'))), ['0', '1', '2', '3'])
+        with Image.open(os.path.join(output, '2', '3', '2.jpg')) as img:
+            self.assertEqual(img.size, (256, 256))
+            self.assertLess(max(img.getpixel((250, 250))), 10)
+
+    def test_export_replaces_previous_tiles(self):
+        """
+        Tests that a second export replaces stale tiles rather than mixing with them.
+        """
+        output = os.path.join(self.test_dir, 'tiles')
+        os.makedirs(os.path.join(output, '9'))
+        export_renditions(self.canvas, [Rendition('xyz', output)])
+        self.assertNotIn('9', os.listdir(output))
+
+    def test_renditions_from_manifest_entries(self):
+        """
+        Tests manifest parsing of renditions and the default web set.
+        """
+        rendition = rendition_from_dict({'kind': 'image', 'output': 'web.jpg', 'max_size': 800}, self.test_dir)
+        self.assertEqual(rendition, Rendition('image', os.path.join(self.test_dir, 'web.jpg'), 800))
+        with self.assertRaises(ValueError):
+            rendition_from_dict({'kind': 'gif', 'output': 'a.gif'})
+        with self.assertRaises(ValueError):
+            rendition_from_dict({'kind': 'image', 'output': 'a.jpg', 'size': 3})
+        self.assertEqual([r.kind for r in web_renditions(self.test_dir)], ['image'] * 4 + ['dzi'])
+
+if __name__ == '__main__':
+    unittest.main()
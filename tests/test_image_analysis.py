@@ -1,8 +1,11 @@
 import unittest
 import os
 import tempfile
+from unittest import mock
 from PIL import Image
-from photogrid.image_utils import analyze_images
+from photogrid import image_utils
+from photogrid.image_utils import (analyze_images, read_jpeg_header, get_oriented_size, scan_images, FORMAT_PROBES,
+                                   list_image_paths)
 
 class TestImageAnalysis(unittest.TestCase):
 
@@ -28,9 +31,14 @@ class TestImageAnalysis(unittest.TestCase):
                 os.rmdir(os.path.join(root, name))
         os.rmdir(self.test_dir)
 
-    def create_test_image(self, path, width, height):
+    def create_test_image(self, path, width, height, orientation=None):
         img = Image.new('RGB', (width, height), color = 'red')
-        img.save(path)
+        if orientation is None:
+            img.save(path)
+        else:
+            exif = Image.Exif()
+            exif[0x0112] = orientation
+            img.save(path, exif=exif)
 
     def test_analyze_images(self):
         """
@@ -55,5 +63,85 @@ class TestImageAnalysis(unittest.TestCase):
         self.assertNotIn(os.path.join(self.test_dir, 'ignore.txt'), h_paths)
         self.assertNotIn(os.path.join(self.test_dir, 'ignore.png'), v_paths)
 
+    def test_read_jpeg_header(self):
+        """
+        Tests that the header reader returns stored dimensions and the EXIF orientation.
+        """
+        path = os.path.join(self.test_dir, "rotated.jpg")
+        self.create_test_image(path, 400, 300, orientation=6)
+
+        self.assertEqual(read_jpeg_header(path), (400, 300, 6))
+        self.assertEqual(read_jpeg_header(os.path.join(self.test_dir, "h1.jpg")), (400, 300, 1))
+
+        with self.assertRaises(ValueError):
+            read_jpeg_header(os.path.join(self.test_dir, "ignore.png"))
+
+    def test_header_scan_matches_decode_scan(self):
+        """
+        Tests that header-only scanning swaps dimensions for orientations 5-8
+        and agrees with a full decode.
+        """
+        for orientation in range(1, 9):
+            path = os.path.join(self.test_dir, f"o{orientation}.jpg")
+            self.create_test_image(path, 400, 300, orientation=orientation)
+            self.assertEqual(get_oriented_size(path, header_only=True),
+                             get_oriented_size(path, header_only=False))
+
+        self.assertEqual(analyze_images(self.test_dir, header_only=True),
+                         analyze_images(self.test_dir, header_only=False, max_workers=1))
+
+        horizontal, vertical = analyze_images(self.test_dir)
+        v_paths = {img.path for img in vertical}
+        self.assertIn(os.path.join(self.test_dir, 'o6.jpg'), v_paths)
+        self.assertIn(os.path.join(self.test_dir, 'o8.jpg'), v_paths)
+
+    def test_format_probes_match_pillow(self):
+        """
+        Tests that the PNG, WebP and TIFF header readers agree with Pillow on size and orientation.
+        """
+        saves = {'a.png': {}, 'lossy.webp': {'lossless': False}, 'lossless.webp': {'lossless': True},
+                 'a.tif': {}, 'b.tiff': {'compression': 'tiff_lzw'}}
+        for orientation in (1, 6):
+            for name, options in saves.items():
+                path = os.path.join(self.test_dir, f"o{orientation}_{name}")
+                exif = Image.Exif()
+                exif[0x0112] = orientation
+                Image.new('RGB', (321, 123), 'blue').save(path, exif=exif, **options)
+                probe = FORMAT_PROBES[os.path.splitext(path)[1]]
+                self.assertEqual(probe(path), (321, 123, orientation), name)
+                self.assertEqual(get_oriented_size(path, header_only=True),
+                                 get_oriented_size(path, header_only=False), name)
+
+        with self.assertRaises(ValueError):
+            FORMAT_PROBES['.png'](os.path.join(self.test_dir, "h1.jpg"))
+
+    def test_scan_images_walks_the_tree_lazily(self):
+        """
+        Tests that scan_images finds images in subfolders, skips hidden ones, and
+        yields the first images before the rest are read.
+        """
+        os.makedirs(os.path.join(self.test_dir, "trip", "day1"))
+        os.makedirs(os.path.join(self.test_dir, ".cache"))
+        nested = os.path.join(self.test_dir, "trip", "day1", "n.png")
+        self.create_test_image(nested, 200, 100)
+        self.create_test_image(os.path.join(self.test_dir, "trip", "t.webp"), 100, 200)
+        self.create_test_image(os.path.join(self.test_dir, ".cache", "hidden.jpg"), 200, 100)
+
+        paths = {info.path for info in scan_images(self.test_dir, recursive=True)}
+        self.assertEqual(len(paths), 6)
+        self.assertIn(nested, paths)
+        self.assertEqual(len(list_image_paths(self.test_dir)), 6)  # Not recursive, including the square files
+        self.assertEqual(sum(map(len, analyze_images(self.test_dir))), 4)
+        self.assertEqual(len(list(scan_images(self.test_dir))), 4)  # The same default as analyze_images
+
+        with mock.patch.object(image_utils, 'SCAN_CHUNK', 2), \
+                mock.patch.object(image_utils, 'probe_images', wraps=image_utils.probe_images) as probe:
+            images = scan_images(self.test_dir, recursive=True)
+            next(images)
+            self.assertLessEqual(probe.call_count, 2, "at most the two square images come first")
+            self.assertEqual(len(probe.call_args[0][0]), 2)
+            self.assertEqual(len(list(images)), 5)
+            self.assertEqual(probe.call_count, 4)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from PIL import Image
+from photogrid.image_utils import ORIENTATION_TRANSPOSE
+from photogrid.imaging import LazyModule
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_python(code):
+    """
+    Runs code in a fresh interpreter and returns what it printed as JSON.
+    """
+    output = subprocess.run([sys.executable, '-c', code], cwd=PROJECT_DIR, check=True, capture_output=True,
+                            text=True).stdout
+    return json.loads(output)
+
+
+class TestImaging(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_core_imports_skip_pillow_and_tkinter(self):
+        """
+        Tests that scanning and laying out a folder loads neither Pillow nor tkinter.
+        """
+        Image.new('RGB', (300, 200)).save(os.path.join(self.test_dir, 'a.jpg'))
+        loaded = run_python(
+            "import json, sys\n"
+            "from photogrid.engine import search_layout\n"
+            "from photogrid.index import analyze_images_cached\n"
+            f"h, v = analyze_images_cached({self.test_dir!r})\n"
+            "search_layout(h + v, 800, 600, 10, 50, False)\n"
+            "print(json.dumps([m for m in ('PIL.Image', 'tkinter', 'photogrid.render') if m in sys.modules]))")
+        self.assertEqual(loaded, [])
+
+    def test_opening_an_image_only_loads_its_plugins(self):
+        """
+        Tests that Pillow is only imported once an image is opened, and then
+        without the plugins of formats that were not opened.
+        """
+        Image.new('RGB', (30, 20)).save(os.path.join(self.test_dir, 'a.jpg'))
+        Image.new('RGB', (30, 20)).save(os.path.join(self.test_dir, 'b.png'))
+        state = run_python(
+            "import json, os, sys\n"
+            "import photogrid.batch, photogrid.crop, photogrid.dedup, photogrid.pages, photogrid.render\n"
+            "import photogrid.server, photogrid.session, photogrid.strips\n"
+            "from photogrid.imaging import open_image\n"
+            "before = [m for m in sys.modules if m == 'PIL' or m.startswith('PIL.')]\n"
+            f"sizes = [open_image(os.path.join({self.test_dir!r}, name)).size for name in ('a.jpg', 'b.png')]\n"
+            "plugins = [m for m in ('PIL.TiffImagePlugin', 'PIL.WebPImagePlugin') if m in sys.modules]\n"
+            "print(json.dumps([before, sizes, plugins]))")
+        self.assertEqual(state, [[], [[30, 20], [30, 20]], []])
+
+    def test_orientation_transposes_match_pillow(self):
+        """
+        Tests the plain-int transposes against Pillow's names for them.
+        """
+        self.assertEqual({orientation: Image.Transpose(method).name
+                          for orientation, method in ORIENTATION_TRANSPOSE.items()},
+                         {2: 'FLIP_LEFT_RIGHT', 3: 'ROTATE_180', 4: 'FLIP_TOP_BOTTOM', 5: 'TRANSPOSE',
+                          6: 'ROTATE_270', 7: 'TRANSVERSE', 8: 'ROTATE_90'})
+
+    def test_lazy_module(self):
+        """
+        Tests that a LazyModule imports and sets up its module on first attribute access only.
+        """
+        setups = []
+        module = LazyModule('json', setup=setups.append)
+        self.assertEqual(setups, [])
+        self.assertEqual(module.dumps([1]), '[1]')
+        self.assertEqual(module.loads('2'), 2)
+        self.assertEqual(len(setups), 1)
+        self.assertFalse(hasattr(module, '__wrapped__'))
+
+if __name__ == '__main__':
+    unittest.main()
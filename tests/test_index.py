@@ -0,0 +1,113 @@
+import unittest
+import os
+import shutil
+import tempfile
+from unittest import mock
+from PIL import Image
+from photogrid.image_utils import analyze_images
+from photogrid.image_utils import scan_images
+from photogrid.index import ImageIndex, analyze_images_cached, scan_images_cached
+
+class TestImageIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.index_path = os.path.join(self.test_dir, "index.sqlite3")
+        self.create_test_image(os.path.join(self.test_dir, "h1.jpg"), 400, 300)
+        self.create_test_image(os.path.join(self.test_dir, "v1.jpg"), 300, 400)
+        self.create_test_image(os.path.join(self.test_dir, "square.jpg"), 500, 500)
+        with open(os.path.join(self.test_dir, "broken.jpg"), "w") as f:
+            f.write("not an image")
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def create_test_image(self, path, width, height):
+        img = Image.new('RGB', (width, height), color = 'red')
+        img.save(path)
+
+    def test_scan_matches_analyze_images(self):
+        """
+        Tests that an indexed scan returns the same results as a plain scan,
+        both when the index is cold and when it is warm.
+        """
+        expected = analyze_images(self.test_dir)
+        with ImageIndex(self.index_path) as index:
+            self.assertEqual(index.scan(self.test_dir), expected)
+            self.assertEqual(index.scan(self.test_dir), expected)
+            self.assertEqual(len(index), 4)
+
+    def test_rescan_only_reads_changed_files(self):
+        """
+        Tests that unchanged files are served from the index, also after reopening it.
+        """
+        with ImageIndex(self.index_path) as index:
+            index.scan(self.test_dir)
+
+        changed = os.path.join(self.test_dir, "h1.jpg")
+        self.create_test_image(changed, 600, 300)
+        os.utime(changed, ns=(1, 1))
+
+        with ImageIndex(self.index_path) as index:
+            with mock.patch('photogrid.index.probe_images', wraps=lambda paths, *args: [(600, 300, 1)]) as probe:
+                horizontal, vertical = index.scan(self.test_dir)
+            probe.assert_called_once()
+            self.assertEqual(probe.call_args[0][0], [changed])
+            self.assertEqual((horizontal[0].width, horizontal[0].height), (600, 300))
+            self.assertEqual(index.get(changed), (600, 300, 1))
+
+    def test_invalidate_and_compact(self):
+        """
+        Tests that invalidated entries are re-read and compact drops deleted files.
+        """
+        with ImageIndex(self.index_path) as index:
+            index.scan(self.test_dir)
+            self.assertEqual(index.invalidate([os.path.join(self.test_dir, "v1.jpg")]), 1)
+            self.assertIsNone(index.get(os.path.join(self.test_dir, "v1.jpg")))
+
+            os.remove(os.path.join(self.test_dir, "square.jpg"))
+            self.assertEqual(index.compact(), 1)
+            self.assertEqual(len(index), 2)
+
+            self.assertEqual(index.invalidate(), 2)
+            self.assertEqual(len(index), 0)
+
+    def test_schema_change_clears_every_table(self):
+        """
+        Tests that an index of another schema version keeps none of its entries.
+        """
+        path = os.path.join(self.test_dir, "h1.jpg")
+        with ImageIndex(self.index_path) as index:
+            index.scan(self.test_dir)
+            index.put_crops({path: (0, 0, 300, 300)}, 1.0)
+            index.put_hashes({path: (2 ** 63 + 5, 1.5)})
+            self.assertEqual(index.get_hashes([path]), {path: (2 ** 63 + 5, 1.5)})
+            index.connection.execute("PRAGMA user_version = 0")
+
+        with ImageIndex(self.index_path) as index:
+            self.assertEqual(len(index), 0)
+            self.assertEqual(index.get_crops([path], 1.0), {})
+            self.assertEqual(index.get_hashes([path]), {})
+
+    def test_analyze_images_cached_uses_sidecar(self):
+        """
+        Tests that the default index lives next to the images and is not scanned itself.
+        """
+        self.assertEqual(analyze_images_cached(self.test_dir), analyze_images(self.test_dir))
+        self.assertTrue(os.path.exists(os.path.join(self.test_dir, ".photogrid_index.sqlite3")))
+
+    def test_streamed_scan_covers_subfolders(self):
+        """
+        Tests that a streamed indexed scan of a tree matches scan_images, cold and warm.
+        """
+        os.makedirs(os.path.join(self.test_dir, "sub"))
+        self.create_test_image(os.path.join(self.test_dir, "sub", "h2.png"), 300, 200)
+        expected = list(scan_images(self.test_dir, recursive=True))
+        self.assertEqual(len(expected), 3)
+        self.assertEqual(list(scan_images_cached(self.test_dir, recursive=True)), expected)
+        with mock.patch('photogrid.index.probe_images') as probe:
+            self.assertEqual(list(scan_images_cached(self.test_dir, recursive=True)), expected)
+        probe.assert_not_called()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,8 @@
 import unittest
+import random
 from photogrid.image_utils import ImageInfo
-from photogrid.layout import calculate_target_sizes, build_rows, justify_row
+from photogrid.layout import calculate_target_sizes, build_rows, justify_row, scale_layout, partition_rows, justified_layout
+from photogrid.engine import search_layout, layout_coverage
 
 class TestLayout(unittest.TestCase):
 
@@ -79,5 +81,58 @@ class TestLayout(unittest.TestCase):
         self.assertEqual(len(positions), 1)
         self.assertAlmostEqual(positions[0]['x'], 0)
 
+    def test_scale_layout(self):
+        """
+        Tests that scaling a layout scales positions and sizes but keeps other keys.
+        """
+        layout = [{'path': 'a.jpg', 'x': 100, 'y': 50, 'width': 400, 'height': 300}]
+        scaled = scale_layout(layout, 0.5)
+        self.assertEqual(scaled, [{'path': 'a.jpg', 'x': 50, 'y': 25, 'width': 200, 'height': 150}])
+        self.assertEqual(layout[0]['x'], 100)
+
+    def test_partition_rows(self):
+        """
+        Tests that the row partition matches the target height where possible.
+        """
+        # Rows of two 1.5 images are exactly 100 high at width 300 without spacing.
+        self.assertEqual(partition_rows([1.5] * 6, 300, 100, 0), [0, 2, 4])
+        # A lone wide image is better on its own than squeezed next to another.
+        self.assertEqual(partition_rows([3.0, 1.5, 1.5], 300, 100, 0), [0, 1])
+        self.assertEqual(partition_rows([], 300, 100, 0), [])
+
+    def test_justified_layout(self):
+        """
+        Tests that justified rows fill the width, stay inside the canvas and
+        beat the greedy search on coverage for a mixed set.
+        """
+        rng = random.Random(5)
+        images = []
+        for i in range(150):
+            aspect_ratio = rng.choice([rng.uniform(1.2, 1.8), rng.uniform(0.5, 0.8)])
+            images.append(ImageInfo(path=f'{i}.jpg', width=1000, height=1000 / aspect_ratio, aspect_ratio=aspect_ratio))
+
+        layout = justified_layout(images, 1920, 1080, 10)
+        self.assertEqual([placement['path'] for placement in layout], [img.path for img in images])
+        for placement in layout:
+            self.assertLessEqual(placement['x'] + placement['width'], 1920 + 1e-6)
+            self.assertLessEqual(placement['y'] + placement['height'], 1080 + 1e-6)
+            self.assertAlmostEqual(placement['width'] / placement['height'],
+                                   images[int(placement['path'][:-4])].aspect_ratio)
+
+        # Also where the rows are scaled down to fit a short canvas
+        for canvas_h, count in ((1080, 150), (200, 12), (150, 1)):
+            rows = {}
+            for placement in justified_layout(images[:count], 1920, canvas_h, 10):
+                self.assertLessEqual(placement['y'] + placement['height'], canvas_h + 1e-6)
+                rows.setdefault(placement['y'], []).append(placement)
+            for row in rows.values():
+                self.assertAlmostEqual(row[0]['x'] + row[-1]['x'] + row[-1]['width'], 1920, places=6)
+                if len(row) > 1:
+                    self.assertAlmostEqual(row[0]['x'], 0)
+
+        greedy = search_layout(images, 1920, 1080, 10, 50, False)
+        self.assertGreater(layout_coverage(layout, 1920, 1080), layout_coverage(greedy, 1920, 1080))
+        self.assertEqual(search_layout(images, 1920, 1080, 10, 50, False, mode='justified'), layout)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,102 @@
+import unittest
+import os
+import shutil
+import tempfile
+from photogrid.catalog import ImageCatalog
+from photogrid.image_utils import ImageInfo
+from photogrid.engine import seeded_layout, search_layout, shuffled
+from photogrid.layout_cache import LayoutCache, image_fingerprint, layout_key
+from photogrid.session import CollageSession
+
+def make_images(count):
+    return [ImageInfo(f'img{i}.jpg', 400, 300, 4 / 3) if i % 3 else ImageInfo(f'img{i}.jpg', 300, 400, 3 / 4)
+            for i in range(count)]
+
+class TestLayoutCache(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.test_dir, 'layouts')
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_fingerprint_and_key(self):
+        """
+        Tests that the key changes with the images and every layout parameter,
+        except max spacing in justified mode.
+        """
+        images = make_images(10)
+        fingerprint = image_fingerprint(images)
+        self.assertEqual(fingerprint, image_fingerprint(list(images)))
+        self.assertNotEqual(fingerprint, image_fingerprint(images[:-1]))
+        self.assertNotEqual(fingerprint, image_fingerprint(images[:-1] + [images[-1]._replace(width=401)]))
+
+        base = ((1920, 1080), 10, 50, False, 'greedy', 1)
+        key = layout_key(fingerprint, *base)
+        for i, value in enumerate(((1920, 1000), 5, 40, True, 'justified', 2)):
+            changed = list(base)
+            changed[i] = value
+            self.assertNotEqual(layout_key(fingerprint, *changed), key)
+        self.assertEqual(layout_key(fingerprint, (1920, 1080), 10, 50, False, 'justified', 1),
+                         layout_key(fingerprint, (1920, 1080), 10, 20, False, 'justified', 1))
+
+    def test_seeded_layout_is_cached_on_disk(self):
+        """
+        Tests that a seeded layout equals the searched one and is found again by a new cache on the same folder.
+        """
+        images = make_images(40)
+        expected = search_layout(shuffled(images, 7), 1920, 1080, 10, 50, False)
+        layout = seeded_layout(images, 1920, 1080, 10, 50, False, 7, cache=LayoutCache(cache_dir=self.cache_dir))
+        self.assertEqual(layout, expected)
+
+        cache = LayoutCache(cache_dir=self.cache_dir)
+        self.assertEqual(seeded_layout(images, 1920, 1080, 10, 50, False, 7, cache=cache), expected)
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+
+        seeded_layout(images, 1920, 1080, 10, 50, False, None, cache=cache)
+        self.assertEqual((cache.hits, cache.misses), (1, 0), "unseeded layouts are not cached")
+
+    def test_listing_order_does_not_matter(self):
+        """
+        Tests that the same set listed in two orders gets the same seeded layout and cache entry.
+        """
+        images = make_images(40)
+        listed = images[1::2] + images[::2]
+        self.assertEqual(image_fingerprint(listed), image_fingerprint(images))
+        self.assertEqual(shuffled(listed, 3), shuffled(images, 3))
+        self.assertEqual(list(shuffled(ImageCatalog.from_infos(listed), 3)), shuffled(images, 3))
+
+        cache = LayoutCache(cache_dir=self.cache_dir)
+        layout = seeded_layout(images, 1920, 1080, 10, 50, False, 3, cache=cache)
+        self.assertEqual(seeded_layout(listed, 1920, 1080, 10, 50, False, 3, cache=cache), layout)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_corrupt_entries_are_misses(self):
+        """
+        Tests that an unreadable disk entry is treated as missing and replaced.
+        """
+        images = make_images(5)
+        cache = LayoutCache(cache_dir=self.cache_dir)
+        key = layout_key(image_fingerprint(images), (800, 600), 10, 50, False, 'greedy', 1)
+        os.makedirs(os.path.dirname(cache._disk_path(key)))
+        with open(cache._disk_path(key), 'wb') as f:
+            f.write(b'not a layout')
+        self.assertIsNone(cache.get(key))
+        layout = cache.get_or_compute(key, lambda: search_layout(shuffled(images, 1), 800, 600, 10, 50, False))
+        self.assertEqual(LayoutCache(cache_dir=self.cache_dir).get(key), layout)
+
+    def test_session_reuses_cached_layouts(self):
+        """
+        Tests that a new session with the same images, parameters and seed skips the search.
+        """
+        images = make_images(30)
+        cache = LayoutCache()
+        first = CollageSession(layout_cache=cache, images=images, seed=3)
+        layout = first.layout()
+        second = CollageSession(layout_cache=cache, images=list(images), seed=3)
+        self.assertEqual(second.layout(), layout)
+        self.assertNotIn('search', second.recomputed)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+import os
+from photogrid.catalog import ImageCatalog
+from photogrid.pages import page_path, page_report_path, paginate
+
+class TestPages(unittest.TestCase):
+
+    def test_paginate_balances_aspect_ratios(self):
+        """
+        Tests that pages keep file name order and hold about equal summed aspect ratios.
+        """
+        # Landscape photos first, as the scans list them, then portraits
+        names = [f'img_{i:03d}.jpg' for i in range(100)]
+        landscapes = [name for i, name in enumerate(names) if i % 4 == 0]
+        portraits = [name for i, name in enumerate(names) if i % 4]
+        paths = landscapes + portraits
+        widths = [3000] * len(landscapes) + [1000] * len(portraits)
+        images = ImageCatalog(paths, widths, [1000] * len(landscapes) + [3000] * len(portraits))
+
+        pages = paginate(images, 30)
+        self.assertEqual(len(pages), 4)
+        self.assertEqual([path for page in pages for path in page.paths], names)
+        totals = [page.aspect_ratios.sum() for page in pages]
+        # At most one landscape photo apart, out of about 33 each
+        self.assertLessEqual(max(totals) - min(totals), 3)
+
+        cropped = paginate(images, 30, is_cropping=True)
+        self.assertEqual([len(page) for page in cropped], [25, 25, 25, 25])
+        self.assertEqual(paginate(images, 1000)[0].paths, names)
+        self.assertEqual(paginate([], 10), [])
+        with self.assertRaises(ValueError):
+            paginate(images, 0)
+
+    def test_paginate_never_leaves_a_page_empty(self):
+        """
+        Tests that one very wide image does not leave the pages around it empty.
+        """
+        images = ImageCatalog(['a.jpg', 'b.jpg', 'c.jpg', 'd.jpg'], [100, 100, 100, 10000], [100, 100, 100, 100])
+        self.assertEqual([page.paths for page in paginate(images, 1)],
+                         [['a.jpg'], ['b.jpg'], ['c.jpg'], ['d.jpg']])
+
+    def test_page_paths(self):
+        out = os.path.join('out', 'archive.jpg')
+        self.assertEqual(page_path(out, 6, 84), os.path.join('out', 'archive_007.jpg'))
+        self.assertEqual(page_path(out, 0, 1200), os.path.join('out', 'archive_0001.jpg'))
+        self.assertEqual(page_report_path(out), os.path.join('out', 'archive_pages.json'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+import unittest
+import os
+import shutil
+import tempfile
+from PIL import Image, ImageOps, ImageChops, ImageStat
+from photogrid.image_utils import crop_to_aspect_ratio
+from photogrid.render import render_tile, render_collage, render_preview, render_proxy_tile, progressive_preview
+
+class TestRenderTile(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        # An asymmetric image so that wrong rotations or flips show up
+        self.source = Image.linear_gradient('L').resize((640, 400)).convert('RGB')
+        self.source.paste((255, 0, 0), (0, 0, 100, 60))
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def save_with_orientation(self, orientation):
+        path = os.path.join(self.test_dir, f"o{orientation}.jpg")
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        self.source.save(path, exif=exif, quality=95)
+        return path
+
+    def reference_tile(self, path, size, crop_aspect_ratio):
+        with Image.open(path) as img:
+            img = ImageOps.exif_transpose(img)
+            if crop_aspect_ratio:
+                img = crop_to_aspect_ratio(img, crop_aspect_ratio)
+            return img.resize(size, Image.Resampling.LANCZOS)
+
+    def test_render_tile_matches_full_decode(self):
+        """
+        Tests that the fused draft/crop/resize/orient path matches the step-by-step
+        full-resolution pipeline for every orientation and crop mode.
+        """
+        for orientation in range(1, 9):
+            path = self.save_with_orientation(orientation)
+            for crop_aspect_ratio in (None, 16 / 9, 0.5):
+                for size in ((120, 80), (80, 120)):
+                    tile = render_tile(path, size, crop_aspect_ratio)
+                    expected = self.reference_tile(path, size, crop_aspect_ratio)
+                    self.assertEqual(tile.size, size)
+                    diff = ImageStat.Stat(ImageChops.difference(tile, expected)).mean
+                    self.assertLess(max(diff), 6, f"orientation {orientation}, crop {crop_aspect_ratio}, size {size}")
+
+    def test_render_tile_without_draft(self):
+        """
+        Tests that disabling draft decoding still produces a tile of the requested size.
+        """
+        path = self.save_with_orientation(6)
+        tile = render_tile(path, (50, 80), draft=False)
+        self.assertEqual(tile.size, (50, 80))
+
+    def test_parallel_collage_matches_serial(self):
+        """
+        Tests that the multi-process renderer produces the same bytes as the serial
+        path, including tiles that are clipped by the canvas edge.
+        """
+        layout = []
+        for i, orientation in enumerate((1, 3, 6, 8)):
+            path = self.save_with_orientation(orientation)
+            layout.append({'path': path, 'x': 10 + i * 75.6, 'y': 5.5, 'width': 70.9, 'height': 50.2})
+        layout.append({'path': layout[0]['path'], 'x': 280, 'y': 60, 'width': 80, 'height': 80})
+
+        serial = render_collage(layout, (320, 120), '#336699', 4 / 3, workers=1)
+        parallel = render_collage(layout, (320, 120), '#336699', 4 / 3, workers=2)
+        self.assertEqual(serial.size, (320, 120))
+        self.assertEqual(serial.tobytes(), parallel.tobytes())
+
+    def test_render_preview_matches_downscaled_render(self):
+        """
+        Tests that rendering at preview resolution fits the preview box and looks
+        like the full render shrunk with thumbnail().
+        """
+        path = self.save_with_orientation(1)
+        layout = [{'path': path, 'x': 0, 'y': 0, 'width': 960, 'height': 600},
+                  {'path': path, 'x': 980, 'y': 0, 'width': 640, 'height': 400}]
+
+        preview = render_preview(layout, (1620, 600), (405, 300), 'white')
+        self.assertEqual(preview.size, (405, 150))
+
+        expected = render_collage(layout, (1620, 600), 'white')
+        expected.thumbnail((405, 300), Image.Resampling.LANCZOS)
+        diff = ImageStat.Stat(ImageChops.difference(preview, expected)).mean
+        self.assertLess(max(diff), 8)
+
+    def test_proxy_tile_approximates_tile(self):
+        """
+        Tests that draft tiles have the tile's size and orientation, both from the
+        1/8 scale decode and from an embedded EXIF thumbnail.
+        """
+        for orientation in (1, 6):
+            path = self.save_with_orientation(orientation)
+            for size in ((40, 30), (30, 40)):
+                proxy = render_proxy_tile(path, size, 1.0)
+                self.assertEqual(proxy.size, size)
+                diff = ImageStat.Stat(ImageChops.difference(proxy, render_tile(path, size, 1.0))).mean
+                self.assertLess(max(diff), 12)
+
+        path = os.path.join(os.path.dirname(__file__), '..', 'test-images', '1991_0046.jpg')
+        proxy = render_proxy_tile(path, (60, 84))
+        diff = ImageStat.Stat(ImageChops.difference(proxy, render_tile(path, (60, 84)).convert(proxy.mode))).mean
+        self.assertLess(max(diff), 12)
+
+    def test_progressive_preview_ends_with_the_full_preview(self):
+        """
+        Tests that the passes come in order and the last canvas equals render_preview.
+        """
+        path = self.save_with_orientation(8)
+        layout = [{'path': path, 'x': i * 410, 'y': 0, 'width': 400, 'height': 250} for i in range(4)]
+        layout.append({'path': os.path.join(self.test_dir, 'missing.jpg'), 'x': 0, 'y': 260, 'width': 0, 'height': 0})
+
+        passes = []
+        canvas = None
+        for canvas, name, done, total in progressive_preview(layout, (1630, 260), (400, 300), 'white', 4 / 3,
+                                                             interval=0):
+            passes.append((name, done, total))
+        self.assertEqual(passes[0], ('placeholder', 0, 4))
+        self.assertEqual([name for name, _, _ in passes], ['placeholder'] + ['draft'] * 4 + ['refine'] * 4)
+        self.assertEqual(passes[-1], ('refine', 4, 4))
+        self.assertEqual(canvas.tobytes(), render_preview(layout, (1630, 260), (400, 300), 'white', 4 / 3).tobytes())
+
+    def test_progress_callback_can_abort(self):
+        """
+        Tests that render progress is reported per tile and that raising from the
+        callback stops the render.
+        """
+        path = self.save_with_orientation(1)
+        layout = [{'path': path, 'x': i * 20, 'y': 0, 'width': 20, 'height': 20} for i in range(4)]
+
+        calls = []
+        render_collage(layout, (80, 20), progress=lambda done, total: calls.append((done, total)))
+        self.assertEqual(calls, [(1, 4), (2, 4), (3, 4), (4, 4)])
+
+        def abort(done, total):
+            raise KeyboardInterrupt
+
+        for workers in (1, 2):
+            with self.assertRaises(KeyboardInterrupt):
+                render_collage(layout, (80, 20), workers=workers, progress=abort)
+
+if __name__ == '__main__':
+    unittest.main()
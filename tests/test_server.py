@@ -0,0 +1,162 @@
+import unittest
+import asyncio
+import http.client
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from PIL import Image
+from photogrid import server
+from photogrid.server import RenderService
+
+class TestRenderService(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.folder = os.path.join(self.test_dir, 'photos')
+        os.makedirs(os.path.join(self.folder, 'more'))
+        for i, size in enumerate([(400, 300), (300, 400), (600, 400), (400, 600)]):
+            Image.new('RGB', size, (60 * i, 100, 200)).save(os.path.join(self.folder, f'{i}.jpg'))
+        Image.new('RGB', (500, 300), 'green').save(os.path.join(self.folder, 'more', 'nested.png'))
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.service = None
+
+    def tearDown(self):
+        if self.service is not None:
+            self.call(self.service.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        shutil.rmtree(self.test_dir)
+
+    def call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(timeout=30)
+
+    def start(self, **kwargs):
+        if 'executor' in kwargs:
+            self.addCleanup(kwargs['executor'].shutdown)
+        self.service = RenderService(**kwargs)
+        self.host, self.port = self.call(self.service.start('127.0.0.1', 0))
+
+    def request(self, method, path, params=None):
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        body = json.dumps(params).encode('utf-8') if params is not None else None
+        connection.request(method, path, body=body, headers={'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        result = (response.status, dict(response.getheaders()), response.read())
+        connection.close()
+        return result
+
+    def test_scan_layout_and_render(self):
+        """
+        Tests the three endpoints end to end on a real process pool.
+        """
+        self.start(workers=1)
+        status, headers, body = self.request('POST', '/scan', {'folder': self.folder})
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)['count'], 5)
+        self.assertIn('probe;dur=', headers['Server-Timing'])
+
+        job = {'folder': self.folder, 'width': 800, 'height': 400, 'seed': 3}
+        status, headers, body = self.request('POST', '/layout', job)
+        self.assertEqual(status, 200)
+        result = json.loads(body)
+        self.assertEqual((result['seed'], headers['X-PhotoGrid-Seed']), (3, '3'))
+        self.assertTrue(0 < result['coverage'] <= 1)
+        self.assertEqual(len(result['layout']), 5)
+
+        status, headers, body = self.request('GET', f'/render?folder={self.folder}&width=800&height=400&seed=3'
+                                                    '&max_size=[200,200]')
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['Content-Type'], 'image/jpeg')
+        with Image.open(io.BytesIO(body)) as img:
+            self.assertEqual(img.size, (200, 100))
+        timing = headers['Server-Timing']
+        for name in ('decode', 'encode', 'job', 'total'):
+            self.assertIn(f'{name};dur=', timing)
+        self.assertNotIn('search', timing, "the seeded layout is reused from the /layout request")
+
+    def test_errors(self):
+        """
+        Tests that bad requests are answered with a JSON error and a fitting status.
+        """
+        self.start(executor=ThreadPoolExecutor(1))
+        self.assertEqual(self.request('GET', '/nothing')[0], 404)
+        self.assertEqual(self.request('DELETE', '/render')[0], 405)
+        self.assertEqual(self.request('POST', '/layout', {'width': 100})[0], 400)
+        self.assertEqual(self.request('POST', '/layout', {'folder': self.folder, 'size': 3})[0], 400)
+        self.assertEqual(self.request('POST', '/layout', {'folder': self.folder, 'width': 'wide'})[0], 400)
+        self.assertEqual(self.request('POST', '/layout', {'folder': self.folder, 'mode': 'spiral'})[0], 400)
+        status, _, body = self.request('POST', '/scan', {'folder': os.path.join(self.test_dir, 'missing')})
+        self.assertEqual(status, 404)
+        self.assertIn('error', json.loads(body))
+        self.assertEqual(self.request('GET', '/health')[0], 200)
+
+    def gate_layout_jobs(self):
+        """
+        Makes layout jobs wait until the returned event is set.
+        """
+        release = threading.Event()
+        layout_job = server.layout_job
+
+        def gated(*args):
+            release.wait(10)
+            return layout_job(*args)
+
+        patcher = mock.patch.object(server, 'layout_job', gated)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(release.set)
+        return release
+
+    def wait_until(self, condition):
+        for _ in range(500):
+            if condition():
+                return
+            threading.Event().wait(0.01)
+        self.fail("condition not reached")
+
+    def test_identical_requests_are_coalesced(self):
+        """
+        Tests that identical concurrent requests share one job and its seed.
+        """
+        self.start(executor=ThreadPoolExecutor(2))
+        release = self.gate_layout_jobs()
+        job = {'folder': self.folder, 'width': 800, 'height': 400}
+        with ThreadPoolExecutor(2) as clients:
+            first = clients.submit(self.request, 'POST', '/layout', job)
+            self.wait_until(lambda: self.service.pending == 1)
+            second = clients.submit(self.request, 'POST', '/layout', job)
+            self.wait_until(lambda: self.service.coalesced == 1)
+            release.set()
+            responses = [first.result(), second.result()]
+
+        self.assertEqual(self.service.jobs_started, 1)
+        self.assertEqual(sorted(headers['X-PhotoGrid-Coalesced'] for _, headers, _ in responses), ['0', '1'])
+        self.assertEqual(responses[0][2], responses[1][2])
+        self.assertEqual(self.service.pending, 0)
+
+    def test_backpressure(self):
+        """
+        Tests that requests beyond max_pending distinct jobs are refused with 503.
+        """
+        self.start(executor=ThreadPoolExecutor(2), max_pending=1)
+        release = self.gate_layout_jobs()
+        with ThreadPoolExecutor(1) as clients:
+            first = clients.submit(self.request, 'POST', '/layout', {'folder': self.folder, 'seed': 1})
+            self.wait_until(lambda: self.service.pending == 1)
+            status, headers, _ = self.request('POST', '/layout', {'folder': self.folder, 'seed': 2})
+            self.assertEqual(status, 503)
+            self.assertEqual(headers['Retry-After'], '1')
+            release.set()
+            self.assertEqual(first.result()[0], 200)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+from PIL import Image
+from photogrid.image_utils import ImageInfo
+from photogrid.engine import search_layout, shuffled
+from photogrid.render import render_collage, render_preview
+from photogrid.session import CollageSession
+from photogrid.tile_cache import TileCache
+
+class TestCollageSession(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.images = []
+        for i in range(12):
+            size = (300, 200) if i % 3 else (200, 300)
+            path = os.path.join(self.test_dir, f"img{i}.jpg")
+            Image.new('RGB', size, (20 * i, 255 - 20 * i, 128)).save(path)
+            self.images.append(ImageInfo(path, size[0], size[1], size[0] / size[1]))
+        self.session = CollageSession(cache=TileCache(), images=self.images, seed=3, output_size=(600, 400))
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_layout_matches_search_layout(self):
+        """
+        Tests that the session lays out the seeded shuffle as search_layout does, in both modes.
+        """
+        for mode in ('greedy', 'justified'):
+            self.session.update(mode=mode)
+            expected = search_layout(shuffled(self.images, 3), 600, 400, 10, 50, False, mode=mode)
+            self.assertEqual(self.session.layout(), expected)
+
+    def test_only_changed_stages_are_recomputed(self):
+        """
+        Tests that each parameter change recomputes only the stages depending on it.
+        """
+        self.session.layout()
+        self.assertEqual(self.session.recomputed, ['order', 'search', 'placements'])
+
+        self.session.layout()
+        self.assertEqual(self.session.recomputed, [])
+
+        self.session.update(max_space=30)
+        self.session.layout()
+        self.assertEqual(self.session.recomputed, ['placements'])
+
+        self.session.update(min_space=5)
+        self.session.layout()
+        self.assertEqual(self.session.recomputed, ['search', 'placements'])
+
+        self.session.update(seed=4)
+        self.session.layout()
+        self.assertEqual(self.session.recomputed, ['order', 'search', 'placements'])
+
+        self.session.update(mode='justified')
+        self.session.layout()
+        self.session.update(max_space=20)
+        self.session.layout()
+        self.assertEqual(self.session.recomputed, [], "max spacing does not affect justified layouts")
+
+    def test_background_change_only_recolors(self):
+        """
+        Tests that a new background color reuses the rendered preview and equals a fresh render.
+        """
+        self.session.update(min_space=20)
+        self.session.preview((300, 300))
+        self.session.update(background_color='#ff0000')
+        preview = self.session.preview((300, 300))
+        self.assertEqual(self.session.recomputed, ['preview'])
+
+        expected = render_preview(self.session.layout(), (600, 400), (300, 300), '#ff0000')
+        self.assertEqual(preview.tobytes(), expected.tobytes())
+
+    def test_progressive_frames_end_with_the_preview(self):
+        """
+        Tests that the progressive frames end with the preview, and that a kept
+        preview is yielded once without rendering.
+        """
+        frames = [(phase, canvas.copy()) for canvas, phase, _, _ in self.session.preview_frames((300, 300))]
+        self.assertEqual(frames[0][0], 'placeholder')
+        expected = render_preview(self.session.layout(), (600, 400), (300, 300))
+        self.assertEqual(frames[-1][1].tobytes(), expected.tobytes())
+
+        frames = list(self.session.preview_frames((300, 300)))
+        self.assertEqual(len(frames), 1)
+        self.assertEqual(self.session.recomputed, [])
+
+    def test_abandoned_frames_do_not_hold_the_session(self):
+        """
+        Tests that other threads can use the session while a frame generator is left unfinished.
+        """
+        frames = self.session.preview_frames((300, 300))
+        next(frames)
+        other = threading.Thread(target=lambda: self.session.update(background_color='black'))
+        other.start()
+        other.join(5)
+        self.assertFalse(other.is_alive(), "the session lock is held by the paused generator")
+        frames.close()
+
+    def test_save_reuses_the_render(self):
+        """
+        Tests that saving with another quality or color does not render the tiles again.
+        """
+        path = os.path.join(self.test_dir, 'out.jpg')
+        self.session.save(path, quality=90)
+        self.assertIn('full_tiles', self.session.recomputed)
+
+        self.session.save(path, quality=50)
+        self.assertEqual(self.session.recomputed, [])
+
+        self.session.update(background_color='black')
+        rendered = self.session.render()
+        self.assertEqual(self.session.recomputed, ['full'])
+        expected = render_collage(self.session.layout(), (600, 400), 'black')
+        self.assertEqual(rendered.tobytes(), expected.tobytes())
+
+    def test_unknown_parameter(self):
+        """
+        Tests that misspelled parameters are rejected.
+        """
+        with self.assertRaises(TypeError):
+            self.session.update(max_spacing=3)
+        with self.assertRaises(ValueError):
+            self.session.update(mode='masonry')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import unittest
+import os
+import shutil
+import tempfile
+from unittest import mock
+from PIL import Image, ImageChops, ImageStat
+from photogrid import strips
+from photogrid.render import render_collage, render_tile
+from photogrid.strips import iter_collage_strips, StripedTiffWriter, save_collage_strips
+
+class TestStripRendering(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        source = Image.linear_gradient('L').resize((640, 400)).convert('RGB')
+        source.paste((255, 0, 0), (0, 0, 100, 60))
+        self.layout = []
+        for i, orientation in enumerate((1, 3, 6, 8)):
+            path = os.path.join(self.test_dir, f"o{orientation}.jpg")
+            exif = Image.Exif()
+            exif[0x0112] = orientation
+            source.save(path, exif=exif, quality=95)
+            self.layout.append({'path': path, 'x': 10 + i * 75.6, 'y': 5.5 + i * 20, 'width': 70.9, 'height': 90.2})
+        # A tile clipped by the bottom-right corner of the canvas
+        self.layout.append({'path': self.layout[0]['path'], 'x': 280, 'y': 100, 'width': 80, 'height': 80})
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_strips_match_full_render(self):
+        """
+        Tests that stacking the strips reproduces the full-canvas render, for strips
+        that cut through tiles.
+        """
+        expected = render_collage(self.layout, (320, 150), '#336699', 4 / 3)
+        for strip_height in (1, 7, 64, 1000):
+            canvas = Image.new('RGB', (320, 150))
+            top = 0
+            for strip in iter_collage_strips(self.layout, (320, 150), '#336699', 4 / 3, strip_height):
+                self.assertEqual(strip.size[0], 320)
+                self.assertLessEqual(strip.size[1], strip_height)
+                canvas.paste(strip, (0, top))
+                top += strip.size[1]
+            self.assertEqual(top, 150)
+            diff = ImageStat.Stat(ImageChops.difference(canvas, expected)).mean
+            self.assertLess(max(diff), 1, f"strip height {strip_height}")
+
+    def test_tiles_are_rendered_once(self):
+        """
+        Tests that a tile crossing many strips is decoded once, and that tiles over
+        the held budget are still rendered correctly in slices.
+        """
+        expected = render_collage(self.layout, (320, 150), '#336699', 4 / 3)
+        for held_strips, renders in ((64, 5), (0, None)):
+            with mock.patch.object(strips, 'HELD_TILE_STRIPS', held_strips), \
+                    mock.patch.object(strips, 'render_tile', wraps=render_tile) as counted:
+                canvas = Image.new('RGB', (320, 150))
+                for i, strip in enumerate(iter_collage_strips(self.layout, (320, 150), '#336699', 4 / 3, 7)):
+                    canvas.paste(strip, (0, i * 7))
+            if renders is not None:
+                self.assertEqual(counted.call_count, renders)
+            else:
+                self.assertGreater(counted.call_count, 5)
+            diff = ImageStat.Stat(ImageChops.difference(canvas, expected)).mean
+            self.assertLess(max(diff), 1)
+
+    def test_progress_counts_every_tile_once(self):
+        calls = []
+        for _ in iter_collage_strips(self.layout, (320, 150), strip_height=16,
+                                     progress=lambda done, total: calls.append((done, total))):
+            pass
+        self.assertEqual(calls[-1], (5, 5))
+        self.assertEqual(len(calls), 5)
+
+    def test_striped_tiff_roundtrip(self):
+        """
+        Tests that the streamed TIFF decodes to the same pixels, in both compressions
+        and in the BigTIFF layout.
+        """
+        image = Image.linear_gradient('L').resize((97, 53)).convert('RGB')
+        for compression in ('deflate', 'none'):
+            for bigtiff in (False, True):
+                path = os.path.join(self.test_dir, f"{compression}{bigtiff}.tif")
+                with StripedTiffWriter(path, image.size, 10, compression, bigtiff=bigtiff) as writer:
+                    for top in range(0, 53, 10):
+                        writer.write(image.crop((0, top, 97, min(top + 10, 53))))
+                with Image.open(path) as written:
+                    self.assertEqual(written.size, (97, 53))
+                    self.assertEqual(written.convert('RGB').tobytes(), image.tobytes())
+
+    def test_writer_rejects_incomplete_image(self):
+        path = os.path.join(self.test_dir, "short.tif")
+        writer = StripedTiffWriter(path, (10, 20), 10)
+        writer.write(Image.new('RGB', (10, 10)))
+        with self.assertRaises(ValueError):
+            writer.close()
+
+    def test_save_collage_strips(self):
+        path = os.path.join(self.test_dir, "poster.tiff")
+        save_collage_strips(self.layout, path, (320, 150), 'white', strip_height=32)
+        with Image.open(path) as written:
+            self.assertEqual(written.size, (320, 150))
+        self.assertFalse(os.path.exists(path + '.part'))
+
+        with self.assertRaises(ValueError):
+            save_collage_strips(self.layout, os.path.join(self.test_dir, "poster.jpg"), (320, 150))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import unittest
+import os
+import shutil
+import tempfile
+from unittest import mock
+from PIL import Image
+from photogrid.crop import CropPlan
+from photogrid.render import render_collage, render_tile
+from photogrid.tile_cache import USAGE_FILENAME, TileCache
+
+LANCZOS = Image.Resampling.LANCZOS
+
+class TestTileCache(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.test_dir, 'cache')
+        self.path = os.path.join(self.test_dir, 'a.jpg')
+        Image.linear_gradient('L').resize((320, 200)).convert('RGB').save(self.path)
+        self.renders = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def render(self, size, crop_aspect_ratio=None):
+        def render():
+            self.renders += 1
+            return render_tile(self.path, size, crop_aspect_ratio, LANCZOS)
+        return render
+
+    def test_memory_tier_reuses_tiles(self):
+        cache = TileCache()
+        first = cache.get_tile(self.path, (40, 25), None, LANCZOS, self.render((40, 25)))
+        second = cache.get_tile(self.path, (40, 25), None, LANCZOS, self.render((40, 25)))
+        self.assertEqual(self.renders, 1)
+        self.assertEqual(first.tobytes(), second.tobytes())
+
+        # Any change of size or crop is a different tile
+        cache.get_tile(self.path, (40, 24), None, LANCZOS, self.render((40, 24)))
+        cache.get_tile(self.path, (40, 25), 1.0, LANCZOS, self.render((40, 25), 1.0))
+        self.assertEqual(self.renders, 3)
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+
+    def test_memory_budget_evicts_least_recently_used(self):
+        cache = TileCache(memory_bytes=2 * 10 * 10 * 3)
+        cache.get_tile(self.path, (10, 10), None, LANCZOS, self.render((10, 10)))
+        cache.get_tile(self.path, (10, 10), 1.0, LANCZOS, self.render((10, 10), 1.0))
+        cache.get_tile(self.path, (10, 10), None, LANCZOS, self.render((10, 10)))  # Refresh the first
+        cache.get_tile(self.path, (10, 10), 2.0, LANCZOS, self.render((10, 10), 2.0))
+        self.assertEqual(len(cache), 2)
+        self.assertIsNotNone(cache.memory_tile(self.path, (10, 10), None, LANCZOS))
+        self.assertIsNone(cache.memory_tile(self.path, (10, 10), 1.0, LANCZOS))
+
+    def test_disk_tier_survives_a_new_cache(self):
+        TileCache(cache_dir=self.cache_dir).get_tile(self.path, (40, 25), None, LANCZOS, self.render((40, 25)))
+        cache = TileCache(memory_bytes=0, cache_dir=self.cache_dir)
+        tile = cache.get_tile(self.path, (40, 25), None, LANCZOS, self.render((40, 25)))
+        self.assertEqual(self.renders, 1)
+        self.assertEqual(tile.size, (40, 25))
+
+    def test_disk_tier_with_content_crop(self):
+        """
+        Tests that content-aware tiles, with and without a planned box, are read back by a new cache.
+        """
+        for plan in (CropPlan(1.0, {self.path: (60, 0, 260, 200)}), CropPlan(1.0)):
+            self.renders = 0
+            TileCache(cache_dir=self.cache_dir).get_tile(self.path, (30, 30), plan, LANCZOS,
+                                                         self.render((30, 30), plan))
+            cache = TileCache(memory_bytes=0, cache_dir=self.cache_dir)
+            tile = cache.get_tile(self.path, (30, 30), plan, LANCZOS, self.render((30, 30), plan))
+            self.assertEqual(self.renders, 1)
+            self.assertEqual((cache.hits, cache.misses), (1, 0))
+            self.assertEqual(tile.size, (30, 30))
+
+    def test_modified_source_is_rendered_again(self):
+        cache = TileCache(cache_dir=self.cache_dir)
+        cache.get_tile(self.path, (40, 25), None, LANCZOS, self.render((40, 25)))
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        cache.get_tile(self.path, (40, 25), None, LANCZOS, self.render((40, 25)))
+        self.assertEqual(self.renders, 2)
+
+    def test_disk_budget_is_enforced(self):
+        cache = TileCache(memory_bytes=0, cache_dir=self.cache_dir, disk_bytes=3 * 10 * 10 * 3)
+        for crop_aspect_ratio in (0.5, 1.0, 1.5, 2.0, 2.5):
+            cache.get_tile(self.path, (10, 10), crop_aspect_ratio, LANCZOS, self.render((10, 10), crop_aspect_ratio))
+        used = sum(os.path.getsize(os.path.join(root, name))
+                   for root, _, files in os.walk(self.cache_dir) for name in files if name.endswith('.rgb'))
+        self.assertLessEqual(used, 3 * 10 * 10 * 3)
+
+    def test_disk_total_is_kept_across_caches(self):
+        """
+        Tests that a new cache adds to the stored disk total instead of counting the directory again.
+        """
+        TileCache(cache_dir=self.cache_dir).get_tile(self.path, (10, 10), None, LANCZOS, self.render((10, 10)))
+        cache = TileCache(memory_bytes=0, cache_dir=self.cache_dir)
+        with mock.patch.object(cache, '_disk_entries', side_effect=AssertionError("directory walked")):
+            cache.get_tile(self.path, (20, 10), None, LANCZOS, self.render((20, 10)))
+        with open(os.path.join(self.cache_dir, USAGE_FILENAME)) as f:
+            self.assertEqual(int(f.read()), 10 * 10 * 3 + 20 * 10 * 3)
+
+    def test_cached_collage_matches_uncached(self):
+        """
+        Tests that serial and parallel renders through a warm cache give the same
+        bytes as an uncached render.
+        """
+        layout = [{'path': self.path, 'x': i * 45, 'y': 3, 'width': 40, 'height': 25} for i in range(4)]
+        layout.append({'path': self.path, 'x': 170, 'y': 20, 'width': 30, 'height': 30})
+        expected = render_collage(layout, (190, 40), 'black')
+
+        cache = TileCache(cache_dir=self.cache_dir)
+        for workers in (1, 2, 1, 2):
+            rendered = render_collage(layout, (190, 40), 'black', workers=workers, cache=cache)
+            self.assertEqual(rendered.tobytes(), expected.tobytes())
+        self.assertGreater(cache.hits, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+import os
+import pstats
+import shutil
+import tempfile
+from PIL import Image
+from photogrid.batch import CollageJob, run_manifest
+from photogrid.render import render_collage
+from photogrid.timing import Timings, recording, stage, profiling
+
+class TestTiming(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.test_dir, 'a.jpg')
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        Image.new('RGB', (60, 40), 'red').save(self.path, exif=exif)
+        self.layout = [{'path': self.path, 'x': i * 25, 'y': 0, 'width': 20, 'height': 30} for i in range(3)]
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_stages_are_recorded_only_while_recording(self):
+        with stage('scan') as record:
+            record.count = 5  # No active Timings: nothing to record into
+
+        calls = []
+        with recording(Timings(hook=lambda *args: calls.append(args))) as timings:
+            with stage('scan') as record:
+                record.count = 5
+            with stage('encode', nbytes=100):
+                pass
+            with stage('encode', nbytes=50):
+                pass
+        with stage('scan'):
+            pass
+
+        stages = timings.as_dict()
+        self.assertEqual(set(stages), {'scan', 'encode'})
+        self.assertEqual(stages['scan'][1], 5)
+        self.assertEqual(stages['encode'][1:], (2, 150))
+        self.assertEqual([call[0] for call in calls], ['scan', 'encode', 'encode'])
+        self.assertTrue(timings.summary().startswith('scan '))
+
+    def test_render_stages_include_worker_processes(self):
+        """
+        Tests that tiles rendered in worker processes report their stages back.
+        """
+        for workers in (1, 2):
+            with recording() as timings:
+                render_collage(self.layout, (80, 30), workers=workers)
+            stages = timings.as_dict()
+            for name in ('decode', 'resample', 'orient', 'paste'):
+                self.assertEqual(stages[name][1], 3, f"{name} with {workers} workers")
+
+    def test_batch_timings_and_cprofile(self):
+        output = os.path.join(self.test_dir, 'out.jpg')
+        stats_path = os.path.join(self.test_dir, 'run.prof')
+        timings = Timings()
+        with profiling(stats_path):
+            counts = run_manifest([CollageJob(folder=self.test_dir, output=output, width=200, height=100)],
+                                  workers=0, timings=timings, report=lambda line: None)
+        self.assertEqual(counts['done'], 1)
+        self.assertTrue({'scan', 'probe', 'search', 'decode', 'encode'} <= set(timings.as_dict()))
+        self.assertGreater(pstats.Stats(stats_path).total_calls, 0)
+
+if __name__ == '__main__':
+    unittest.main()
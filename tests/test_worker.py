@@ -0,0 +1,86 @@
+import unittest
+import threading
+import time
+from photogrid.worker import BackgroundWorker
+
+class TestBackgroundWorker(unittest.TestCase):
+
+    def wait_for(self, worker, condition, timeout=5):
+        deadline = time.time() + timeout
+        while not condition():
+            self.assertLess(time.time(), deadline, "worker did not finish in time")
+            worker.poll()
+            time.sleep(0.01)
+
+    def test_callbacks_run_on_polling_thread(self):
+        """
+        Tests that progress and results are delivered through poll() on the caller's thread.
+        """
+        worker = BackgroundWorker()
+        events = []
+
+        def work(job, n):
+            for i in range(n):
+                job.report_progress(i + 1, n, "working")
+            return n * 2
+
+        worker.submit(work, 3,
+                      on_done=lambda result: events.append(('done', result, threading.current_thread())),
+                      on_progress=lambda done, total, message: events.append(('progress', done, total)))
+        self.wait_for(worker, lambda: not worker.busy)
+
+        self.assertEqual(events[:3], [('progress', 1, 3), ('progress', 2, 3), ('progress', 3, 3)])
+        self.assertEqual(events[3][:2], ('done', 6))
+        self.assertIs(events[3][2], threading.current_thread())
+
+    def test_partial_results_arrive_before_the_result(self):
+        worker = BackgroundWorker()
+        events = []
+
+        def work(job):
+            job.report_partial('draft')
+            job.report_partial('refined')
+            return 'final'
+
+        worker.submit(work, on_done=events.append, on_partial=lambda result: events.append(('partial', result)))
+        self.wait_for(worker, lambda: not worker.busy)
+        self.assertEqual(events, [('partial', 'draft'), ('partial', 'refined'), 'final'])
+
+    def test_new_job_cancels_running_job(self):
+        """
+        Tests that submitting a job cancels the previous one and drops its callbacks.
+        """
+        worker = BackgroundWorker()
+        started = threading.Event()
+        finished = []
+
+        def slow(job):
+            started.set()
+            while True:
+                job.check_cancelled()
+                time.sleep(0.01)
+
+        first = worker.submit(slow, on_done=lambda result: finished.append('slow'))
+        started.wait(5)
+        worker.submit(lambda job: 'fast', on_done=finished.append)
+        self.wait_for(worker, lambda: not worker.busy)
+
+        self.assertTrue(first.cancelled)
+        self.assertEqual(finished, ['fast'])
+
+    def test_errors_are_reported(self):
+        """
+        Tests that an exception in a job is passed to on_error.
+        """
+        worker = BackgroundWorker()
+        errors = []
+
+        def fail(job):
+            raise ValueError("boom")
+
+        worker.submit(fail, on_error=errors.append)
+        self.wait_for(worker, lambda: not worker.busy)
+        self.assertIsInstance(errors[0], ValueError)
+
+if __name__ == '__main__':
+    unittest.main()